@@ -16,10 +16,55 @@ import json
 from collections import defaultdict
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Set, Tuple
+from typing import Dict, Iterator, List, Set, Tuple
 
 import numpy as np
 
+from gemini_api import predictions as prediction_store
+
+
+def _check_single_model(predictions_dir: Path, tags: Set[str]):
+    if len(tags) > 1:
+        raise ValueError(f"Predictions from several models in {predictions_dir} ({', '.join(sorted(tags))}); "
+                         f"pick one with model_tag")
+
+
+def prediction_files(predictions_dir: Path, model_tag: str = None) -> List[Path]:
+    """
+    Prediction files in a directory, named {image_name}__{model_tag}__v{version}.json
+    (e.g. frame__g25flash__v3.0.json). With no model_tag the directory must hold a single
+    model's predictions; mixing models would silently overwrite one with another.
+    """
+    files = sorted(predictions_dir.glob(f"*__{model_tag or '*'}__v*.json"))
+    _check_single_model(predictions_dir, {f.stem.split("__")[-2] for f in files})
+    return files
+
+
+def iter_predictions(predictions_dir: Path, model_tag: str = None) -> Iterator[Tuple[str, Dict]]:
+    """
+    (image_name, prediction) pairs from a run directory: the per-image JSON files, then
+    the records of predictions.jsonl, streamed line by line. An image seen twice keeps
+    its last record when collected into a dict.
+    """
+    files = prediction_files(predictions_dir, model_tag)
+    tags = {f.stem.split("__")[-2] for f in files}
+    for pred_file in files:
+        # Format: {image_name}__g25flash__v3.0.json
+        with open(pred_file, 'r') as f:
+            yield pred_file.stem.split("__")[0] + ".png", json.load(f)
+
+    jsonl_path = predictions_dir / prediction_store.FILENAME
+    if not jsonl_path.exists():
+        return
+    for record in prediction_store.read_predictions(jsonl_path):
+        meta = record["_meta"]
+        tag = prediction_store.model_tag(meta["model"])
+        if model_tag and tag != model_tag:
+            continue
+        tags.add(tag)
+        _check_single_model(predictions_dir, tags)
+        yield Path(meta["source_image"]).stem + ".png", record
+
 
 @dataclass
 class BinaryMetrics:
@@ -169,13 +214,14 @@ class HazardEvaluator:
         "wall": "wall",
     }
 
-    def __init__(self, ground_truth_path: Path, predictions_dir: Path):
+    def __init__(self, ground_truth_path: Path, predictions_dir: Path, model_tag: str = None):
         """
         Initialize evaluator.
 
         Args:
             ground_truth_path: Path to ground_truth_labels.json
-            predictions_dir: Directory containing prediction JSON files
+            predictions_dir: Directory containing prediction JSON files and/or predictions.jsonl
+            model_tag: Only load predictions with this model tag (e.g. g25flash)
         """
         self.ground_truth_path = ground_truth_path
         self.predictions_dir = predictions_dir
@@ -185,13 +231,7 @@ class HazardEvaluator:
             self.ground_truth = {item['image_name']: item for item in json.load(f)}
 
         # Load predictions
-        self.predictions = {}
-        for pred_file in predictions_dir.glob("*__g15flash__v*.json"):
-            # Extract image name from filename
-            # Format: {image_name}__g15flash__v2.0.json
-            image_name = pred_file.stem.split("__")[0] + ".png"
-            with open(pred_file, 'r') as f:
-                self.predictions[image_name] = json.load(f)
+        self.predictions = dict(iter_predictions(predictions_dir, model_tag))
 
         # Results
         self.binary_metrics = BinaryMetrics()
@@ -398,13 +438,15 @@ def main():
     ap.add_argument("--ground_truth", "-g", type=Path, required=True,
                     help="Path to ground_truth_labels.json")
     ap.add_argument("--predictions", "-p", type=Path, required=True,
-                    help="Directory containing prediction JSON files")
+                    help="Directory containing predictions.jsonl and/or prediction JSON files")
     ap.add_argument("--output", "-o", type=Path, default=None,
                     help="Output JSON file for metrics (optional)")
+    ap.add_argument("--model_tag", "-m", default=None,
+                    help="Model tag in prediction filenames, e.g. g25flash (needed if several models share the directory)")
     args = ap.parse_args()
 
     # Run evaluation
-    evaluator = HazardEvaluator(args.ground_truth, args.predictions)
+    evaluator = HazardEvaluator(args.ground_truth, args.predictions, args.model_tag)
     results = evaluator.evaluate_all()
 
     # Print summary
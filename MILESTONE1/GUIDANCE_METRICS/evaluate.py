@@ -17,7 +17,7 @@ import json
 from pathlib import Path
 from datetime import datetime, timezone
 
-from eval.metrics import HazardEvaluator
+from eval.metrics import HazardEvaluator, iter_predictions
 
 
 def load_latency_stats(predictions_dir: Path) -> dict:
@@ -29,15 +29,12 @@ def load_latency_stats(predictions_dir: Path) -> dict:
     return {}
 
 
-def extract_per_image_latencies(predictions_dir: Path) -> dict:
+def extract_per_image_latencies(predictions_dir: Path, model_tag: str = None) -> dict:
     """Extract latency from each prediction file."""
     latencies = {}
-    for pred_file in predictions_dir.glob("*__g15flash__v*.json"):
-        image_name = pred_file.stem.split("__")[0] + ".png"
-        with open(pred_file, 'r') as f:
-            data = json.load(f)
-            if '_meta' in data and 'latency' in data['_meta']:
-                latencies[image_name] = data['_meta']['latency']
+    for image_name, data in iter_predictions(predictions_dir, model_tag):
+        if '_meta' in data and 'latency' in data['_meta']:
+            latencies[image_name] = data['_meta']['latency']
     return latencies
 
 
@@ -182,9 +179,11 @@ Example usage:
     ap.add_argument("--ground_truth", "-g", type=Path, required=True,
                     help="Path to ground_truth_labels.json")
     ap.add_argument("--predictions", "-p", type=Path, required=True,
-                    help="Directory containing prediction JSON files")
+                    help="Directory containing predictions.jsonl and/or prediction JSON files")
     ap.add_argument("--output", "-o", type=Path, default=None,
                     help="Output JSON file for full report (optional)")
+    ap.add_argument("--model_tag", "-m", default=None,
+                    help="Model tag in prediction filenames, e.g. g25flash (needed if several models share the directory)")
     args = ap.parse_args()
 
     # Validate inputs
@@ -195,13 +194,13 @@ Example usage:
 
     # Run detection evaluation
     print("Running hazard detection evaluation...")
-    evaluator = HazardEvaluator(args.ground_truth, args.predictions)
+    evaluator = HazardEvaluator(args.ground_truth, args.predictions, args.model_tag)
     detection_results = evaluator.evaluate_all()
 
     # Load latency data
     print("Loading latency statistics...")
     latency_stats = load_latency_stats(args.predictions)
-    per_image_latencies = extract_per_image_latencies(args.predictions)
+    per_image_latencies = extract_per_image_latencies(args.predictions, args.model_tag)
 
     # Compile full report
     full_report = compile_full_report(detection_results, latency_stats, per_image_latencies)
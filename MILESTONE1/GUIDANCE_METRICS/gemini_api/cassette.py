@@ -0,0 +1,128 @@
+# cassette.py
+from __future__ import annotations
+
+import asyncio, dataclasses, hashlib, json, os, tempfile, threading, time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+MODES = ("off", "record", "replay", "auto")
+
+class CassetteMiss(LookupError):
+    """Replay mode and no recording exists for this request."""
+
+def _generation_config_dict(gcfg: Any) -> Dict[str, Any]:
+    if dataclasses.is_dataclass(gcfg):
+        gcfg = dataclasses.asdict(gcfg)
+    return {k: v for k, v in dict(gcfg or {}).items() if v is not None}
+
+def _sha256(data) -> str:
+    return hashlib.sha256(data if isinstance(data, bytes) else str(data).encode("utf-8")).hexdigest()
+
+class Cassette:
+    """
+    Content-addressed record/replay store for Gemini calls.
+
+    A request is keyed by sha256 over (model, generation config incl. response schema,
+    prompt hash, image hashes); each recording is one JSON file under
+    root/<key[:2]>/<key>.json holding the raw reply text, its latency and token usage.
+
+    Modes:
+        off    - pass through
+        record - always call the API and (over)write the recording
+        replay - serve recordings only; a miss raises CassetteMiss (no API calls)
+        auto   - replay when recorded, otherwise call the API and record
+    Only replies that parsed and validated are recorded.
+    """
+
+    def __init__(self, root: Path, mode: str = "auto", simulate_latency: bool = False, latency_scale: float = 1.0):
+        if mode not in MODES:
+            raise ValueError(f"cassette mode must be one of {MODES}, got {mode!r}")
+        self.root = Path(root)
+        self.mode = mode
+        self.simulate_latency = simulate_latency
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "recorded": 0, "replayed_latency_ms": 0.0}
+
+    @property
+    def replays(self) -> bool:
+        return self.mode in ("replay", "auto")
+
+    @property
+    def records(self) -> bool:
+        return self.mode in ("record", "auto")
+
+    def key(self, model_name: str, generation_config: Any, contents: List[Any]) -> str:
+        parts = []
+        for item in contents:
+            if isinstance(item, dict) and "data" in item:
+                parts.append({"mime_type": item.get("mime_type"), "sha256": _sha256(item["data"])})
+            else:
+                parts.append({"text_sha256": _sha256(item)})
+        payload = {"model": model_name, "generation_config": _generation_config_dict(generation_config),
+                   "contents": parts}
+        return _sha256(json.dumps(payload, sort_keys=True, default=str))
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.replays:
+            return None
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            entry = None
+        except ValueError:
+            entry = None  # torn/corrupt recording: treat as a miss
+        with self._lock:
+            self._stats["hits" if entry else "misses"] += 1
+            if entry and self.simulate_latency:
+                self._stats["replayed_latency_ms"] += entry.get("latency_ms", 0.0) * self.latency_scale
+        if entry is None and self.mode == "replay":
+            raise CassetteMiss(f"No recording for request {key[:12]} in {self.root}")
+        return entry
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Recording for `key` ("text", "latency_ms", "usage"), sleeping for its latency if simulating; or None."""
+        entry = self._load(key)
+        if entry is None:
+            return None
+        if self.simulate_latency:
+            time.sleep(entry.get("latency_ms", 0.0) * self.latency_scale / 1000)
+        return entry
+
+    async def lookup_async(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = await asyncio.to_thread(self._load, key)
+        if entry is None:
+            return None
+        if self.simulate_latency:
+            await asyncio.sleep(entry.get("latency_ms", 0.0) * self.latency_scale / 1000)
+        return entry
+
+    def record(self, key: str, model_name: str, text: str, latency_ms: float,
+               usage: Optional[Dict[str, int]] = None):
+        if not self.records:
+            return
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry = {"key": key, "model": model_name, "text": text, "latency_ms": round(latency_ms, 2),
+                 "usage": usage, "recorded_at": datetime.now(timezone.utc).isoformat()}
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        with self._lock:
+            self._stats["recorded"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, mode=self.mode, root=str(self.root),
+                        replayed_latency_ms=round(self._stats["replayed_latency_ms"], 1))
@@ -0,0 +1,156 @@
+# concurrency.py
+from __future__ import annotations
+
+import asyncio, statistics, threading, time
+from typing import Any, Callable, Dict, List, Optional
+
+class ConcurrencyLimit:
+    """A fixed cap on in-flight requests, shared by threads and asyncio tasks alike."""
+
+    def __init__(self, limit: int):
+        self.limit = float(max(1, limit))
+        self._cond = threading.Condition()
+        self._async_waiters: List[asyncio.Future] = []
+        self._in_flight = 0
+
+    def _try_take(self) -> bool:
+        """Caller holds the lock."""
+        if self._in_flight < int(self.limit):
+            self._in_flight += 1
+            return True
+        return False
+
+    def acquire(self):
+        with self._cond:
+            while not self._try_take():
+                self._cond.wait()
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self._try_take():
+                    return
+                waiter = loop.create_future()
+                self._async_waiters.append(waiter)
+            await waiter  # woken on release or a limit change, then try again
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._wake()
+
+    def _wake(self):
+        """Caller holds the lock."""
+        self._cond.notify_all()
+        for waiter in self._async_waiters:
+            waiter.get_loop().call_soon_threadsafe(lambda w=waiter: w.done() or w.set_result(None))
+        self._async_waiters.clear()
+
+    def record(self, latency_ms: float):
+        """Report one finished request (a fixed limit ignores it)."""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"final_limit": int(self.limit), "adaptive": False}
+
+class AIMDController(ConcurrencyLimit):
+    """
+    Adaptive limit on in-flight requests (additive increase, multiplicative decrease).
+
+    Callers hold a slot (acquire/release) for each request and report its latency.
+    Every window of completions (at least `min_window`, or the current limit if larger)
+    the limit moves:
+        congested -> limit * decrease (never below min_limit)
+        healthy   -> limit + increase (never above max_limit)
+    A window is congested if any request was rate limited (429, read from
+    `rate_limited_count`) or its median latency exceeds `latency_slack` x the best
+    window median seen so far (queueing behind the rate limiter or a slower backend).
+    The window right after a decrease only holds: its requests started under the old
+    limit, so its congestion has already been answered.
+
+    Every adjustment is kept in `trajectory`, so a run shows the highest
+    concurrency it could sustain.
+    """
+
+    def __init__(self, initial: int = 2, min_limit: int = 1, max_limit: int = 32,
+                 increase: float = 1.0, decrease: float = 0.5, latency_slack: float = 2.0,
+                 min_window: int = 4, rate_limited_count: Optional[Callable[[], int]] = None,
+                 on_change: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        super().__init__(min(max(initial, self.min_limit), self.max_limit))
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_slack = latency_slack
+        self.min_window = max(1, min_window)
+        self._rate_limited_count = rate_limited_count or (lambda: 0)
+        self._on_change = on_change
+        self._window: List[float] = []
+        self._window_started = self._started = time.monotonic()
+        self._rate_limited_seen = self._rate_limited_count()
+        self._baseline_ms: Optional[float] = None
+        self._just_decreased = False
+        self.trajectory: List[Dict[str, Any]] = []
+
+    def record(self, latency_ms: float):
+        """Report one finished request; may adjust the limit."""
+        with self._cond:
+            self._window.append(latency_ms)
+            if len(self._window) < max(self.min_window, int(self.limit)):
+                return
+            now = time.monotonic()
+            rate_limited_total = self._rate_limited_count()
+            rate_limited = rate_limited_total - self._rate_limited_seen
+            median_ms = statistics.median(self._window)
+            if self._baseline_ms is None or median_ms < self._baseline_ms:
+                self._baseline_ms = median_ms
+
+            previous = self.limit
+            congested = rate_limited > 0 or median_ms > self.latency_slack * self._baseline_ms
+            if congested and not self._just_decreased:
+                self.limit = max(float(self.min_limit), self.limit * self.decrease)
+            elif not congested:
+                self.limit = min(float(self.max_limit), self.limit + self.increase)
+            self._just_decreased = self.limit < previous
+
+            event = {
+                "t_s": round(now - self._started, 2),
+                "limit": int(previous),
+                "new_limit": int(self.limit),
+                "requests": len(self._window),
+                "median_ms": round(median_ms, 1),
+                "baseline_ms": round(self._baseline_ms, 1),
+                "rate_limited": rate_limited,
+                "congested": congested,
+                "duration_s": round(now - self._window_started, 3),
+                "throughput_per_min": round(len(self._window) / max(now - self._window_started, 1e-6) * 60, 2),
+            }
+            self.trajectory.append(event)
+            self._window = []
+            self._window_started = now
+            self._rate_limited_seen = rate_limited_total
+            if int(self.limit) > int(previous):
+                self._wake()
+        if self._on_change is not None and event["new_limit"] != event["limit"]:
+            self._on_change(event)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            trajectory = list(self.trajectory)
+            limit = int(self.limit)
+        # Throughput per limit over all of its uncongested windows (single windows are too noisy)
+        per_limit: Dict[int, List[float]] = {}
+        for e in trajectory:
+            if not e["congested"]:
+                requests, duration = per_limit.setdefault(e["limit"], [0, 0.0])
+                per_limit[e["limit"]] = [requests + e["requests"], duration + e["duration_s"]]
+        sustained = {lim: req / dur * 60 for lim, (req, dur) in per_limit.items() if dur > 0}
+        best = max(sustained, key=sustained.get, default=None)
+        return {
+            "final_limit": limit,
+            "adaptive": True,
+            "max_limit_reached": max([e["new_limit"] for e in trajectory], default=limit),
+            "decreases": sum(1 for e in trajectory if e["new_limit"] < e["limit"]),
+            "best_sustained": {"limit": best, "throughput_per_min": round(sustained[best], 2)} if best else None,
+            "trajectory": trajectory,
+        }
@@ -0,0 +1,106 @@
+# frame_analysis_schema.py — One model call for hazard + traffic light + scene (+ navigation)
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field, ValidationError, confloat
+
+from .hazard_schema import HazardOutput, schema_enum
+from .navigation_guidance_schema import NavigationGuidanceOutput
+
+PROMPT_VERSION = "1.0"
+
+# Seconds subtracted from a visible countdown (processing + reaction + crossing), as in deep_analyze_traffic.md
+CROSSING_BUFFER_S = 7
+MIN_ADJUSTED_CROSSING_S = 5
+LIGHT_STATUS_VALUES = ("green", "red", "yellow", "unknown")
+PEDESTRIAN_SIGNAL_VALUES = ("walk", "dont_walk", "flashing", "unknown")
+
+class TrafficSignalOutput(BaseModel):
+    """Same contract as the /api/deep-analyze-traffic prompt."""
+    light_status: str = Field("unknown", json_schema_extra=schema_enum(LIGHT_STATUS_VALUES))
+    pedestrian_signal: str = Field("unknown", json_schema_extra=schema_enum(PEDESTRIAN_SIGNAL_VALUES))
+    countdown_timer_seconds: Optional[int] = Field(default=None, ge=0)
+    adjusted_crossing_time: Optional[int] = None
+    safe_to_cross: bool = False
+    instruction: str = Field(min_length=1, max_length=400)
+    confidence: confloat(ge=0.0, le=1.0) = 0.5
+    notes: str = Field(default="", max_length=300)
+
+    def normalized(self) -> "TrafficSignalOutput":
+        d = self.model_dump()
+        d["light_status"] = str(d["light_status"]).lower().strip()
+        d["pedestrian_signal"] = str(d["pedestrian_signal"]).lower().strip()
+        if d["light_status"] not in LIGHT_STATUS_VALUES:
+            d["light_status"] = "unknown"
+        if d["pedestrian_signal"] not in PEDESTRIAN_SIGNAL_VALUES:
+            d["pedestrian_signal"] = "unknown"
+
+        # Recompute the buffer locally rather than trusting the model's arithmetic
+        if d["countdown_timer_seconds"] is not None:
+            d["adjusted_crossing_time"] = max(0, d["countdown_timer_seconds"] - CROSSING_BUFFER_S)
+        else:
+            d["adjusted_crossing_time"] = None
+
+        # Safety guardrails: if unsure -> do not cross
+        if d["light_status"] != "green" or d["pedestrian_signal"] in ("dont_walk", "flashing"):
+            d["safe_to_cross"] = False
+        if d["adjusted_crossing_time"] is not None and d["adjusted_crossing_time"] < MIN_ADJUSTED_CROSSING_S:
+            d["safe_to_cross"] = False
+
+        return TrafficSignalOutput(**d)
+
+class SceneOutput(BaseModel):
+    """Same contract as the /api/scene-understanding prompt."""
+    scene_type: str = "unknown"
+    landmarks: List[str] = Field(default_factory=list)
+    street_name: Optional[str] = None
+    direction_facing: Optional[str] = None
+    features: List[str] = Field(default_factory=list)
+    safety_notes: str = ""
+    one_sentence_summary: str = Field(min_length=1, max_length=400)
+
+    def normalized(self) -> "SceneOutput":
+        d = self.model_dump()
+        d["scene_type"] = str(d["scene_type"]).lower().strip() or "unknown"
+        d["landmarks"] = [s for s in dict.fromkeys(d["landmarks"]) if s][:5]
+        d["features"] = [s for s in dict.fromkeys(d["features"]) if s][:5]
+        return SceneOutput(**d)
+
+# Section name -> model; each section of a combined reply is validated on its own
+SECTIONS = {
+    "hazard": HazardOutput,
+    "traffic": TrafficSignalOutput,
+    "scene": SceneOutput,
+    "navigation": NavigationGuidanceOutput,
+}
+DEFAULT_TASKS = ("hazard", "traffic", "scene")
+
+def validate_sections(raw: Dict[str, Any], tasks) -> Tuple[Dict[str, Optional[dict]], Dict[str, str]]:
+    """
+    Validate and normalize each requested section independently, so one malformed
+    section does not discard the others.
+
+    Returns:
+        (sections, errors) - sections[name] is the normalized dict or None;
+        errors[name] describes why a section was dropped.
+    """
+    sections: Dict[str, Optional[dict]] = {}
+    errors: Dict[str, str] = {}
+    for name in tasks:
+        value = raw.get(name)
+        if not isinstance(value, dict):
+            sections[name] = None
+            errors[name] = "missing from model output" if value is None else "not a JSON object"
+            continue
+        try:
+            sections[name] = SECTIONS[name](**value).normalized().model_dump()
+        except ValidationError as e:
+            sections[name] = None
+            errors[name] = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+    return sections, errors
+
+def require_any_section(raw: Dict[str, Any], tasks) -> None:
+    """Validator for hedged calls: a reply is usable if at least one requested section is valid."""
+    sections, errors = validate_sections(raw, tasks)
+    if not any(sections.values()):
+        raise ValueError(f"No valid section in combined output: {errors}")
@@ -1,13 +1,24 @@
 # gemini_client.py
 from __future__ import annotations
 
-import json, mimetypes, os, re, time, threading
+import asyncio, dataclasses, json, os, re, time, threading
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Tuple
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Type
 
 import google.generativeai as genai  # pip install google-generativeai
 from google.api_core import exceptions as google_exceptions
 
+from .cassette import Cassette
+from .image_cache import IMAGE_CACHE, ImagePartCache
+from .json_stream import IncrementalJSONParser
+from .response_schema import gemini_schema
+from .rate_limit import RateLimitTimeout, TokenBucket, shared_bucket
+from .retry import RATE_LIMITED, RetryPolicy
+from .usage import UsageStats, add_usage, usage_from_response, usage_stats
+
 def _extract_json_object(text: str) -> str:
     """
     Extract the first top-level {...} JSON object from a model reply.
@@ -39,87 +50,445 @@ def _extract_json_object(text: str) -> str:
                 return text[start:i+1]
     raise ValueError("Unbalanced JSON braces in model output.")
 
+class GeminiDeadlineExceeded(TimeoutError):
+    """No valid model response arrived within the caller's time budget."""
+
+class GeminiCancelled(RuntimeError):
+    """The call was abandoned because another (hedged) request already won."""
+
+class OutputStats:
+    """Per (model, schema) counts of replies that failed JSON parsing or validation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+
+    def record(self, model_name: str, schema_name: str, outcome: str):
+        """outcome: "ok", "parse_error" or "validation_error"."""
+        with self._lock:
+            self._counts[(model_name, schema_name)][outcome] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            items = [(key, dict(counts)) for key, counts in self._counts.items()]
+        out = {}
+        for (model_name, schema_name), counts in sorted(items):
+            total = sum(counts.values())
+            out[f"{model_name}/{schema_name}"] = {
+                "responses": total,
+                "parse_failures": counts.get("parse_error", 0),
+                "validation_failures": counts.get("validation_error", 0),
+                "parse_failure_rate": round(counts.get("parse_error", 0) / total, 4),
+                "validation_failure_rate": round(counts.get("validation_error", 0) / total, 4),
+            }
+        return out
+
+# Shared by every client in the process
+output_stats = OutputStats()
+
 def _load_image_for_gemini(path: Path) -> Dict[str, Any]:
-    mime, _ = mimetypes.guess_type(str(path))
-    if mime is None:
-        # default to png; adjust if you know your inputs
-        mime = "image/png"
-    data = path.read_bytes()
-    return {"mime_type": mime, "data": data}
+    # Cached: several prompts over the same frame read and encode it once
+    return IMAGE_CACHE.get(path)
 
 class GeminiHazardClient:
     """Client with built-in rate limiting for free tier (10 RPM)."""
 
-    # Class-level lock and timestamp tracking for rate limiting across threads
-    _rate_limit_lock = threading.Lock()
-    _last_request_time = 0.0
-
     def __init__(self, api_key: str, model_name: str = "gemini-2.5-flash",
                  temperature: float = 0.2, top_p: float = 0.8, max_retries: int = 3,
-                 rpm_limit: int = 10):
-        if not api_key:
+                 rpm_limit: int = 10, rpm_burst: int = 1, async_concurrency: int = 16,
+                 retry_policy: Optional[RetryPolicy] = None, image_cache: Optional[ImagePartCache] = None,
+                 cassette: Optional[Cassette] = None, rate_limit_scope: str = "",
+                 output_stats: OutputStats = output_stats, usage_stats: UsageStats = usage_stats):
+        # Pure replay never reaches the API, so it runs without a key
+        if not api_key and not (cassette is not None and cassette.mode == "replay"):
             raise RuntimeError("GOOGLE_API_KEY not set.")
-        genai.configure(api_key=api_key)
+        if api_key:
+            genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.temperature = temperature
+        self.top_p = top_p
         self.model = genai.GenerativeModel(model_name)
         self.gcfg = genai.types.GenerationConfig(
             temperature=temperature, top_p=top_p, candidate_count=1, response_mime_type="application/json"
         )
         self.max_retries = max_retries
+        # Jittered backoff, error classification and the process-wide retry budget
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=max_retries)
+        self.image_cache = image_cache or IMAGE_CACHE
+        # Record/replay store (see cassette.py); None = always call the API
+        self.cassette = cassette if cassette is not None and cassette.mode != "off" else None
         self.rpm_limit = rpm_limit
-        # Calculate minimum seconds between requests to stay under RPM limit
-        # Add 10% safety margin
-        self.min_request_interval = (60.0 / rpm_limit) * 1.1 if rpm_limit > 0 else 0
+        # Token bucket shared by all clients using this API key (and rate_limit_scope); allows
+        # `rpm_burst` back-to-back requests while keeping every minute under rpm_limit (10% margin)
+        self.rate_limiter: Optional[TokenBucket] = (shared_bucket(api_key, rpm_limit, rpm_burst, rate_limit_scope)
+                                                    if rpm_limit > 0 else None)
+        # Reply and token counters: process-wide by default, or the caller's own (e.g. per sweep cell)
+        self.output_stats = output_stats
+        self.usage_stats = usage_stats
+        # analyze_async() in-flight cap; the semaphore is created on first use inside a running loop
+        self.async_concurrency = max(1, async_concurrency)
+        self._async_slots: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.BoundedSemaphore]] = None
+        self._schema_gcfgs: Dict[type, Any] = {}
 
-    def _rate_limit_wait(self):
-        """Thread-safe rate limiting to stay within RPM limits."""
-        if self.rpm_limit <= 0:
-            return  # No rate limiting
+    def _generation_config(self, response_schema: Optional[Type] = None):
+        """self.gcfg, plus a constrained-decoding schema derived from `response_schema` (a pydantic model)."""
+        if response_schema is None:
+            return self.gcfg
+        gcfg = self._schema_gcfgs.get(response_schema)
+        if gcfg is None:
+            gcfg = self._schema_gcfgs[response_schema] = dataclasses.replace(
+                self.gcfg, response_schema=gemini_schema(response_schema))
+        return gcfg
 
-        with self._rate_limit_lock:
-            now = time.time()
-            time_since_last = now - self._last_request_time
+    def _parse_reply(self, text: str, response_schema: Optional[Type] = None,
+                     validate: Optional[Callable[[Dict[str, Any]], Any]] = None) -> Dict[str, Any]:
+        """JSON-decode (and optionally validate) a reply, counting failures in self.output_stats."""
+        schema_name = response_schema.__name__ if response_schema is not None else "unconstrained"
+        try:
+            data = json.loads(_extract_json_object(text))
+        except ValueError:
+            self.output_stats.record(self.model_name, schema_name, "parse_error")
+            raise
+        if validate is not None:
+            try:
+                validate(data)
+            except Exception:
+                self.output_stats.record(self.model_name, schema_name, "validation_error")
+                raise
+        self.output_stats.record(self.model_name, schema_name, "ok")
+        return data
 
-            if time_since_last < self.min_request_interval:
-                sleep_time = self.min_request_interval - time_since_last
-                time.sleep(sleep_time)
+    def _record_usage(self, resp: Any, response_schema: Optional[Type] = None,
+                      usage: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, int]]:
+        """Count a response's tokens in self.usage_stats (and the caller's `usage` dict); billed even if the reply is unusable."""
+        counts = usage_from_response(resp)
+        if counts is not None:
+            schema_name = response_schema.__name__ if response_schema is not None else "unconstrained"
+            self.usage_stats.record(self.model_name, schema_name, counts)
+            if usage is not None:
+                add_usage(usage, counts)
+        return counts
 
-            self._last_request_time = time.time()
+    def _rate_limit_wait(self, timeout: Optional[float] = None, cancel_event: Optional[threading.Event] = None):
+        """Wait for a request slot. Threads wait concurrently; nothing sleeps under a lock."""
+        if self.rate_limiter is None:
+            return  # No rate limiting
+        try:
+            self.rate_limiter.acquire(timeout=timeout, cancel_event=cancel_event)
+        except RateLimitTimeout as e:
+            raise GeminiDeadlineExceeded(f"{self.model_name}: {e}")
 
-    def analyze(self, image_path: Path, prompt_text: str) -> Tuple[Dict[str, Any], str]:
+    def analyze(self, image_path: Path, prompt_text: str, deadline_s: Optional[float] = None,
+                cancel_event: Optional[threading.Event] = None, response_schema: Optional[Type] = None,
+                validate: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                usage: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], str]:
         """
         Returns (parsed_json_dict, raw_text).
-        Includes rate limiting and 429 error handling.
+        Includes rate limiting; failures are retried per self.retry_policy (jittered
+        backoff, server retry delays honored, fatal errors raised immediately).
+
+        deadline_s bounds the whole call (retries and backoff included); each request
+        gets the remaining budget as its timeout. cancel_event aborts between attempts.
+
+        response_schema (a pydantic model) is sent as Gemini's response schema so the
+        reply is constrained to valid JSON of that shape. validate(data) runs on every
+        parsed reply; a failure counts in output_stats and is retried like a parse error.
+
+        If a `usage` dict is given, it receives this call's token counts summed over all
+        attempts (see usage.py); a replayed reply carries its recorded counts instead.
         """
-        img_part = _load_image_for_gemini(image_path)
+        img_part = self.image_cache.get(image_path)
         contents = [prompt_text, img_part]
+        gcfg = self._generation_config(response_schema)
+        deadline = time.monotonic() + deadline_s if deadline_s is not None else None
+
+        cassette_key = self._cassette_key(gcfg, contents)
+        if cassette_key is not None:
+            recorded = self.cassette.lookup(cassette_key)  # CassetteMiss in replay-only mode
+            if recorded is not None:
+                return self._replay(recorded, response_schema, validate, usage)
+
+        def remaining() -> Optional[float]:
+            if deadline is None:
+                return None
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise GeminiDeadlineExceeded(f"{self.model_name}: no response within {deadline_s:.1f}s")
+            return left
+
+        def sleep(seconds: float):
+            left = remaining()
+            if left is not None and seconds >= left:
+                # backing off would blow the budget; give up now rather than later
+                raise GeminiDeadlineExceeded(f"{self.model_name}: no response within {deadline_s:.1f}s")
+            if cancel_event is not None:
+                if cancel_event.wait(seconds):
+                    raise GeminiCancelled(f"{self.model_name}: cancelled")
+            else:
+                time.sleep(seconds)
 
         # retry on transient errors or JSON parse errors
-        backoff = 1.0
+        retry = self.retry_policy.begin()
         last_txt = ""
-        for attempt in range(1, self.max_retries + 1):
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise GeminiCancelled(f"{self.model_name}: cancelled")
             try:
                 # Apply rate limiting before each request
-                self._rate_limit_wait()
+                self._rate_limit_wait(timeout=remaining(), cancel_event=cancel_event)
+                if cancel_event is not None and cancel_event.is_set():
+                    raise GeminiCancelled(f"{self.model_name}: cancelled")
 
-                resp = self.model.generate_content(contents, generation_config=self.gcfg)
+                left = remaining()
+                request_options = {"timeout": left} if left is not None else None
+                sent_at = time.monotonic()
+                resp = self.model.generate_content(contents, generation_config=gcfg,
+                                                   request_options=request_options)
+                counts = self._record_usage(resp, response_schema, usage)
                 last_txt = resp.text.strip() if hasattr(resp, "text") else str(resp)
-                obj = _extract_json_object(last_txt)
-                data = json.loads(obj)
+                data = self._parse_reply(last_txt, response_schema, validate)
+                if cassette_key is not None:
+                    self.cassette.record(cassette_key, self.model_name, last_txt,
+                                         (time.monotonic() - sent_at) * 1000, usage=counts)
                 return data, last_txt
 
-            except google_exceptions.ResourceExhausted as e:
-                # 429 Rate Limit Error - use longer backoff
-                if attempt == self.max_retries:
-                    raise RuntimeError(f"Rate limit exceeded after {self.max_retries} retries: {e}")
-                wait_time = backoff * 5  # Longer wait for rate limits
-                print(f"  Rate limit hit, waiting {wait_time:.1f}s (attempt {attempt}/{self.max_retries})")
-                time.sleep(wait_time)
-                backoff *= 2.0
+            except (GeminiDeadlineExceeded, GeminiCancelled):
+                raise
 
             except Exception as e:
-                if attempt == self.max_retries:
+                sleep(self._retry_delay(retry, e))
+
+    def _replay(self, recorded: Dict[str, Any], response_schema: Optional[Type], validate,
+                usage: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], str]:
+        """A cassette recording as analyze()'s return value; its tokens were billed when recorded."""
+        if usage is not None and recorded.get("usage"):
+            add_usage(usage, recorded["usage"])["replayed"] = True
+        return self._parse_reply(recorded["text"], response_schema, validate), recorded["text"]
+
+    def _cassette_key(self, gcfg, contents) -> Optional[str]:
+        return self.cassette.key(self.model_name, gcfg, contents) if self.cassette is not None else None
+
+    def _retry_delay(self, retry, exc: Exception) -> float:
+        """Backoff before the next attempt; re-raises `exc` when the policy says give up."""
+        delay = retry.next_delay(exc)
+        if delay is None:
+            if retry.last_kind == RATE_LIMITED:
+                raise RuntimeError(f"Rate limit exceeded after {retry.attempt} attempts: {exc}") from exc
+            raise exc
+        if retry.last_kind == RATE_LIMITED:
+            print(f"  Rate limit hit, waiting {delay:.1f}s (attempt {retry.attempt - 1}/{self.retry_policy.max_attempts})")
+        return delay
+
+    def _async_semaphore(self) -> asyncio.BoundedSemaphore:
+        loop = asyncio.get_running_loop()
+        if self._async_slots is None or self._async_slots[0] is not loop:
+            self._async_slots = (loop, asyncio.BoundedSemaphore(self.async_concurrency))
+        return self._async_slots[1]
+
+    async def analyze_async(self, image_path: Path, prompt_text: str, deadline_s: Optional[float] = None,
+                            response_schema: Optional[Type] = None,
+                            validate: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                            usage: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], str]:
+        """
+        asyncio variant of analyze(): same retry, backoff and JSON extraction, but
+        waits (rate limiter, backoff, the request itself) never block a thread, so
+        one event loop can keep hundreds of analyses in flight.
+
+        At most `async_concurrency` requests run at once per client. Cancel the
+        awaiting task to abandon the call; a reserved rate-limit slot is returned.
+        """
+        async with self._async_semaphore():
+            img_part = await asyncio.to_thread(self.image_cache.get, image_path)
+            contents = [prompt_text, img_part]
+            gcfg = self._generation_config(response_schema)
+            deadline = time.monotonic() + deadline_s if deadline_s is not None else None
+
+            cassette_key = None
+            if self.cassette is not None:
+                cassette_key = await asyncio.to_thread(self._cassette_key, gcfg, contents)
+                recorded = await self.cassette.lookup_async(cassette_key)
+                if recorded is not None:
+                    return self._replay(recorded, response_schema, validate, usage)
+
+            def remaining() -> Optional[float]:
+                if deadline is None:
+                    return None
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise GeminiDeadlineExceeded(f"{self.model_name}: no response within {deadline_s:.1f}s")
+                return left
+
+            async def sleep(seconds: float):
+                left = remaining()
+                if left is not None and seconds >= left:
+                    raise GeminiDeadlineExceeded(f"{self.model_name}: no response within {deadline_s:.1f}s")
+                await asyncio.sleep(seconds)
+
+            retry = self.retry_policy.begin()
+            last_txt = ""
+            while True:
+                try:
+                    if self.rate_limiter is not None:
+                        try:
+                            await self.rate_limiter.acquire_async(timeout=remaining())
+                        except RateLimitTimeout as e:
+                            raise GeminiDeadlineExceeded(f"{self.model_name}: {e}")
+
+                    left = remaining()
+                    request_options = {"timeout": left} if left is not None else None
+                    sent_at = time.monotonic()
+                    try:
+                        resp = await asyncio.wait_for(
+                            self.model.generate_content_async(contents, generation_config=gcfg,
+                                                              request_options=request_options),
+                            timeout=left)
+                    except asyncio.TimeoutError:
+                        raise GeminiDeadlineExceeded(f"{self.model_name}: no response within {deadline_s:.1f}s")
+                    counts = self._record_usage(resp, response_schema, usage)
+                    last_txt = resp.text.strip() if hasattr(resp, "text") else str(resp)
+                    data = self._parse_reply(last_txt, response_schema, validate)
+                    if cassette_key is not None:
+                        await asyncio.to_thread(self.cassette.record, cassette_key, self.model_name, last_txt,
+                                                (time.monotonic() - sent_at) * 1000, counts)
+                    return data, last_txt
+
+                except GeminiDeadlineExceeded:
                     raise
-                time.sleep(backoff)
-                backoff *= 2.0
 
-        return {}, last_txt  # unreachable
+                except Exception as e:
+                    await sleep(self._retry_delay(retry, e))
+
+    def analyze_stream(self, image_path: Path, prompt_text: str, deadline_s: Optional[float] = None,
+                       cancel_event: Optional[threading.Event] = None,
+                       response_schema: Optional[Type] = None) -> Iterator[Tuple[str, Any]]:
+        """
+        Streaming variant of analyze(): yields (key, value) for each top-level field
+        of the reply as soon as it has been generated, in the order the model writes them.
+
+        No retries - fields may already have been acted on when a failure happens.
+        If the streamed text does not parse incrementally, the full reply is parsed
+        once at the end and any fields not yet yielded are yielded then.
+        """
+        img_part = self.image_cache.get(image_path)
+        deadline = time.monotonic() + deadline_s if deadline_s is not None else None
+        self._rate_limit_wait(timeout=deadline_s, cancel_event=cancel_event)
+
+        request_options = {"timeout": max(deadline - time.monotonic(), 0.1)} if deadline is not None else None
+        resp = self.model.generate_content([prompt_text, img_part],
+                                           generation_config=self._generation_config(response_schema),
+                                           stream=True, request_options=request_options)
+        parser = IncrementalJSONParser()
+        chunks, sent, parse_ok = [], set(), True
+        for chunk in resp:
+            if cancel_event is not None and cancel_event.is_set():
+                raise GeminiCancelled(f"{self.model_name}: cancelled")
+            if deadline is not None and time.monotonic() > deadline:
+                raise GeminiDeadlineExceeded(f"{self.model_name}: no response within {deadline_s:.1f}s")
+            text = chunk.text if hasattr(chunk, "text") else ""
+            chunks.append(text)
+            if parse_ok:
+                try:
+                    fields = parser.feed(text)
+                except ValueError:
+                    parse_ok = False  # malformed mid-stream; fall back to a full parse below
+                    continue
+                for key, value in fields:
+                    sent.add(key)
+                    yield key, value
+
+        self._record_usage(resp, response_schema)  # the final chunk carries the usage metadata
+        schema_name = response_schema.__name__ if response_schema is not None else "unconstrained"
+        if parse_ok and parser.done:
+            self.output_stats.record(self.model_name, schema_name, "ok")
+        else:
+            data = self._parse_reply("".join(chunks), response_schema)
+            for key, value in data.items():
+                if key not in sent:
+                    yield key, value
+
+
+# Shared pool for deadline-bounded / hedged calls (threads are cheap; calls are I/O bound)
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="gemini-hedge")
+
+@dataclass
+class HedgedResult:
+    data: Dict[str, Any]
+    raw_text: str
+    model_name: str
+    hedged: bool  # True if the answer came from the hedge (fallback) model
+    latency_ms: float
+    usage: Optional[Dict[str, Any]] = None  # the winning call's tokens (a cancelled loser is still billed)
+
+def analyze_hedged(primary: GeminiHazardClient, image_path: Path, prompt_text: str, deadline_s: float,
+                   hedge_after_s: Optional[float] = None, hedge_client: Optional[GeminiHazardClient] = None,
+                   validate: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                   response_schema: Optional[Type] = None,
+                   call_wrapper: Optional[Callable[[GeminiHazardClient, Callable[[], Any]], Any]] = None) -> HedgedResult:
+    """
+    Run `primary.analyze()` under a hard time budget.
+
+    If no valid answer has arrived after `hedge_after_s` (or the primary fails early),
+    the same request is sent to `hedge_client` (typically a faster model). The first
+    response that parses and passes `validate` wins; the loser is cancelled.
+    `response_schema` constrains both models' output (see analyze()).
+    `call_wrapper(client, attempt)` runs each model's attempt, e.g. through that model's
+    circuit breaker, so every call's outcome is attributed to the model that made it. An
+    attempt cancelled because the other model won raises GeminiCancelled; one cut off
+    because the budget ran out raises GeminiDeadlineExceeded.
+    Raises GeminiDeadlineExceeded if nothing valid arrives within `deadline_s`.
+    """
+    start = time.monotonic()
+    deadline = start + deadline_s
+    hedge_at = start + hedge_after_s if hedge_client is not None and hedge_after_s is not None else None
+    cancel = threading.Event()
+    answered = threading.Event()
+
+    def run(client: GeminiHazardClient):
+        def attempt():
+            usage: Dict[str, Any] = {}
+            try:
+                data, raw = client.analyze(image_path, prompt_text, deadline_s=deadline - time.monotonic(),
+                                           cancel_event=cancel, response_schema=response_schema,
+                                           validate=validate, usage=usage)
+            except GeminiCancelled:
+                if not answered.is_set():
+                    raise GeminiDeadlineExceeded(f"{client.model_name}: no valid response within {deadline_s:.1f}s")
+                raise
+            return client, data, raw, usage
+        return call_wrapper(client, attempt) if call_wrapper is not None else attempt()
+
+    pending = {_HEDGE_POOL.submit(run, primary)}
+    last_error: Optional[BaseException] = None
+    try:
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            timeout = deadline - now
+            if hedge_at is not None:
+                timeout = min(timeout, max(0.0, hedge_at - now))
+
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    client, data, raw, usage = fut.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                answered.set()
+                return HedgedResult(data=data, raw_text=raw, model_name=client.model_name,
+                                    hedged=client is not primary,
+                                    latency_ms=(time.monotonic() - start) * 1000, usage=usage or None)
+
+            # Fire the hedge once its delay has passed, or right away if the primary failed
+            if hedge_at is not None and (done or time.monotonic() >= hedge_at):
+                pending.add(_HEDGE_POOL.submit(run, hedge_client))
+                hedge_at = None
+    finally:
+        cancel.set()
+        for fut in pending:
+            fut.cancel()
+
+    if pending or last_error is None:
+        raise GeminiDeadlineExceeded(f"No valid response within {deadline_s:.1f}s")
+    raise last_error
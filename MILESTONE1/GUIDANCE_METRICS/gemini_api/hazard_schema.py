@@ -20,6 +20,21 @@ CANON = {
     "bike": "bicycle", "sign": "signpost", "bollards": "bollard"
 }
 
+HAPTIC_VALUES = ("left_haptic", "right_haptic", "full_haptic", "no_haptic")
+BEARING_VALUES = ("left", "center", "right", "unknown")
+PROXIMITY_VALUES = ("near", "mid", "far", "unknown")
+
+def schema_enum(values) -> dict:
+    """Field(json_schema_extra=...) restricting the *generated* schema to `values`; validation stays lenient."""
+    return {"enum": list(values)}
+
+def haptic_for(hazard_detected: bool, bearing: str, proximity: str) -> str:
+    """Haptic cue implied by bearing + proximity (only near hazards vibrate)."""
+    if not hazard_detected or str(proximity).lower().strip() != "near":
+        return "no_haptic"
+    return {"left": "left_haptic", "right": "right_haptic", "center": "full_haptic"}.get(
+        str(bearing).lower().strip(), "no_haptic")
+
 class TrafficLightInfo(BaseModel):
     approximate_distance_meters: int = Field(ge=0)
     description: str = Field(max_length=200)
@@ -29,16 +44,17 @@ class HazardOutput(BaseModel):
     hazard_detected: bool
     num_hazards: int = Field(ge=0)
     # v2: use min_length instead of min_items
-    hazard_types: conlist(str, min_length=0)
+    hazard_types: conlist(str, min_length=0) = Field(
+        json_schema_extra={"items": {"type": "string", "enum": sorted(ALLOWED_TYPES)}})
     one_sentence: str = Field(min_length=1, max_length=200)  # v2.0: increased from 140
     evasive_suggestion: str = Field(min_length=1, max_length=250)  # v2.0: increased from 160
-    bearing: str
-    proximity: str
+    bearing: str = Field(json_schema_extra=schema_enum(BEARING_VALUES))
+    proximity: str = Field(json_schema_extra=schema_enum(PROXIMITY_VALUES))
     confidence: confloat(ge=0.0, le=1.0)
     notes: str = Field(max_length=300)  # v2.0: explicit limit for notes (~40 words)
 
     # v3.0: NEW FIELDS
-    haptic_recommendation: str = "no_haptic"  # left_haptic | right_haptic | full_haptic | no_haptic
+    haptic_recommendation: str = Field("no_haptic", json_schema_extra=schema_enum(HAPTIC_VALUES))
     traffic_light_detected: bool = False
     traffic_light_info: Optional[TrafficLightInfo] = None
 
@@ -72,19 +88,9 @@ class HazardOutput(BaseModel):
 
         # v3.0: Normalize haptic recommendation
         haptic = d.get("haptic_recommendation", "no_haptic").lower().strip()
-        if haptic not in ["left_haptic", "right_haptic", "full_haptic", "no_haptic"]:
+        if haptic not in HAPTIC_VALUES:
             # Auto-generate based on bearing + proximity if invalid
-            if d["proximity"] == "near" and d["hazard_detected"]:
-                if d["bearing"] == "left":
-                    haptic = "left_haptic"
-                elif d["bearing"] == "right":
-                    haptic = "right_haptic"
-                elif d["bearing"] == "center":
-                    haptic = "full_haptic"
-                else:
-                    haptic = "no_haptic"
-            else:
-                haptic = "no_haptic"
+            haptic = haptic_for(d["hazard_detected"], d["bearing"], d["proximity"])
         d["haptic_recommendation"] = haptic
 
         # v3.0: Normalize traffic light detection
@@ -95,5 +101,7 @@ class HazardOutput(BaseModel):
         return HazardOutput(**d)
 
 class OutputEnvelope(BaseModel):
-    _meta: dict
+    # Written as "_meta"; a field named with a leading underscore would be a private
+    # attribute that pydantic silently drops. Dump with by_alias=True.
+    meta: dict = Field(alias="_meta")
     result: HazardOutput
@@ -0,0 +1,110 @@
+# image_cache.py
+from __future__ import annotations
+
+import hashlib, mimetypes, threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+def _guess_mime(path: Path) -> str:
+    mime, _ = mimetypes.guess_type(str(path))
+    # default to png; adjust if you know your inputs
+    return mime or "image/png"
+
+class ImagePartCache:
+    """
+    LRU of encoded Gemini image parts ({"mime_type", "data"}) under a byte budget.
+
+    Entries are keyed by file identity (resolved path, size, mtime_ns, inode), so a
+    rewritten file is re-read and never served stale. Payloads are stored once per
+    content hash: copies of the same frame under different names share one bytes
+    object. Concurrent misses for the same file wait for a single read.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[Tuple, str]" = OrderedDict()   # identity -> sha256|mime, LRU order
+        self._parts: Dict[str, Dict[str, Any]] = {}               # sha256|mime -> part
+        self._refs: Dict[str, int] = {}                           # sha256|mime -> identities using it
+        self._loading: Dict[Tuple, threading.Event] = {}
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "deduplicated": 0}
+
+    @staticmethod
+    def _identity(path: Path) -> Tuple:
+        path = Path(path).resolve()
+        st = path.stat()
+        return (str(path), st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def get(self, path: Path) -> Dict[str, Any]:
+        """Image part for `path`, reading the file only if this version of it is not cached."""
+        key = self._identity(path)
+        while True:
+            with self._lock:
+                digest = self._index.get(key)
+                if digest is not None:
+                    self._index.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return self._parts[digest]
+                loading = self._loading.get(key)
+                if loading is None:
+                    self._loading[key] = threading.Event()
+                    self._stats["misses"] += 1
+                    break
+            loading.wait()  # another thread is reading this file; then look again
+
+        try:
+            data = Path(key[0]).read_bytes()
+            mime = _guess_mime(Path(key[0]))
+            digest = f"{hashlib.sha256(data).hexdigest()}|{mime}"
+            return self._insert(key, digest, {"mime_type": mime, "data": data})
+        finally:
+            with self._lock:
+                self._loading.pop(key).set()
+
+    def _insert(self, key: Tuple, digest: str, part: Dict[str, Any]) -> Dict[str, Any]:
+        """Store `part` (or reuse an identical payload); returns the part to serve."""
+        size = len(part["data"])
+        with self._lock:
+            if size > self.max_bytes:
+                return part  # larger than the whole budget: serve uncached
+            if digest in self._parts:
+                self._stats["deduplicated"] += 1
+                part = self._parts[digest]
+            else:
+                self._parts[digest] = part
+                self._refs[digest] = 0
+                self._bytes += size
+            self._refs[digest] += 1
+            self._index[key] = digest
+            while self._bytes > self.max_bytes and self._index:
+                self._evict_oldest()
+            return part
+
+    def _evict_oldest(self):
+        """Caller holds the lock."""
+        _, digest = self._index.popitem(last=False)
+        self._refs[digest] -= 1
+        if self._refs[digest] == 0:
+            del self._refs[digest]
+            self._bytes -= len(self._parts.pop(digest)["data"])
+            self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._parts.clear()
+            self._refs.clear()
+            self._index.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(self._stats,
+                        hit_rate=round(self._stats["hits"] / lookups, 3) if lookups else None,
+                        entries=len(self._index), unique_images=len(self._parts),
+                        bytes=self._bytes, max_bytes=self.max_bytes)
+
+# Shared by every GeminiHazardClient in the process unless one is given its own
+IMAGE_CACHE = ImagePartCache()
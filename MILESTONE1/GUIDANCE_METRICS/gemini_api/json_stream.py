@@ -0,0 +1,79 @@
+# json_stream.py
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Tuple
+
+class IncrementalJSONParser:
+    """
+    Incremental parser for a single top-level JSON object arriving in chunks.
+
+    feed() returns the (key, value) pairs of top-level fields that completed in
+    that chunk, so small early fields (e.g. hazard_detected, bearing) can be acted
+    on before the rest of the reply has been generated. Text before the opening
+    '{' (such as a ```json fence) is ignored.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect = "object"  # object -> key -> key_end -> colon -> value -> value_end
+        self._start = 0
+        self._key = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self._text += chunk
+        text, out = self._text, []
+        i = self._pos
+        while i < len(text) and not self.done:
+            ch = text[i]
+            if self._expect == "object":
+                if ch == "{":
+                    self._depth, self._expect = 1, "key"
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect == "key_end":
+                        self._key = json.loads(text[self._start:i + 1])
+                        self._expect = "colon"
+            elif ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect in ("key", "value"):
+                    self._start = i
+                    self._expect = "key_end" if self._expect == "key" else "value_end"
+            elif ch in "{[":
+                if self._depth == 1 and self._expect == "value":
+                    self._start, self._expect = i, "value_end"
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    if self._expect == "value_end":
+                        self._emit(text[self._start:i], out)
+                    self.done = True
+            elif ch == ",":
+                if self._depth == 1 and self._expect == "value_end":
+                    self._emit(text[self._start:i], out)
+                    self._expect = "key"
+            elif ch == ":":
+                if self._depth == 1 and self._expect == "colon":
+                    self._expect = "value"
+            elif not ch.isspace() and self._depth == 1 and self._expect == "value":
+                self._start, self._expect = i, "value_end"  # number / true / false / null
+            i += 1
+        self._pos = i
+        return out
+
+    def _emit(self, raw: str, out: List[Tuple[str, Any]]):
+        value = json.loads(raw.strip())
+        self.fields[self._key] = value
+        out.append((self._key, value))
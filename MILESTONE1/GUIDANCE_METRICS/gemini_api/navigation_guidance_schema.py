@@ -4,6 +4,8 @@ from typing import Optional
 
 from pydantic import BaseModel, Field, confloat
 
+from .hazard_schema import HAPTIC_VALUES, schema_enum
+
 PROMPT_VERSION = "3.0"  # Combined guidance system
 
 class TrafficLightInfo(BaseModel):
@@ -19,7 +21,7 @@ class NavigationGuidanceOutput(BaseModel):
     # Hazard Detection
     hazard_detected: bool = False
     hazard_guidance: str = ""  # Spoken first if hazard exists
-    haptic_recommendation: str = "no_haptic"  # left_haptic | right_haptic | full_haptic | no_haptic
+    haptic_recommendation: str = Field("no_haptic", json_schema_extra=schema_enum(HAPTIC_VALUES))
 
     # Navigation Instruction
     navigation_instruction: str = Field(min_length=1, max_length=300)  # Enhanced Google Maps instruction
@@ -54,5 +56,7 @@ class NavigationGuidanceOutput(BaseModel):
         return NavigationGuidanceOutput(**d)
 
 class OutputEnvelope(BaseModel):
-    _meta: dict
+    # Written as "_meta"; a field named with a leading underscore would be a private
+    # attribute that pydantic silently drops. Dump with by_alias=True.
+    meta: dict = Field(alias="_meta")
     result: NavigationGuidanceOutput
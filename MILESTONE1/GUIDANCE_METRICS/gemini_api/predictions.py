@@ -0,0 +1,178 @@
+# predictions.py
+from __future__ import annotations
+
+import argparse, json, os, re, tempfile, threading, time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+FILENAME = "predictions.jsonl"
+
+def model_tag(model_name: str) -> str:
+    """Filename tag for a model: gemini-2.5-flash -> g25flash, gemini-2.5-flash-lite -> g25flashlite."""
+    return re.sub(r"[^a-z0-9]", "", model_name.lower().replace("gemini", "g"))
+
+def prediction_filename(image: Path, model_name: str, prompt_version: str) -> str:
+    return f"{Path(image).stem}__{model_tag(model_name)}__v{prompt_version}.json"
+
+def save_prediction_file(out_dir: Path, payload: Dict[str, Any]) -> Path:
+    """Write one record as {image_stem}__{model_tag}__v{version}.json (pretty, atomic)."""
+    meta = payload["_meta"]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / prediction_filename(meta["source_image"], meta["model"], meta["prompt_version"])
+    # Atomic: an interrupted run never leaves a truncated output behind
+    fd, tmp = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return path
+
+def read_predictions(path: Path) -> Iterator[Dict[str, Any]]:
+    """Records of a predictions.jsonl one at a time; a torn last line from a crash is skipped."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+def read_prediction_at(path: Path, offset: int, length: int) -> Optional[Dict[str, Any]]:
+    """The record a sink reported at `offset`, or None if the file no longer holds it there."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+    except (OSError, ValueError):
+        return None
+
+class PredictionSink:
+    """
+    Appends prediction records to a single predictions.jsonl in the output dir.
+
+    Records are buffered and written in batches: a batch goes out once it holds
+    `batch_size` records, or on the first write after its oldest record has waited
+    `max_delay_s`, and on flush()/close(). Each batch is one write followed by an fsync,
+    and only then are the records' `on_durable(offset, length)` callbacks called, so
+    anything reported durable survives a crash. A crash loses at most the unwritten
+    batch and may leave a torn last line, which readers skip.
+    """
+
+    def __init__(self, out_dir: Path, batch_size: int = 64, max_delay_s: float = 1.0, fsync: bool = True):
+        self.path = Path(out_dir) / FILENAME
+        self.batch_size = max(1, batch_size)
+        self.max_delay_s = max_delay_s
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[bytes, Optional[Callable[[int, int], None]]]] = []
+        self._oldest: Optional[float] = None
+        self._file = None
+        self._records = 0
+        self._batches = 0
+        self._bytes = 0
+        self._fsync_s = 0.0
+
+    def write(self, record: Dict[str, Any], on_durable: Optional[Callable[[int, int], None]] = None):
+        line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            self._pending.append((line, on_durable))
+            now = time.monotonic()
+            if self._oldest is None:
+                self._oldest = now
+            if len(self._pending) < self.batch_size and now - self._oldest < self.max_delay_s:
+                return
+            durable = self._flush_locked()
+        self._notify(durable)
+
+    def flush(self):
+        with self._lock:
+            durable = self._flush_locked()
+        self._notify(durable)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self) -> "PredictionSink":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _open(self):
+        """Caller holds the lock."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "ab")
+        if self._file.tell() > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write(b"\n")  # end a torn line from a crash so it stays one bad line
+
+    def _flush_locked(self) -> List[Tuple[Callable[[int, int], None], int, int]]:
+        """Caller holds the lock. Returns the callbacks to run once the lock is released."""
+        if not self._pending:
+            return []
+        if self._file is None:
+            self._open()
+        offset = self._file.tell()
+        data = b"".join(line for line, _ in self._pending)
+        self._file.write(data)
+        self._file.flush()
+        start = time.monotonic()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._fsync_s += time.monotonic() - start
+        durable = []
+        for line, on_durable in self._pending:
+            if on_durable is not None:
+                durable.append((on_durable, offset, len(line)))
+            offset += len(line)
+        self._records += len(self._pending)
+        self._batches += 1
+        self._bytes += len(data)
+        self._pending = []
+        self._oldest = None
+        return durable
+
+    @staticmethod
+    def _notify(durable: List[Tuple[Callable[[int, int], None], int, int]]):
+        for on_durable, offset, length in durable:
+            on_durable(offset, length)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "path": str(self.path),
+                "records": self._records,
+                "batches": self._batches,
+                "bytes": self._bytes,
+                "mean_batch": round(self._records / self._batches, 1) if self._batches else 0.0,
+                "fsync_s": round(self._fsync_s, 3),
+            }
+
+def export_files(jsonl_path: Path, out_dir: Path) -> int:
+    """Write every record of a predictions.jsonl as its own pretty JSON file (later records win)."""
+    n = 0
+    for record in read_predictions(jsonl_path):
+        save_prediction_file(out_dir, record)
+        n += 1
+    return n
+
+def main():
+    ap = argparse.ArgumentParser(description="Export a predictions.jsonl to one JSON file per image.")
+    ap.add_argument("jsonl", type=Path, help="predictions.jsonl written by main.py")
+    ap.add_argument("--output_dir", "-o", type=Path, default=None,
+                    help="Where to write the files (default: the JSONL's directory)")
+    args = ap.parse_args()
+    n = export_files(args.jsonl, args.output_dir or args.jsonl.parent)
+    print(f"✓ Exported {n} records to {args.output_dir or args.jsonl.parent}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# rate_limit.py
+from __future__ import annotations
+
+import asyncio, hashlib, threading, time
+from typing import Dict, Optional, Tuple
+
+class RateLimitTimeout(TimeoutError):
+    """The next request slot is further away than the caller is willing to wait."""
+
+class TokenBucket:
+    """
+    Token-bucket limiter: `burst` requests may go out back to back, after which
+    tokens refill at `rate_per_s`.
+
+    Waiting never happens under the lock. A caller reserves the next slot (the
+    token count may go negative), computes how long until that slot, and sleeps
+    on its own - so N threads waiting for N slots sleep concurrently instead of
+    queueing behind one sleeper.
+    """
+
+    def __init__(self, rate_per_s: float, burst: int = 1):
+        self.rate_per_s = rate_per_s
+        self.burst = max(1, int(burst))
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._acquired = 0
+        self._waited = 0
+        self._total_wait_s = 0.0
+        self._max_wait_s = 0.0
+
+    def _reserve(self, timeout: Optional[float]) -> float:
+        """Take a token (possibly from the future); returns seconds until it is valid."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate_per_s)
+            self._updated = now
+            wait_s = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate_per_s
+            if timeout is not None and wait_s > timeout:
+                raise RateLimitTimeout(f"next request slot in {wait_s:.1f}s exceeds {timeout:.1f}s budget")
+            self._tokens -= 1
+            self._acquired += 1
+            if wait_s > 0:
+                self._waited += 1
+                self._total_wait_s += wait_s
+                self._max_wait_s = max(self._max_wait_s, wait_s)
+            return wait_s
+
+    def _refund(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    def acquire(self, timeout: Optional[float] = None, cancel_event: Optional[threading.Event] = None) -> float:
+        """
+        Block until a request may be sent. Returns the seconds waited.
+        Raises RateLimitTimeout (without consuming a token) if that would take longer than `timeout`.
+        """
+        wait_s = self._reserve(timeout)
+        if wait_s > 0:
+            if cancel_event is not None:
+                if cancel_event.wait(wait_s):
+                    self._refund()
+            else:
+                time.sleep(wait_s)
+        return wait_s
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> float:
+        """asyncio variant of acquire(); cancelling the awaiting task returns the token."""
+        wait_s = self._reserve(timeout)
+        if wait_s > 0:
+            try:
+                await asyncio.sleep(wait_s)
+            except asyncio.CancelledError:
+                self._refund()
+                raise
+        return wait_s
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "acquired": self._acquired,
+                "waited": self._waited,
+                "total_wait_s": round(self._total_wait_s, 3),
+                "mean_wait_s": round(self._total_wait_s / self._acquired, 3) if self._acquired else 0.0,
+                "max_wait_s": round(self._max_wait_s, 3),
+                "rate_per_min": round(self.rate_per_s * 60, 2),
+                "burst": self.burst,
+            }
+
+def rpm_to_rate(rpm_limit: int, burst: int = 1, safety: float = 1.1) -> float:
+    """
+    Refill rate (tokens/s) that keeps any 60s window under `rpm_limit`, with a 10%
+    safety margin: a full bucket spends `burst` at once, so the refill covers the rest.
+    """
+    quota = rpm_limit / safety
+    return max(quota - (max(1, burst) - 1), 1.0) / 60.0
+
+_BUCKETS: Dict[Tuple[str, str, int, int], TokenBucket] = {}
+_BUCKETS_LOCK = threading.Lock()
+
+def shared_bucket(api_key: str, rpm_limit: int, burst: int = 1, scope: str = "") -> TokenBucket:
+    """
+    One bucket per API key (and limit), shared by every client in the process.
+    `scope` splits a key's budget further, e.g. by model name, since Gemini quotas are per model.
+    """
+    key_id = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    with _BUCKETS_LOCK:
+        bucket = _BUCKETS.get((key_id, scope, rpm_limit, burst))
+        if bucket is None:
+            bucket = _BUCKETS[(key_id, scope, rpm_limit, burst)] = TokenBucket(rpm_to_rate(rpm_limit, burst), burst)
+        return bucket
@@ -0,0 +1,69 @@
+# response_schema.py
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple, Type
+
+from pydantic import BaseModel, create_model
+
+# The subset of OpenAPI that Gemini's response_schema accepts (protos.Schema fields)
+_ALLOWED_KEYS = {"type", "format", "description", "nullable", "enum", "items", "properties",
+                 "required", "min_items", "max_items"}
+_RENAMED_KEYS = {"minItems": "min_items", "maxItems": "max_items"}
+
+def _resolve(node: Any, defs: Dict[str, Any]) -> Any:
+    """Inline $refs, collapse Optional[X] (anyOf X/null) to nullable X, drop unsupported keys."""
+    if isinstance(node, list):
+        return [_resolve(n, defs) for n in node]
+    if not isinstance(node, dict):
+        return node
+
+    if "$ref" in node:
+        target = defs[node["$ref"].rsplit("/", 1)[-1]]
+        merged = {**target, **{k: v for k, v in node.items() if k != "$ref"}}
+        return _resolve(merged, defs)
+
+    if "anyOf" in node:
+        options = [o for o in node["anyOf"] if o.get("type") != "null"]
+        nullable = len(options) < len(node["anyOf"])
+        if len(options) != 1:
+            raise ValueError(f"Unions are not supported in a Gemini response schema: {node['anyOf']}")
+        merged = {**options[0], **{k: v for k, v in node.items() if k != "anyOf"}}
+        if nullable:
+            merged["nullable"] = True
+        return _resolve(merged, defs)
+
+    out: Dict[str, Any] = {}
+    for key, value in node.items():
+        key = _RENAMED_KEYS.get(key, key)
+        if key not in _ALLOWED_KEYS:
+            continue
+        if key == "properties":
+            out[key] = {name: _resolve(prop, defs) for name, prop in value.items()}
+        elif key == "items":
+            out[key] = _resolve(value, defs)
+        else:
+            out[key] = value
+    if "enum" in out:
+        out["type"] = "string"  # Gemini enums are string-only
+        out["enum"] = [str(v) for v in out["enum"]]
+    if "properties" in out:
+        out.pop("description", None)  # class docstrings are notes for developers, not the model
+        # Ask for every field (Optional ones as null) so replies have a stable shape
+        out["required"] = list(out["properties"])
+    return out
+
+@lru_cache(maxsize=None)
+def gemini_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    Gemini response_schema (dict) for a pydantic model: $refs inlined, Optional
+    fields marked nullable, and only keys Gemini accepts kept (length/range limits
+    are still enforced by pydantic validation afterwards).
+    """
+    schema = model.model_json_schema()
+    return _resolve(schema, schema.get("$defs", {}))
+
+@lru_cache(maxsize=None)
+def sections_model(sections: Tuple[Tuple[str, Type[BaseModel]], ...], name: str = "Sections") -> Type[BaseModel]:
+    """A model with one nullable field per (name, model) pair, e.g. for combined multi-task replies."""
+    return create_model(name, **{key: (Optional[model], None) for key, model in sections})
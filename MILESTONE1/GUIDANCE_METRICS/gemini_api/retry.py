@@ -0,0 +1,205 @@
+# retry.py
+from __future__ import annotations
+
+import email.utils, random, re, threading, time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+RETRYABLE, RATE_LIMITED, FATAL = "retryable", "rate_limited", "fatal"
+
+# Client errors that will fail the same way on every attempt
+_FATAL_API_ERRORS = (
+    google_exceptions.InvalidArgument,
+    google_exceptions.PermissionDenied,
+    google_exceptions.Unauthenticated,
+    google_exceptions.NotFound,
+    google_exceptions.FailedPrecondition,
+    google_exceptions.BadRequest,
+    google_exceptions.Forbidden,
+    google_exceptions.Unauthorized,
+    google_exceptions.MethodNotAllowed,
+)
+_RATE_LIMIT_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+# Malformed JSON (ValueError) is worth another sample; dropped connections are worth a resend
+_RETRYABLE_LOCAL_ERRORS = (ValueError, ConnectionError, TimeoutError)
+
+_RETRY_DELAY_PATTERNS = (
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE),
+    re.compile(r"retry in\s*([\d.]+)\s*s", re.IGNORECASE),
+)
+
+def classify(exc: BaseException) -> str:
+    """RATE_LIMITED, RETRYABLE or FATAL."""
+    if isinstance(exc, _RATE_LIMIT_ERRORS):
+        return RATE_LIMITED
+    if isinstance(exc, _FATAL_API_ERRORS):
+        return FATAL
+    if isinstance(exc, google_exceptions.GoogleAPICallError):
+        code = getattr(exc, "code", None)
+        if isinstance(code, int) and 400 <= code < 500 and code not in (408, 429):
+            return FATAL
+        return RETRYABLE  # 5xx, transport-level and unknown API errors
+    if isinstance(exc, _RETRYABLE_LOCAL_ERRORS):
+        return RETRYABLE
+    return FATAL  # programming errors (TypeError, KeyError, ...) do not fix themselves
+
+def server_retry_delay(exc: BaseException) -> Optional[float]:
+    """
+    Delay the server asked for, in seconds: a RetryInfo detail (gRPC), a Retry-After
+    header (REST) or the "retry in Ns" hint in the error message. None if absent.
+    """
+    for detail in getattr(exc, "details", None) or ():
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None and hasattr(delay, "seconds"):
+            return delay.seconds + getattr(delay, "nanos", 0) / 1e9
+
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    message = str(exc)
+    for pattern in _RETRY_DELAY_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return None
+
+class RetryBudget:
+    """
+    Process-wide cap on retry amplification: over a sliding window, retries may
+    not exceed `ratio` x first attempts (plus a small floor so a quiet process can
+    still retry). During an outage this turns N workers x max_attempts calls into
+    roughly N x (1 + ratio).
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries_per_s: float = 0.1, window_s: float = 60.0):
+        self.ratio = ratio
+        self.min_retries_per_s = min_retries_per_s
+        self.window_s = window_s
+        self._lock = threading.Lock()
+        self._requests: deque = deque()
+        self._retries: deque = deque()
+        self._denied = 0
+
+    def _trim(self, now: float):
+        for q in (self._requests, self._retries):
+            while q and q[0] < now - self.window_s:
+                q.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_spend(self) -> bool:
+        """Take one retry from the budget; False if it is exhausted."""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            allowed = self.min_retries_per_s * self.window_s + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                self._denied += 1
+                return False
+            self._retries.append(now)
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._trim(time.monotonic())
+            return {"requests_in_window": len(self._requests), "retries_in_window": len(self._retries),
+                    "denied": self._denied, "ratio": self.ratio, "window_s": self.window_s}
+
+# Shared by every client in the process unless one is given its own
+DEFAULT_BUDGET = RetryBudget()
+
+class RetryPolicy:
+    """
+    Decorrelated-jitter backoff: each delay is drawn from
+    U(base, max(base, previous) * 3), capped - so concurrent workers that failed together
+    spread out instead of retrying in lockstep. Rate-limit errors start from a
+    larger base, and a delay supplied by the server always wins (plus a little
+    jitter).
+
+    Usage, per call:
+        attempt = policy.begin()
+        ... on exception e:
+        delay = attempt.next_delay(e)   # None -> give up and re-raise
+    """
+
+    def __init__(self, max_attempts: int = 3, base_s: float = 1.0, rate_limit_base_s: float = 5.0,
+                 cap_s: float = 60.0, budget: Optional[RetryBudget] = DEFAULT_BUDGET,
+                 rng: Optional[random.Random] = None):
+        self.max_attempts = max(1, max_attempts)
+        self.base_s = base_s
+        self.rate_limit_base_s = rate_limit_base_s
+        self.cap_s = cap_s
+        self.budget = budget
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "retries": 0, "fatal": 0, "exhausted": 0,
+                       "budget_denied": 0, "server_delays": 0, "rate_limited": 0}
+
+    def begin(self) -> "RetryAttempt":
+        if self.budget is not None:
+            self.budget.record_request()
+        self._count("calls")
+        return RetryAttempt(self)
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+        if self.budget is not None:
+            out["budget"] = self.budget.stats()
+        return out
+
+class RetryAttempt:
+    """Retry state for one logical call."""
+
+    def __init__(self, policy: RetryPolicy):
+        self.policy = policy
+        self.attempt = 1
+        self.last_kind: Optional[str] = None
+        self._prev_delay = 0.0
+
+    def next_delay(self, exc: BaseException) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None if `exc` should be raised."""
+        policy = self.policy
+        self.last_kind = kind = classify(exc)
+        if kind == RATE_LIMITED:
+            policy._count("rate_limited")  # every 429, retried or not (a congestion signal)
+        if kind == FATAL:
+            policy._count("fatal")
+            return None
+        if self.attempt >= policy.max_attempts:
+            policy._count("exhausted")
+            return None
+        if policy.budget is not None and not policy.budget.try_spend():
+            policy._count("budget_denied")
+            return None
+
+        base = policy.rate_limit_base_s if kind == RATE_LIMITED else policy.base_s
+        delay = min(policy.cap_s, policy._rng.uniform(base, max(base, self._prev_delay) * 3))
+        hinted = server_retry_delay(exc)
+        if hinted is not None:
+            policy._count("server_delays")
+            delay = hinted + policy._rng.uniform(0, max(0.1, hinted * 0.1))
+
+        self._prev_delay = delay
+        self.attempt += 1
+        policy._count("retries")
+        return delay
@@ -0,0 +1,104 @@
+# run_manifest.py
+from __future__ import annotations
+
+import hashlib, json, threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from .predictions import read_prediction_at
+
+STATUSES = ("pending", "completed", "failed")
+
+def config_hash(config: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+class RunManifest:
+    """
+    Append-only record of a batch run's items, stored as run_manifest.jsonl in the output dir.
+
+    Each line is {"key", "image", "status", ...} and the latest line per key wins, so
+    an interrupted run loses at most the line being written. Keys combine the image path
+    with a hash of everything that shapes the output (model, sampling, prompt), so a
+    changed config makes every image pending again instead of reusing stale results.
+    """
+
+    FILENAME = "run_manifest.jsonl"
+
+    def __init__(self, out_dir: Path, config: Dict[str, Any]):
+        self.path = Path(out_dir) / self.FILENAME
+        self.config_hash = config_hash(config)
+        self._lock = threading.Lock()
+        self._items: Dict[str, Dict[str, Any]] = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from a crash
+                    self._items[entry["key"]] = entry
+
+    def key(self, image: Path) -> str:
+        return f"{Path(image).resolve()}#{self.config_hash}"
+
+    def completed(self, image: Path) -> Optional[Dict[str, Any]]:
+        """
+        The completed entry for `image` under this config, if its output is still the one
+        that run wrote (a run with another config may have overwritten the same file, or
+        predictions.jsonl may have been truncated or replaced).
+        """
+        entry = self._items.get(self.key(image))
+        if entry is None or entry["status"] != "completed":
+            return None
+        if "output_offset" in entry:
+            record = read_prediction_at(Path(entry["output"]), entry["output_offset"], entry["output_length"])
+            if record is None or record.get("_meta", {}).get("source_image") != entry["image"]:
+                return None
+            return entry
+        try:
+            if Path(entry["output"]).stat().st_mtime_ns != entry.get("output_mtime_ns"):
+                return None
+        except OSError:
+            return None
+        return entry
+
+    def _append(self, entries: Iterable[Dict[str, Any]]):
+        entries = list(entries)
+        if not entries:
+            return
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                for entry in entries:
+                    entry["timestamp"] = now
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            for entry in entries:
+                self._items[entry["key"]] = entry
+
+    def mark_pending(self, images: Iterable[Path]):
+        self._append({"key": self.key(img), "image": str(img), "status": "pending"} for img in images)
+
+    def mark_completed(self, image: Path, output: Path, latency_ms: float, usage: Optional[Dict[str, Any]] = None,
+                       offset: Optional[int] = None, length: Optional[int] = None):
+        """`output` is the image's own file, or with `offset`/`length` a record in a predictions.jsonl."""
+        entry = {"key": self.key(image), "image": str(image), "status": "completed", "output": str(output)}
+        if offset is not None:
+            entry.update(output_offset=offset, output_length=length)
+        else:
+            entry["output_mtime_ns"] = Path(output).stat().st_mtime_ns
+        entry.update(latency_ms=round(latency_ms, 2), usage=usage or None)
+        self._append([entry])
+
+    def mark_failed(self, image: Path, error: BaseException):
+        self._append([{"key": self.key(image), "image": str(image), "status": "failed",
+                       "error": f"{type(error).__name__}: {error}"}])
+
+    def counts(self, images: Iterable[Path]) -> Dict[str, int]:
+        """Items of this run by status (images never seen count as pending)."""
+        counts = dict.fromkeys(STATUSES, 0)
+        for img in images:
+            entry = self._items.get(self.key(img))
+            counts[entry["status"] if entry else "pending"] += 1
+        return counts
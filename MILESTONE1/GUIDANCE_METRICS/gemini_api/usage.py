@@ -0,0 +1,96 @@
+# usage.py
+from __future__ import annotations
+
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, Optional, Tuple
+
+# USD per 1M tokens (input, output) at paid-tier list prices for prompts <= 200k tokens.
+# Thinking tokens are billed as output. Update when pricing changes.
+PRICES_PER_M: Dict[str, Tuple[float, float]] = {
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.0-flash": (0.10, 0.40),
+}
+
+def usage_from_response(resp: Any) -> Optional[Dict[str, int]]:
+    """
+    Token counts from a response's usage_metadata, or None if it has none.
+    Newer API versions also split prompt tokens by modality (prompt_text_tokens,
+    prompt_image_tokens); those keys are added when present.
+    """
+    meta = getattr(resp, "usage_metadata", None)
+    if meta is None:
+        return None
+    usage = {
+        "prompt_tokens": getattr(meta, "prompt_token_count", 0) or 0,
+        "output_tokens": getattr(meta, "candidates_token_count", 0) or 0,
+        "thoughts_tokens": getattr(meta, "thoughts_token_count", 0) or 0,
+        "cached_tokens": getattr(meta, "cached_content_token_count", 0) or 0,
+        "total_tokens": getattr(meta, "total_token_count", 0) or 0,
+    }
+    for detail in getattr(meta, "prompt_tokens_details", None) or ():
+        modality = getattr(detail.modality, "name", str(detail.modality)).lower()
+        usage[f"prompt_{modality}_tokens"] = detail.token_count
+    return usage
+
+def estimate_cost(model_name: str, usage: Dict[str, int]) -> Optional[float]:
+    """List-price cost in USD for one call's usage, or None for an unpriced model."""
+    name = model_name.split("/")[-1]
+    matches = [m for m in PRICES_PER_M if name.startswith(m)]
+    if not matches:
+        return None
+    input_price, output_price = PRICES_PER_M[max(matches, key=len)]
+    output_tokens = usage.get("output_tokens", 0) + usage.get("thoughts_tokens", 0)
+    return (usage.get("prompt_tokens", 0) * input_price + output_tokens * output_price) / 1e6
+
+def add_usage(total: Dict[str, Any], usage: Dict[str, int]) -> Dict[str, Any]:
+    """Accumulate one response's counts into `total` (in place), e.g. across retries."""
+    for key, value in usage.items():
+        total[key] = total.get(key, 0) + value
+    total["responses"] = total.get("responses", 0) + 1
+    return total
+
+class UsageStats:
+    """Per (model, schema) token totals and list-price cost of every billed response, retries included."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+        self._cost: Dict[Tuple[str, str], float] = defaultdict(float)
+
+    def record(self, model_name: str, schema_name: str, usage: Dict[str, int]):
+        cost = estimate_cost(model_name, usage)
+        with self._lock:
+            tokens = self._tokens[(model_name, schema_name)]
+            tokens.update(usage)
+            tokens["responses"] += 1
+            if cost is not None:
+                self._cost[(model_name, schema_name)] += cost
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            items = [(key, dict(tokens), self._cost.get(key)) for key, tokens in self._tokens.items()]
+        out = {}
+        for (model_name, schema_name), tokens, cost in sorted(items, key=lambda item: item[0]):
+            n = tokens.pop("responses")
+            out[f"{model_name}/{schema_name}"] = {
+                "responses": n,
+                "tokens": tokens,
+                "mean_tokens": {key: round(value / n, 1) for key, value in tokens.items()},
+                "cost_usd": round(cost, 6) if cost is not None else None,
+            }
+        return out
+
+    def totals(self) -> Dict[str, Any]:
+        """All models and schemas combined."""
+        totals: Counter = Counter()
+        with self._lock:
+            for tokens in self._tokens.values():
+                totals.update(tokens)
+            cost = sum(self._cost.values())
+        return dict(totals, cost_usd=round(cost, 6))
+
+# Shared by every client in the process
+usage_stats = UsageStats()
@@ -1,14 +1,23 @@
 # main.py
 from __future__ import annotations
 
-import argparse, json, os, random, time
+import argparse, asyncio, hashlib, itertools, json, os, random, statistics, time
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Set
 
 from gemini_api.hazard_schema import HazardOutput, OutputEnvelope, PROMPT_VERSION
-from gemini_api.gemini_client import GeminiHazardClient
+from gemini_api.cassette import MODES as CASSETTE_MODES, Cassette
+from gemini_api.concurrency import AIMDController, ConcurrencyLimit
+from gemini_api.gemini_client import GeminiHazardClient, OutputStats
+from gemini_api.image_cache import IMAGE_CACHE
+from gemini_api.predictions import PredictionSink, model_tag, save_prediction_file
+from gemini_api.run_manifest import RunManifest
+from gemini_api.usage import UsageStats, estimate_cost
+
+MODELS = ["gemini-2.5-flash", "gemini-2.5-pro", "gemini-2.5-flash-lite", "gemini-2.0-flash"]
 
 def read_prompt(path: Path) -> str:
     return path.read_text(encoding="utf-8").strip()
@@ -17,22 +26,83 @@ def list_images(images_dir: Path) -> List[Path]:
     exts = {".png", ".jpg", ".jpeg", ".webp"}
     return sorted([p for p in images_dir.rglob("*") if p.suffix.lower() in exts])
 
-def save_json(out_dir: Path, img_path: Path, model_name: str, payload: dict):
-    out_dir.mkdir(parents=True, exist_ok=True)
-    stem = img_path.stem
-    model_tag = "g15flash" if "flash" in model_name else "g15pro"
-    fn = f"{stem}__{model_tag}__v{PROMPT_VERSION}.json"
-    (out_dir / fn).write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
-    return out_dir / fn
+@dataclass
+class Cell:
+    """One (model, prompt, temperature, top_p) combination of a run, with its own output namespace."""
+    name: str
+    model: str
+    prompt_path: Path
+    prompt_text: str
+    temperature: float
+    top_p: float
+    output_dir: Path
+    client: Optional[GeminiHazardClient] = None
+    manifest: Optional[RunManifest] = None
+    limiter: Optional[ConcurrencyLimit] = None  # shared by every cell of the same model
+    sink: Optional[PredictionSink] = None  # None = one JSON file per image (--output_format json)
+    todo: List[Path] = field(default_factory=list)
+    todo_set: Set[Path] = field(default_factory=set)
+    done: Dict[Path, dict] = field(default_factory=dict)
+    results: List = field(default_factory=list)
+    failures: List[str] = field(default_factory=list)
+    latencies: List[float] = field(default_factory=list)
+    finished_s: float = 0.0  # seconds from the start of the run to this cell's last completion
+
+def build_cells(args) -> List[Cell]:
+    """Every combination of --model, --prompt_path, --temperature and --top_p."""
+    prompt_paths = list(dict.fromkeys(args.prompt_path))
+    combos = list(itertools.product(dict.fromkeys(args.model), prompt_paths,
+                                    dict.fromkeys(args.temperature), dict.fromkeys(args.top_p)))
+    stems = [p.stem for p in prompt_paths]
+    cells = []
+    for model, prompt_path, temperature, top_p in combos:
+        prompt_label = prompt_path.stem
+        if stems.count(prompt_label) > 1:
+            # same file name in different directories
+            prompt_label += "-" + hashlib.sha256(str(prompt_path.resolve()).encode("utf-8")).hexdigest()[:6]
+        name = f"{model_tag(model)}__{prompt_label}__t{temperature:g}_p{top_p:g}"
+        # A single combination writes straight into output_dir, as before sweeps existed
+        output_dir = args.output_dir if len(combos) == 1 else args.output_dir / name
+        cells.append(Cell(name=name, model=model, prompt_path=prompt_path, prompt_text=read_prompt(prompt_path),
+                          temperature=temperature, top_p=top_p, output_dir=output_dir))
+    return cells
 
-def process_one(img_path: Path, client: GeminiHazardClient, prompt_text: str, output_dir: Path, model_name: str):
+def process_one(img_path: Path, cell: Cell):
+    cell.limiter.acquire()
     # call model with detailed timing
     start_time = time.time()
-    raw_dict, raw_text = client.analyze(img_path, prompt_text)
-    end_time = time.time()
+    usage = {}
+    try:
+        raw_dict, raw_text = cell.client.analyze(img_path, cell.prompt_text, response_schema=HazardOutput,
+                                                 validate=lambda d: HazardOutput(**d), usage=usage)
+    except Exception as e:
+        cell.manifest.mark_failed(img_path, e)
+        raise
+    finally:
+        end_time = time.time()
+        cell.limiter.release()
+        cell.limiter.record((end_time - start_time) * 1000)
+
+    return finish_one(img_path, raw_dict, (end_time - start_time) * 1000, cell, usage)
+
+async def process_one_async(img_path: Path, cell: Cell):
+    await cell.limiter.acquire_async()
+    start_time = time.time()
+    usage = {}
+    try:
+        raw_dict, raw_text = await cell.client.analyze_async(img_path, cell.prompt_text, response_schema=HazardOutput,
+                                                             validate=lambda d: HazardOutput(**d), usage=usage)
+    except Exception as e:
+        cell.manifest.mark_failed(img_path, e)
+        raise
+    finally:
+        end_time = time.time()
+        cell.limiter.release()
+        cell.limiter.record((end_time - start_time) * 1000)
 
-    total_latency_ms = (end_time - start_time) * 1000
+    return finish_one(img_path, raw_dict, (end_time - start_time) * 1000, cell, usage)
 
+def finish_one(img_path: Path, raw_dict: dict, total_latency_ms: float, cell: Cell, usage: dict = None):
     # validation timing
     validation_start = time.time()
     ho = HazardOutput(**raw_dict).normalized()
@@ -45,47 +115,309 @@ def process_one(img_path: Path, client: GeminiHazardClient, prompt_text: str, ou
     env = OutputEnvelope(
         _meta={
             "source_image": str(img_path),
-            "model": model_name,
+            "model": cell.model,
             "prompt_version": PROMPT_VERSION,
+            "prompt_path": str(cell.prompt_path),
+            "temperature": cell.temperature,
+            "top_p": cell.top_p,
             "timestamp": datetime.now(timezone.utc).isoformat(),
             "latency": {
                 "total_ms": round(total_latency_ms, 2),
                 "api_processing_ms": round(api_processing_ms, 2),
                 "validation_ms": round(validation_ms, 2)
-            }
+            },
+            # Tokens summed over all attempts (None if the API reported none)
+            "usage": dict(usage, cost_usd=estimate_cost(cell.model, usage)) if usage else None
         },
         result=ho
     )
-    out_path = save_json(output_dir, img_path, model_name, env.model_dump())
+    payload = env.model_dump(by_alias=True)
+    if cell.sink is None:
+        out_path = save_prediction_file(cell.output_dir, payload)
+        cell.manifest.mark_completed(img_path, out_path, total_latency_ms, usage)
+    else:
+        # Completed in the manifest only once the record's batch is fsynced
+        out_path = cell.sink.path
+        cell.sink.write(payload, on_durable=lambda offset, length: cell.manifest.mark_completed(
+            img_path, out_path, total_latency_ms, usage, offset, length))
     return img_path, out_path, total_latency_ms
 
+def record_outcome(cell: Cell, outcome, i: int, n: int, overall_start: float, sweep: bool):
+    label = f"{cell.name} " if sweep else ""
+    cell.finished_s = time.time() - overall_start
+    if isinstance(outcome, Exception):
+        cell.failures.append(str(outcome))
+        print(f"✗ [{i}/{n}] {label}error: {outcome}")
+    else:
+        img, outp, latency = outcome
+        cell.results.append((img, outp))
+        cell.latencies.append(latency)
+        print(f"✓ [{i}/{n}] {label}{img.name} ({latency:.0f}ms)")
+
+async def run_async(work: List[tuple], overall_start: float, sweep: bool):
+    """--use_async driver: one event loop for every cell; each model's limiter caps its requests in flight."""
+    async def guarded(cell: Cell, img: Path):
+        try:
+            return cell, await process_one_async(img, cell)
+        except Exception as e:
+            return cell, e
+
+    tasks = [asyncio.create_task(guarded(cell, img)) for cell, img in work]
+    try:
+        for i, fut in enumerate(asyncio.as_completed(tasks), 1):
+            cell, outcome = await fut
+            record_outcome(cell, outcome, i, len(work), overall_start, sweep)
+    finally:
+        for task in tasks:
+            task.cancel()  # e.g. Ctrl-C: abandon everything still waiting
+
+def run_threads(work: List[tuple], pool_size: int, overall_start: float, sweep: bool):
+    """One thread pool per model, so a model waiting on its own quota never holds up the others."""
+    pools: Dict[str, ThreadPoolExecutor] = {}
+    futs = {}
+    try:
+        for cell, img in work:
+            if cell.model not in pools:
+                # With --adaptive the pool is sized for the upper bound; the limiter gates how many run
+                pools[cell.model] = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix=model_tag(cell.model))
+            futs[pools[cell.model].submit(process_one, img, cell)] = cell
+        for i, fut in enumerate(as_completed(futs), 1):
+            try:
+                outcome = fut.result()
+            except Exception as e:
+                outcome = e
+            record_outcome(futs[fut], outcome, i, len(work), overall_start, sweep)
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True, cancel_futures=True)
+
+def cell_statistics(cell: Cell, args, images: List[Path], total_time: float, max_workers: int) -> dict:
+    """aggregate_statistics.json for one cell (empty if nothing succeeded)."""
+    latencies = cell.latencies
+    if not latencies:
+        return {}
+    client = cell.client
+    usage_totals = client.usage_stats.totals()
+    sorted_latencies = sorted(latencies)
+    return {
+        "total_images": len(images),
+        "successful": len(cell.results),
+        "failures": len(cell.failures),
+        "total_time_seconds": round(total_time, 2),
+        # When this cell's last image finished; in a sweep the cells share total_time_seconds
+        "cell_time_seconds": round(cell.finished_s, 2),
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies), 2),
+            "median": round(statistics.median(latencies), 2),
+            "stdev": round(statistics.stdev(latencies), 2) if len(latencies) > 1 else 0,
+            "min": round(min(latencies), 2),
+            "max": round(max(latencies), 2),
+            "p50": round(sorted_latencies[len(sorted_latencies)//2], 2),
+            "p95": round(sorted_latencies[int(len(sorted_latencies)*0.95)], 2),
+            "p99": round(sorted_latencies[int(len(sorted_latencies)*0.99)], 2) if len(sorted_latencies) > 10 else round(max(latencies), 2)
+        },
+        "config": {
+            "cell": cell.name,
+            "model": cell.model,
+            "prompt_path": str(cell.prompt_path),
+            "rpm_limit": args.rpm_limit,
+            "rpm_burst": args.rpm_burst,
+            "max_concurrency": max_workers,
+            "adaptive": args.adaptive,
+            "async": args.use_async,
+            "temperature": cell.temperature,
+            "top_p": cell.top_p,
+            "prompt_version": PROMPT_VERSION
+        },
+        # Shared by every cell of the same model (Gemini quotas are per model)
+        "rate_limiter": client.rate_limiter.stats() if client.rate_limiter else None,
+        "retries": client.retry_policy.stats(),
+        # AIMD trajectory: every limit adjustment with its window's latency, 429s and throughput
+        "concurrency": cell.limiter.stats() if args.adaptive else None,
+        "output": client.output_stats.snapshot(),
+        # Billed tokens in this invocation, retries included; replayed and resumed images cost nothing
+        "usage": {
+            "totals": usage_totals,
+            "mean_per_image": {k: round(v / len(cell.todo), 1) for k, v in usage_totals.items()} if cell.todo else {},
+            "by_model_schema": client.usage_stats.snapshot()
+        },
+        "cassette": client.cassette.stats() if client.cassette else None,
+        "predictions": cell.sink.stats() if cell.sink else None,
+        # latency_ms and successful include images completed by earlier runs; total_time_seconds does not
+        "manifest": {
+            "path": str(cell.manifest.path),
+            "config_hash": cell.manifest.config_hash,
+            "resumed": args.resume,
+            "completed_earlier": len(cell.done),
+            "processed_now": len(cell.todo),
+            "status": cell.manifest.counts(images)
+        },
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
+def print_summary(cell: Cell, stats: dict, images: List[Path], total_time: float):
+    print("\n" + "="*60)
+    print("Summary")
+    print("="*60)
+    print(f"  Processed: {len(cell.results)}/{len(images)} images")
+    if cell.done:
+        print(f"  Completed in earlier runs: {len(cell.done)}")
+    print(f"  Failures: {len(cell.failures)}")
+    print(f"  Total time: {total_time:.1f}s ({total_time/60:.1f} min)")
+    if stats:
+        print(f"\n  Latency Statistics:")
+        print(f"    Mean:   {stats['latency_ms']['mean']:.0f}ms")
+        print(f"    Median: {stats['latency_ms']['median']:.0f}ms")
+        print(f"    Stdev:  {stats['latency_ms']['stdev']:.0f}ms")
+        print(f"    P95:    {stats['latency_ms']['p95']:.0f}ms")
+        print(f"    P99:    {stats['latency_ms']['p99']:.0f}ms")
+        print(f"    Range:  {stats['latency_ms']['min']:.0f}ms - {stats['latency_ms']['max']:.0f}ms")
+        if stats["rate_limiter"]:
+            rl = stats["rate_limiter"]
+            print(f"\n  Rate limiter: {rl['waited']}/{rl['acquired']} requests waited, "
+                  f"mean {rl['mean_wait_s']:.1f}s, max {rl['max_wait_s']:.1f}s")
+        for key, out in stats["output"].items():
+            print(f"  Output {key}: {out['parse_failures']} parse / {out['validation_failures']} validation "
+                  f"failures in {out['responses']} replies")
+        if stats["cassette"]:
+            cs = stats["cassette"]
+            print(f"  Cassette ({cs['mode']}): {cs['hits']} replayed, {cs['misses']} missed, {cs['recorded']} recorded")
+        ut = stats["usage"]["totals"]
+        if ut.get("responses"):
+            print(f"  Tokens: {ut['prompt_tokens']} prompt / {ut['output_tokens']} output "
+                  f"in {ut['responses']} responses (~${ut['cost_usd']:.4f} at list price)")
+        if stats["concurrency"]:
+            cc = stats["concurrency"]
+            best = cc["best_sustained"]
+            print(f"  Adaptive concurrency: final {cc['final_limit']}, peak {cc['max_limit_reached']}, "
+                  f"{cc['decreases']} decreases"
+                  + (f"; best sustained {best['throughput_per_min']:.1f}/min at {best['limit']}" if best else ""))
+        if stats["predictions"]:
+            ps = stats["predictions"]
+            print(f"  Predictions: {ps['records']} records in {ps['batches']} fsynced batches")
+        rt = stats["retries"]
+        print(f"  Retries: {rt['retries']} (fatal {rt['fatal']}, exhausted {rt['exhausted']}, "
+              f"denied by budget {rt['budget_denied']})")
+    print(f"\n  Output dir: {cell.output_dir}")
+    if cell.sink:
+        print(f"  Predictions file: {cell.sink.path}")
+    if stats:
+        print(f"  Stats file: {cell.output_dir}/aggregate_statistics.json")
+    if cell.failures:
+        print(f"\n  First {min(5, len(cell.failures))} failures:")
+        for f in cell.failures[:5]:
+            print(f"    - {f}")
+
+def sweep_row(cell: Cell, stats: dict) -> dict:
+    """One row of the sweep grid: the cell's config next to its quality, latency and cost."""
+    row = {"cell": cell.name, "model": cell.model, "prompt_path": str(cell.prompt_path),
+           "temperature": cell.temperature, "top_p": cell.top_p,
+           "successful": len(cell.results), "failures": len(cell.failures),
+           "cell_time_seconds": round(cell.finished_s, 2), "output_dir": str(cell.output_dir)}
+    if stats:
+        outputs = list(stats["output"].values())
+        per_image = stats["usage"]["mean_per_image"]
+        row.update({
+            "latency_mean_ms": stats["latency_ms"]["mean"],
+            "latency_p95_ms": stats["latency_ms"]["p95"],
+            "parse_failures": sum(o["parse_failures"] for o in outputs),
+            "validation_failures": sum(o["validation_failures"] for o in outputs),
+            "prompt_tokens_per_image": per_image.get("prompt_tokens"),
+            "output_tokens_per_image": per_image.get("output_tokens"),
+            "cost_usd": stats["usage"]["totals"]["cost_usd"],
+        })
+    return row
+
+def print_sweep(rows: List[dict], total_time: float, output_dir: Path):
+    print("\n" + "="*60)
+    print(f"Sweep: {len(rows)} cells in {total_time:.1f}s ({total_time/60:.1f} min)")
+    print("="*60)
+    width = max(len(r["cell"]) for r in rows)
+    print(f"  {'cell':<{width}}  {'ok':>4} {'fail':>4} {'mean ms':>8} {'p95 ms':>8} {'invalid':>7} "
+          f"{'tok in':>7} {'tok out':>7} {'cost $':>8} {'time s':>7}")
+    for r in rows:
+        invalid = (r.get("parse_failures") or 0) + (r.get("validation_failures") or 0)
+        print(f"  {r['cell']:<{width}}  {r['successful']:>4} {r['failures']:>4} "
+              f"{r.get('latency_mean_ms') or 0:>8.0f} {r.get('latency_p95_ms') or 0:>8.0f} {invalid:>7} "
+              f"{r.get('prompt_tokens_per_image') or 0:>7.0f} {r.get('output_tokens_per_image') or 0:>7.0f} "
+              f"{r.get('cost_usd') or 0:>8.4f} {r['cell_time_seconds']:>7.1f}")
+    print(f"\n  Per-cell outputs and stats: {output_dir}/<cell>/")
+    print(f"  Grid: {output_dir}/sweep_summary.json")
+
 def main():
     ap = argparse.ArgumentParser(description="Gemini hazard detector (image -> JSON).")
     ap.add_argument("--images_dir", "-d", type=Path, help="Directory of images to scan.")
     ap.add_argument("--image_path", "-i", type=Path, help="Single image path.")
     ap.add_argument("--num_samples", "-n", type=int, default=None, help="Random sample size from images_dir.")
     ap.add_argument("--output_dir", "-o", type=Path, required=True, help="Where to write JSON files.")
-    ap.add_argument("--prompt_path", "-p", type=Path,
-                    default=Path("/Users/prabhavsingh/Documents/CLASSES/Fall2025/NAVAID/MILESTONE1/GUIDANCE_METRICS/prompts/prompt.md"))
-    ap.add_argument("--model", "-m", default="gemini-2.5-flash",
-                    choices=["gemini-2.5-flash", "gemini-2.5-pro", "gemini-2.5-flash-lite", "gemini-2.0-flash"], help="Gemini model to use.")
-    ap.add_argument("--temperature", type=float, default=0.2)
-    ap.add_argument("--top_p", type=float, default=0.8)
+    # --prompt_path, --model, --temperature and --top_p accept several values: every combination
+    # becomes a sweep cell writing to its own subdirectory of output_dir
+    ap.add_argument("--prompt_path", "-p", type=Path, nargs="+",
+                    default=[Path("/Users/prabhavsingh/Documents/CLASSES/Fall2025/NAVAID/MILESTONE1/GUIDANCE_METRICS/prompts/prompt.md")])
+    ap.add_argument("--model", "-m", nargs="+", default=["gemini-2.5-flash"],
+                    choices=MODELS, help="Gemini model(s) to use.")
+    ap.add_argument("--temperature", type=float, nargs="+", default=[0.2])
+    ap.add_argument("--top_p", type=float, nargs="+", default=[0.8])
     ap.add_argument("--max_concurrency", type=int, default=2,
-                    help="Max parallel requests (default: 2 for free tier, use 4+ for paid)")
+                    help="Max parallel requests per model (default: 2 for free tier, use 4+ for paid); "
+                         "with --adaptive, the starting concurrency")
+    ap.add_argument("--adaptive", action="store_true",
+                    help="Adapt concurrency during the run (AIMD): +1 while latency and 429s stay healthy, "
+                         "halve when they don't")
+    ap.add_argument("--adaptive_max", type=int, default=32,
+                    help="Upper bound for --adaptive concurrency (default: 32)")
     ap.add_argument("--rpm_limit", type=int, default=10,
-                    help="Requests per minute limit (default: 10 for free tier, 0 = no limit)")
+                    help="Requests per minute limit per model (default: 10 for free tier, 0 = no limit)")
+    ap.add_argument("--rpm_burst", type=int, default=1,
+                    help="Requests allowed back to back before pacing kicks in (default: 1 = evenly spaced)")
+    ap.add_argument("--use_async", action="store_true",
+                    help="Drive all requests from one asyncio event loop instead of a thread pool")
+    ap.add_argument("--cassette_dir", type=Path, default=None,
+                    help="Record/replay store for model replies (keyed by image, prompt, model and config)")
+    ap.add_argument("--cassette_mode", choices=CASSETTE_MODES, default="auto",
+                    help="auto: replay if recorded, else call and record; replay: recordings only (no API key needed); "
+                         "record: always call and overwrite; off: ignore the store")
+    ap.add_argument("--simulate_latency", action="store_true",
+                    help="When replaying, sleep for each reply's recorded latency")
+    ap.add_argument("--latency_scale", type=float, default=1.0,
+                    help="Multiplier for simulated latency (e.g. 0.1 for a 10x faster dry run)")
+    ap.add_argument("--resume", action="store_true",
+                    help="Skip images already completed in output_dir/run_manifest.jsonl with the same model, "
+                         "sampling and prompt; retry failed and pending ones")
+    ap.add_argument("--output_format", choices=["jsonl", "json"], default="jsonl",
+                    help="jsonl: append every prediction to output_dir/predictions.jsonl in fsynced batches; "
+                         "json: one pretty JSON file per image (also available later via python -m gemini_api.predictions)")
     ap.add_argument("--seed", type=int, default=7)
     args = ap.parse_args()
 
     # inputs
-    prompt_text = read_prompt(args.prompt_path)
+    cells = build_cells(args)
+    sweep = len(cells) > 1
+    models = list(dict.fromkeys(cell.model for cell in cells))
     api_key = os.getenv("GOOGLE_API_KEY", "")
-    client = GeminiHazardClient(api_key=api_key, model_name=args.model,
-                                temperature=args.temperature, top_p=args.top_p,
-                                rpm_limit=args.rpm_limit)
+    # concurrency (cap for pro, respect rate limits); --adaptive starts here and finds the limit itself
+    max_workers = {}
+    for model in models:
+        max_workers[model] = min(args.max_concurrency, 2 if "pro" in model else args.max_concurrency)
+        if max_workers[model] < args.max_concurrency:
+            print(f"ℹ️  {model}: concurrency capped at {max_workers[model]}"
+                  + (" to start (--adaptive may raise it)" if args.adaptive else " (use --adaptive to probe higher)"))
+    pool_size = max(args.adaptive_max, *max_workers.values()) if args.adaptive else max(max_workers.values())
+    cassette = None
+    if args.cassette_dir is not None:
+        cassette = Cassette(args.cassette_dir, mode=args.cassette_mode,
+                            simulate_latency=args.simulate_latency, latency_scale=args.latency_scale)
+    for cell in cells:
+        # A client per cell keeps retry, reply and token counters per cell; the token
+        # bucket is shared per model, since that is how Gemini enforces quotas
+        cell.client = GeminiHazardClient(api_key=api_key, model_name=cell.model,
+                                         temperature=cell.temperature, top_p=cell.top_p,
+                                         rpm_limit=args.rpm_limit, rpm_burst=args.rpm_burst,
+                                         async_concurrency=pool_size, cassette=cassette,
+                                         rate_limit_scope=cell.model,
+                                         output_stats=OutputStats(), usage_stats=UsageStats())
 
-    # gather images
+    # gather images (one pool for every cell)
     images: List[Path] = []
     if args.image_path:
         if not args.image_path.exists():
@@ -104,96 +436,107 @@ def main():
     if not images:
         raise SystemExit("No images found.")
 
-    # concurrency (cap for pro, respect rate limits)
-    max_workers = min(args.max_concurrency, 2 if "pro" in args.model else args.max_concurrency)
+    # One concurrency limit per model, shared by all of its cells
+    for model in models:
+        model_cells = [cell for cell in cells if cell.model == model]
+        if args.adaptive:
+            def on_change(event, model=model):
+                arrow = "📈" if event["new_limit"] > event["limit"] else "📉"
+                print(f"{arrow} {model + ' ' if sweep else ''}concurrency {event['limit']} → {event['new_limit']} "
+                      f"(median {event['median_ms']:.0f}ms vs best {event['baseline_ms']:.0f}ms, "
+                      f"{event['rate_limited']} rate-limited, {event['throughput_per_min']:.1f}/min)")
+            limiter = AIMDController(
+                initial=max_workers[model], max_limit=pool_size, on_change=on_change,
+                rate_limited_count=lambda cs=model_cells: sum(c.client.retry_policy.stats()["rate_limited"] for c in cs))
+        else:
+            limiter = ConcurrencyLimit(max_workers[model])
+        for cell in model_cells:
+            cell.limiter = limiter
 
-    # Warn if concurrency might cause rate limit issues
-    if args.rpm_limit > 0 and max_workers > args.rpm_limit / 6:
-        print(f"⚠️  Warning: max_concurrency={max_workers} with rpm_limit={args.rpm_limit} may cause initial rate limit hits")
-        print(f"   Recommended: --max_concurrency {max(1, args.rpm_limit // 10)} for smoother operation\n")
+    # Run manifest per cell: one entry per image, keyed by image + hash of everything that shapes the output
+    for cell in cells:
+        cell.manifest = RunManifest(cell.output_dir, {
+            "model": cell.model, "temperature": cell.temperature, "top_p": cell.top_p,
+            "prompt_version": PROMPT_VERSION,
+            "prompt_sha256": hashlib.sha256(cell.prompt_text.encode("utf-8")).hexdigest()
+        })
+        if args.output_format == "jsonl":
+            cell.sink = PredictionSink(cell.output_dir)
+        for img in images:
+            entry = cell.manifest.completed(img)
+            if entry is not None:
+                cell.done[img] = entry
+        label = f"{cell.name}: " if sweep else ""
+        if args.resume:
+            cell.todo = [img for img in images if img not in cell.done]
+            print(f"⏭️  {label}Resuming: {len(cell.done)}/{len(images)} images already completed, "
+                  f"{len(cell.todo)} to process")
+        else:
+            if cell.done:
+                print(f"ℹ️  {label}{len(cell.done)} of these images are already completed with this config; "
+                      f"use --resume to skip them")
+            cell.todo, cell.done = images, {}
+        cell.todo_set = set(cell.todo)
+        cell.manifest.mark_pending(cell.todo)
+        # Images completed by earlier runs count towards this run's results and latency stats
+        cell.results = [(img, Path(entry["output"])) for img, entry in cell.done.items()]
+        cell.latencies = [entry["latency_ms"] for entry in cell.done.values()]
+    if args.resume or any(cell.done for cell in cells):
+        print()
 
-    # Estimate time
-    if args.rpm_limit > 0:
-        est_minutes = len(images) / args.rpm_limit
-        print(f"📊 Processing {len(images)} images at ~{args.rpm_limit} RPM")
-        print(f"   Estimated time: {est_minutes:.1f} minutes (~{est_minutes*60:.0f} seconds)\n")
+    # The token bucket paces requests regardless of thread count; only a large
+    # burst can push the first minute over quota
+    if args.rpm_limit > 0 and args.rpm_burst > max(1, args.rpm_limit // 2):
+        print(f"⚠️  Warning: rpm_burst={args.rpm_burst} with rpm_limit={args.rpm_limit} may cause initial rate limit hits")
+        print(f"   Recommended: --rpm_burst {max(1, args.rpm_limit // 5)} or lower\n")
 
-    results = []
-    failures = []
-    latencies = []
+    # Image-major order: every cell asks for an image while its encoded bytes are still cached
+    work = [(cell, img) for img in images for cell in cells if img in cell.todo_set]
 
-    overall_start = time.time()
-    with ThreadPoolExecutor(max_workers=max_workers) as ex:
-        futs = [ex.submit(process_one, img, client, prompt_text, args.output_dir, args.model) for img in images]
-        for i, fut in enumerate(as_completed(futs), 1):
-            try:
-                img, outp, latency = fut.result()
-                results.append((img, outp))
-                latencies.append(latency)
-                print(f"✓ [{i}/{len(images)}] {img.name} ({latency:.0f}ms)")
-            except Exception as e:
-                failures.append(str(e))
-                print(f"✗ [{i}/{len(images)}] error: {e}")
+    # Estimate time (replays are not rate limited); models run side by side, so the busiest one decides
+    if args.rpm_limit > 0 and cassette is None:
+        per_model = {model: sum(1 for cell, _ in work if cell.model == model) for model in models}
+        est_minutes = max(per_model.values()) / args.rpm_limit
+        print(f"📊 Processing {len(work)} " + (f"requests over {len(cells)} cells" if sweep else "images")
+              + f" at ~{args.rpm_limit} RPM" + (" per model" if len(models) > 1 else ""))
+        print(f"   Estimated time: {est_minutes:.1f} minutes (~{est_minutes*60:.0f} seconds)\n")
 
+    overall_start = time.time()
+    try:
+        if args.use_async:
+            asyncio.run(run_async(work, overall_start, sweep))
+        else:
+            run_threads(work, pool_size, overall_start, sweep)
+    finally:
+        # Write the last partial batches, also on Ctrl-C
+        for cell in cells:
+            if cell.sink is not None:
+                cell.sink.close()
     total_time = time.time() - overall_start
 
-    # Compute aggregate statistics
-    stats = {}
-    if latencies:
-        import statistics
-        sorted_latencies = sorted(latencies)
-        stats = {
+    # Compute and save aggregate statistics, one file per cell
+    rows = []
+    for cell in cells:
+        stats = cell_statistics(cell, args, images, total_time, max_workers[cell.model])
+        if stats:
+            stats_path = cell.output_dir / "aggregate_statistics.json"
+            stats_path.write_text(json.dumps(stats, indent=2))
+        if sweep:
+            rows.append(sweep_row(cell, stats))
+        else:
+            print_summary(cell, stats, images, total_time)
+
+    if sweep:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+        (args.output_dir / "sweep_summary.json").write_text(json.dumps({
             "total_images": len(images),
-            "successful": len(results),
-            "failures": len(failures),
             "total_time_seconds": round(total_time, 2),
-            "latency_ms": {
-                "mean": round(statistics.mean(latencies), 2),
-                "median": round(statistics.median(latencies), 2),
-                "stdev": round(statistics.stdev(latencies), 2) if len(latencies) > 1 else 0,
-                "min": round(min(latencies), 2),
-                "max": round(max(latencies), 2),
-                "p50": round(sorted_latencies[len(sorted_latencies)//2], 2),
-                "p95": round(sorted_latencies[int(len(sorted_latencies)*0.95)], 2),
-                "p99": round(sorted_latencies[int(len(sorted_latencies)*0.99)], 2) if len(sorted_latencies) > 10 else round(max(latencies), 2)
-            },
-            "config": {
-                "model": args.model,
-                "rpm_limit": args.rpm_limit,
-                "max_concurrency": max_workers,
-                "temperature": args.temperature,
-                "top_p": args.top_p,
-                "prompt_version": PROMPT_VERSION
-            },
+            "cells": rows,
+            # Each image is read and encoded once however many cells use it
+            "image_cache": IMAGE_CACHE.stats(),
             "timestamp": datetime.now(timezone.utc).isoformat()
-        }
-
-        # Save aggregate stats
-        stats_path = args.output_dir / "aggregate_statistics.json"
-        stats_path.write_text(json.dumps(stats, indent=2))
-
-    # Print summary
-    print("\n" + "="*60)
-    print("Summary")
-    print("="*60)
-    print(f"  Processed: {len(results)}/{len(images)} images")
-    print(f"  Failures: {len(failures)}")
-    print(f"  Total time: {total_time:.1f}s ({total_time/60:.1f} min)")
-    if latencies:
-        print(f"\n  Latency Statistics:")
-        print(f"    Mean:   {stats['latency_ms']['mean']:.0f}ms")
-        print(f"    Median: {stats['latency_ms']['median']:.0f}ms")
-        print(f"    Stdev:  {stats['latency_ms']['stdev']:.0f}ms")
-        print(f"    P95:    {stats['latency_ms']['p95']:.0f}ms")
-        print(f"    P99:    {stats['latency_ms']['p99']:.0f}ms")
-        print(f"    Range:  {stats['latency_ms']['min']:.0f}ms - {stats['latency_ms']['max']:.0f}ms")
-    print(f"\n  Output dir: {args.output_dir}")
-    if stats:
-        print(f"  Stats file: {args.output_dir}/aggregate_statistics.json")
-    if failures:
-        print(f"\n  First {min(5, len(failures))} failures:")
-        for f in failures[:5]:
-            print(f"    - {f}")
+        }, indent=2))
+        print_sweep(rows, total_time, args.output_dir)
 
 if __name__ == "__main__":
     main()
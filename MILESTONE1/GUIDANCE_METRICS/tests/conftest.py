@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Tests import the gemini_api package the way main.py does, from MILESTONE1/GUIDANCE_METRICS
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
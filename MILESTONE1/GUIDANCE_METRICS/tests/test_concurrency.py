@@ -0,0 +1,81 @@
+"""Window and decrease logic of gemini_api.concurrency.AIMDController."""
+
+from gemini_api.concurrency import AIMDController
+
+
+def window(ctl, latency_ms, n=None):
+    """Complete one full window of requests at `latency_ms`."""
+    for _ in range(n or max(ctl.min_window, int(ctl.limit))):
+        ctl.record(latency_ms)
+
+
+def test_window_is_min_window_or_the_limit():
+    ctl = AIMDController(initial=2, min_window=4)
+    window(ctl, 100, n=3)
+    assert ctl.trajectory == []
+    ctl.record(100)
+    assert [e["requests"] for e in ctl.trajectory] == [4]
+
+    ctl = AIMDController(initial=6, min_window=4)
+    window(ctl, 100, n=5)
+    assert ctl.trajectory == []
+    ctl.record(100)
+    assert ctl.trajectory[0]["requests"] == 6
+
+
+def test_healthy_windows_increase_additively_up_to_max():
+    ctl = AIMDController(initial=2, max_limit=4, min_window=1)
+    for _ in range(4):
+        window(ctl, 100)
+    assert [e["new_limit"] for e in ctl.trajectory] == [3, 4, 4, 4]
+
+
+def test_slow_window_decreases_multiplicatively():
+    ctl = AIMDController(initial=8, min_window=1, latency_slack=2.0)
+    window(ctl, 100)
+    assert ctl.limit == 9
+    window(ctl, 199)  # within the slack of the 100 ms baseline
+    assert ctl.limit == 10
+    window(ctl, 250)
+    assert ctl.limit == 5
+    assert ctl.trajectory[-1]["congested"] and ctl.trajectory[-1]["baseline_ms"] == 100
+
+
+def test_window_after_a_decrease_holds():
+    ctl = AIMDController(initial=8, min_window=1)
+    window(ctl, 100)
+    window(ctl, 500)
+    assert ctl.limit == 4.5
+    window(ctl, 500)  # started under the old limit: already answered
+    assert ctl.limit == 4.5
+    window(ctl, 500)
+    assert ctl.limit == 2.25
+
+
+def test_rate_limits_decrease_even_at_baseline_latency():
+    rate_limited = [0]
+    ctl = AIMDController(initial=8, min_window=1, rate_limited_count=lambda: rate_limited[0])
+    window(ctl, 100)
+    rate_limited[0] += 1
+    window(ctl, 100)
+    assert ctl.limit == 4.5
+    assert ctl.trajectory[-1]["rate_limited"] == 1
+    window(ctl, 100)  # the 429 is counted once, not again in the next window
+    assert ctl.trajectory[-1]["rate_limited"] == 0
+    assert ctl.limit == 5.5
+
+
+def test_decrease_never_goes_below_min_limit():
+    ctl = AIMDController(initial=2, min_limit=2, min_window=1)
+    window(ctl, 100)
+    window(ctl, 1000)
+    assert ctl.limit == 2
+
+
+def test_on_change_only_for_limit_changes():
+    changes = []
+    ctl = AIMDController(initial=1, max_limit=2, min_window=1, on_change=changes.append)
+    for _ in range(3):
+        window(ctl, 100)
+    assert [(e["limit"], e["new_limit"]) for e in changes] == [(1, 2)]
+    assert ctl.stats()["max_limit_reached"] == 2
@@ -0,0 +1,45 @@
+"""Batching and torn-line handling of gemini_api.predictions.PredictionSink."""
+
+import json
+
+from gemini_api.predictions import FILENAME, PredictionSink, read_prediction_at, read_predictions
+
+
+def record(i):
+    return {"_meta": {"source_image": f"img{i}.jpg", "model": "gemini-2.5-flash", "prompt_version": "1"}, "i": i}
+
+
+def test_batches_and_reports_offsets(tmp_path):
+    durable = []
+    with PredictionSink(tmp_path, batch_size=2, fsync=False) as sink:
+        sink.write(record(0), lambda off, n: durable.append((0, off, n)))
+        assert durable == []  # still buffered
+        sink.write(record(1), lambda off, n: durable.append((1, off, n)))
+        assert len(durable) == 2
+        sink.write(record(2), lambda off, n: durable.append((2, off, n)))
+    assert sink.stats()["batches"] == 2
+    for i, offset, length in durable:
+        assert read_prediction_at(tmp_path / FILENAME, offset, length) == record(i)
+
+
+def test_readers_skip_a_torn_last_line(tmp_path):
+    path = tmp_path / FILENAME
+    path.write_bytes((json.dumps(record(0)) + "\n" + json.dumps(record(1))[:20]).encode())
+    assert list(read_predictions(path)) == [record(0)]
+
+
+def test_appending_after_a_torn_line_keeps_new_records_intact(tmp_path):
+    path = tmp_path / FILENAME
+    path.write_bytes((json.dumps(record(0)) + "\n" + json.dumps(record(1))[:20]).encode())
+    durable = []
+    with PredictionSink(tmp_path, fsync=False) as sink:
+        sink.write(record(2), lambda off, n: durable.append((off, n)))
+    assert [r["i"] for r in read_predictions(path)] == [0, 2]
+    assert read_prediction_at(path, *durable[0]) == record(2)
+
+
+def test_read_prediction_at_rejects_a_stale_offset(tmp_path):
+    path = tmp_path / FILENAME
+    path.write_text(json.dumps(record(0)) + "\n")
+    assert read_prediction_at(path, 5, 10) is None
+    assert read_prediction_at(tmp_path / "missing.jsonl", 0, 10) is None
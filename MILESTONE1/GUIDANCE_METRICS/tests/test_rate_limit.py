@@ -0,0 +1,125 @@
+"""Refill, burst, refunds and lock-free waiting of gemini_api.rate_limit.TokenBucket."""
+
+import asyncio
+import threading
+
+import pytest
+
+from gemini_api import rate_limit
+from gemini_api.rate_limit import RateLimitTimeout, TokenBucket, rpm_to_rate, shared_bucket
+
+
+class Clock:
+    """Fake monotonic clock; sleep() advances it and runs an optional hook first."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+        self.on_sleep = None
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if self.on_sleep is not None:
+            self.on_sleep()
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(rate_limit.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_burst_then_waits_at_the_refill_rate(clock):
+    bucket = TokenBucket(rate_per_s=2.0, burst=3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert clock.sleeps == pytest.approx([0.5, 0.5])
+
+
+def test_reservations_queue_without_sleeping_in_order(clock):
+    bucket = TokenBucket(rate_per_s=1.0, burst=1)
+    bucket.acquire()
+    # Three callers reserving at the same instant each get their own later slot
+    assert [bucket._reserve(None) for _ in range(3)] == pytest.approx([1.0, 2.0, 3.0])
+
+
+def test_refill_is_capped_at_burst(clock):
+    bucket = TokenBucket(rate_per_s=1.0, burst=2)
+    bucket.acquire(), bucket.acquire()
+    clock.now += 1.0
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == pytest.approx(1.0)
+    clock.now += 1000.0
+    assert [bucket.acquire() for _ in range(3)] == pytest.approx([0.0, 0.0, 1.0])
+
+
+def test_timeout_does_not_consume_a_token(clock):
+    bucket = TokenBucket(rate_per_s=1.0, burst=1)
+    bucket.acquire()
+    with pytest.raises(RateLimitTimeout):
+        bucket.acquire(timeout=0.5)
+    assert bucket.acquire(timeout=1.0) == pytest.approx(1.0)
+    assert bucket.stats()["acquired"] == 2
+
+
+def test_cancelled_wait_refunds_its_token(clock):
+    bucket = TokenBucket(rate_per_s=1.0, burst=1)
+    bucket.acquire()
+    cancel = threading.Event()
+    cancel.set()
+    bucket.acquire(cancel_event=cancel)  # gives up at once: the reserved slot is returned
+    assert bucket._reserve(None) == pytest.approx(1.0)
+
+
+def test_cancelled_async_wait_refunds_its_token(clock):
+    bucket = TokenBucket(rate_per_s=0.01, burst=1)
+    bucket.acquire()
+
+    async def cancel_waiter():
+        task = asyncio.ensure_future(bucket.acquire_async())
+        await asyncio.sleep(0)  # let it reserve and start sleeping
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_waiter())
+    assert bucket._reserve(None) == pytest.approx(100.0)
+
+
+def test_waiting_holds_no_lock(clock):
+    bucket = TokenBucket(rate_per_s=1.0, burst=1)
+    other = TokenBucket(rate_per_s=1.0, burst=1)  # e.g. another API key's bucket
+    bucket.acquire()
+    seen = {}
+
+    def while_sleeping():
+        seen["own_lock_free"] = bucket._lock.acquire(blocking=False)
+        if seen["own_lock_free"]:
+            bucket._lock.release()
+        seen["other_wait"] = other.acquire()
+
+    clock.on_sleep = while_sleeping
+    bucket.acquire()
+    assert seen == {"own_lock_free": True, "other_wait": 0.0}
+
+
+def test_shared_buckets_are_per_key_scope_and_limit():
+    a = shared_bucket("key-a", rpm_limit=60)
+    assert shared_bucket("key-a", rpm_limit=60) is a
+    assert shared_bucket("key-a", rpm_limit=60, scope="gemini-2.5-pro") is not a
+    assert shared_bucket("key-c", rpm_limit=60) is not a
+    assert shared_bucket("key-a", rpm_limit=30) is not a
+
+
+def test_rpm_to_rate_keeps_a_minute_under_the_limit():
+    rate = rpm_to_rate(60, burst=5)
+    # A full burst plus a minute of refill stays under 60 requests
+    assert 5 + rate * 60 <= 60
+    assert rpm_to_rate(1, burst=10) == pytest.approx(1 / 60)
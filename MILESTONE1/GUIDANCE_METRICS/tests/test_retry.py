@@ -0,0 +1,124 @@
+"""Retry-After parsing, jittered backoff and the retry budget in gemini_api.retry."""
+
+import email.utils
+import random
+import time
+from types import SimpleNamespace
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from gemini_api import retry
+from gemini_api.retry import FATAL, RATE_LIMITED, RETRYABLE, RetryBudget, RetryPolicy, classify, server_retry_delay
+
+
+def with_headers(exc_type, headers, message="error"):
+    return exc_type(message, response=SimpleNamespace(headers=headers))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(retry.time, "monotonic", lambda: clock.now)
+    return clock
+
+
+@pytest.mark.parametrize("exc, kind", [
+    (google_exceptions.TooManyRequests("429"), RATE_LIMITED),
+    (google_exceptions.ResourceExhausted("quota"), RATE_LIMITED),
+    (google_exceptions.ServiceUnavailable("503"), RETRYABLE),
+    (google_exceptions.InvalidArgument("bad"), FATAL),
+    (ValueError("bad JSON"), RETRYABLE),
+    (ConnectionError("reset"), RETRYABLE),
+    (KeyError("bug"), FATAL),
+])
+def test_classify(exc, kind):
+    assert classify(exc) == kind
+
+
+def test_retry_after_seconds_header():
+    assert server_retry_delay(with_headers(google_exceptions.TooManyRequests, {"Retry-After": "7"})) == 7.0
+    assert server_retry_delay(with_headers(google_exceptions.TooManyRequests, {"retry-after": "1.5"})) == 1.5
+    assert server_retry_delay(with_headers(google_exceptions.TooManyRequests, {"Retry-After": "-3"})) == 0.0
+
+
+def test_retry_after_http_date_header():
+    when = email.utils.formatdate(time.time() + 30, usegmt=True)
+    delay = server_retry_delay(with_headers(google_exceptions.TooManyRequests, {"Retry-After": when}))
+    assert 28.0 <= delay <= 30.0
+    past = email.utils.formatdate(time.time() - 30, usegmt=True)
+    assert server_retry_delay(with_headers(google_exceptions.TooManyRequests, {"Retry-After": past})) == 0.0
+
+
+def test_unparseable_retry_after_falls_back_to_the_message():
+    exc = with_headers(google_exceptions.TooManyRequests, {"Retry-After": "soon"}, "Please retry in 12.5s.")
+    assert server_retry_delay(exc) == 12.5
+    assert server_retry_delay(with_headers(google_exceptions.TooManyRequests, {"Retry-After": "soon"})) is None
+
+
+def test_retry_info_detail_wins():
+    detail = SimpleNamespace(retry_delay=SimpleNamespace(seconds=4, nanos=500_000_000))
+    exc = google_exceptions.TooManyRequests("429", details=[detail],
+                                            response=SimpleNamespace(headers={"Retry-After": "60"}))
+    assert server_retry_delay(exc) == 4.5
+    assert server_retry_delay(google_exceptions.TooManyRequests("retry_delay { seconds: 9 }")) == 9.0
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_decorrelated_jitter_bounds(seed):
+    policy = RetryPolicy(max_attempts=10, base_s=1.0, cap_s=20.0, budget=None, rng=random.Random(seed))
+    attempt = policy.begin()
+    previous = 0.0
+    for _ in range(9):
+        delay = attempt.next_delay(google_exceptions.ServiceUnavailable("503"))
+        assert 1.0 <= delay <= min(20.0, max(1.0, previous) * 3)
+        previous = delay
+    assert attempt.next_delay(google_exceptions.ServiceUnavailable("503")) is None
+    assert policy.stats()["exhausted"] == 1
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_rate_limits_back_off_from_a_larger_base(seed):
+    policy = RetryPolicy(base_s=1.0, rate_limit_base_s=5.0, cap_s=60.0, budget=None, rng=random.Random(seed))
+    delay = policy.begin().next_delay(google_exceptions.TooManyRequests("429"))
+    assert 5.0 <= delay <= 15.0
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_server_delay_wins_with_a_little_jitter(seed):
+    policy = RetryPolicy(cap_s=1.0, budget=None, rng=random.Random(seed))
+    exc = with_headers(google_exceptions.TooManyRequests, {"Retry-After": "30"})
+    delay = policy.begin().next_delay(exc)
+    assert 30.0 <= delay <= 33.0
+    assert policy.stats()["server_delays"] == 1
+
+
+def test_fatal_errors_are_not_retried():
+    policy = RetryPolicy(budget=None)
+    assert policy.begin().next_delay(google_exceptions.InvalidArgument("bad")) is None
+    assert policy.stats()["fatal"] == 1
+
+
+def test_budget_allows_a_ratio_of_requests(clock):
+    budget = RetryBudget(ratio=0.5, min_retries_per_s=0.0, window_s=60.0)
+    for _ in range(4):
+        budget.record_request()
+    assert [budget.try_spend() for _ in range(3)] == [True, True, False]
+    assert budget.stats()["denied"] == 1
+
+
+def test_budget_floor_and_window(clock):
+    budget = RetryBudget(ratio=0.0, min_retries_per_s=0.05, window_s=60.0)  # 3 retries per minute
+    assert [budget.try_spend() for _ in range(4)] == [True, True, True, False]
+    clock.now += 61.0
+    assert budget.try_spend()
+
+
+def test_policy_gives_up_when_the_budget_is_spent(clock):
+    policy = RetryPolicy(max_attempts=5, budget=RetryBudget(ratio=0.0, min_retries_per_s=1 / 60, window_s=60.0),
+                         rng=random.Random(0))
+    attempt = policy.begin()
+    assert attempt.next_delay(google_exceptions.ServiceUnavailable("503")) is not None
+    assert attempt.next_delay(google_exceptions.ServiceUnavailable("503")) is None
+    assert policy.stats()["budget_denied"] == 1
+    assert policy.stats()["budget"]["retries_in_window"] == 1
@@ -0,0 +1,60 @@
+"""RunManifest.completed only trusts outputs that still hold what the run wrote."""
+
+import json
+
+from gemini_api.predictions import FILENAME, PredictionSink
+from gemini_api.run_manifest import RunManifest
+
+CONFIG = {"model": "gemini-2.5-flash", "temperature": 0.0}
+
+
+def complete_via_sink(tmp_path, manifest, image):
+    with PredictionSink(tmp_path, fsync=False) as sink:
+        sink.write({"_meta": {"source_image": str(image)}},
+                   lambda off, n: manifest.mark_completed(image, sink.path, 12.0, offset=off, length=n))
+
+
+def test_completed_record_at_its_offset(tmp_path):
+    manifest = RunManifest(tmp_path, CONFIG)
+    image = tmp_path / "a.jpg"
+    complete_via_sink(tmp_path, manifest, image)
+    entry = manifest.completed(image)
+    assert entry["output_offset"] == 0 and entry["latency_ms"] == 12.0
+    # Reloaded from run_manifest.jsonl
+    assert RunManifest(tmp_path, CONFIG).completed(image) == entry
+
+
+def test_truncated_predictions_file_makes_the_image_pending(tmp_path):
+    manifest = RunManifest(tmp_path, CONFIG)
+    image = tmp_path / "a.jpg"
+    complete_via_sink(tmp_path, manifest, image)
+    (tmp_path / FILENAME).write_text("")
+    assert manifest.completed(image) is None
+
+
+def test_record_of_another_image_at_the_offset_is_rejected(tmp_path):
+    manifest = RunManifest(tmp_path, CONFIG)
+    image = tmp_path / "a.jpg"
+    complete_via_sink(tmp_path, manifest, image)
+    # predictions.jsonl replaced by a file holding a different image at offset 0
+    (tmp_path / FILENAME).write_text(json.dumps({"_meta": {"source_image": str(tmp_path / "b.jpg")}}) + "\n")
+    assert manifest.completed(image) is None
+
+
+def test_changed_config_or_failure_is_not_completed(tmp_path):
+    manifest = RunManifest(tmp_path, CONFIG)
+    image = tmp_path / "a.jpg"
+    complete_via_sink(tmp_path, manifest, image)
+    assert RunManifest(tmp_path, dict(CONFIG, temperature=0.5)).completed(image) is None
+    manifest.mark_failed(image, TimeoutError("deadline"))
+    assert manifest.completed(image) is None
+    assert manifest.counts([image, tmp_path / "b.jpg"]) == {"pending": 1, "completed": 0, "failed": 1}
+
+
+def test_torn_manifest_line_is_skipped(tmp_path):
+    manifest = RunManifest(tmp_path, CONFIG)
+    image = tmp_path / "a.jpg"
+    complete_via_sink(tmp_path, manifest, image)
+    with open(tmp_path / RunManifest.FILENAME, "a", encoding="utf-8") as f:
+        f.write('{"key": "torn')
+    assert RunManifest(tmp_path, CONFIG).completed(image) is not None
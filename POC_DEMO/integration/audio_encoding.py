@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+audio_encoding.py - Compact TTS audio encodings for /api/tts
+
+Formats (negotiated from the request's "format" field or its Accept header):
+1. pcm16 - 16-bit PCM WAV (default; plays everywhere, half the size of float32 WAV)
+2. opus  - Ogg/Opus at a speech bitrate (~10-20x smaller than PCM; needs soundfile
+           with libsndfile >= 1.0.29, otherwise falls back to pcm16)
+
+Audio is encoded at the model's real output rate, optionally resampled down
+(e.g. to 16 kHz, plenty for speech). Float samples are clipped and scaled in
+place, so PCM encoding of a float32 array copies the samples twice: the int16
+conversion and the single join of header and payload into the returned bytes.
+"""
+
+import io
+import logging
+import struct
+from functools import lru_cache
+from math import gcd
+
+import numpy as np
+
+FORMATS = {
+    "pcm16": "audio/wav",
+    "opus": "audio/ogg",
+}
+DEFAULT_FORMAT = "pcm16"
+# libsndfile's Opus encoder only accepts these rates
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+# Output rates a client may ask for (Opus snaps down to one of OPUS_SAMPLE_RATES)
+SAMPLE_RATES = (8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000)
+
+log = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def opus_available() -> bool:
+    try:
+        import soundfile as sf
+        return "OPUS" in sf.available_subtypes("OGG")
+    except Exception:
+        return False
+
+
+def negotiate_format(requested=None, accept: str = "") -> str:
+    """Pick an output format from an explicit request, then the Accept header, then the default."""
+    requested = (requested or "").lower()
+    if requested not in FORMATS:
+        accept = (accept or "").lower()
+        requested = "opus" if ("audio/ogg" in accept or "audio/opus" in accept) else DEFAULT_FORMAT
+    if requested == "opus" and not opus_available():
+        log.warning("⚠️  Opus requested but not supported by soundfile/libsndfile; sending pcm16")
+        return DEFAULT_FORMAT
+    return requested
+
+
+def as_float32(audio) -> np.ndarray:
+    """Model output (list or array) as a float32 array; no copy if it already is one."""
+    return np.asarray(audio, dtype=np.float32).reshape(-1)
+
+
+def resample(audio: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """Polyphase resampling (anti-aliased) from src_rate to dst_rate."""
+    if not dst_rate or dst_rate == src_rate:
+        return audio
+    from scipy.signal import resample_poly
+    g = gcd(int(src_rate), int(dst_rate))
+    return resample_poly(audio, int(dst_rate) // g, int(src_rate) // g).astype(np.float32, copy=False)
+
+
+def _pcm16_wav(audio: np.ndarray, sample_rate: int) -> bytes:
+    # In place: clip and scale the float buffer, then a single int16 conversion
+    np.clip(audio, -1.0, 1.0, out=audio)
+    audio *= 32767.0
+    pcm = audio.astype("<i2")
+    data_bytes = pcm.nbytes
+    header = (b"RIFF" + struct.pack("<I", 36 + data_bytes) + b"WAVE"
+              + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+              + b"data" + struct.pack("<I", data_bytes))
+    return b"".join((header, memoryview(pcm).cast("B")))
+
+
+def _opus_ogg(audio: np.ndarray, sample_rate: int) -> bytes:
+    import soundfile as sf
+    out = io.BytesIO()
+    sf.write(out, audio, sample_rate, format="OGG", subtype="OPUS")
+    return out.getvalue()
+
+
+def payload_sample_rate(payload: bytes):
+    """Sample rate recorded in an encoded payload (e.g. a cached file), or None if unreadable."""
+    if payload[:4] == b"RIFF" and payload[8:12] == b"WAVE" and len(payload) >= 28:
+        return struct.unpack_from("<I", payload, 24)[0]
+    try:
+        import soundfile as sf
+        return sf.info(io.BytesIO(payload)).samplerate
+    except Exception:
+        return None
+
+
+def encode(audio, sample_rate: int, fmt: str = DEFAULT_FORMAT, target_rate: int = None):
+    """
+    Encode model output. The float32 buffer may be modified in place.
+
+    Args:
+        target_rate: resample to this rate first (only downsampling is applied)
+
+    Returns:
+        (payload_bytes, mimetype, sample_rate_used)
+    """
+    audio = as_float32(audio)
+    rate = int(sample_rate)
+    if target_rate and int(target_rate) < rate:
+        audio = resample(audio, rate, int(target_rate))
+        rate = int(target_rate)
+
+    if fmt == "opus":
+        if rate not in OPUS_SAMPLE_RATES:
+            # Nearest supported rate at or below the current one
+            new_rate = max(r for r in OPUS_SAMPLE_RATES if r <= rate) if rate >= OPUS_SAMPLE_RATES[0] else 8000
+            audio, rate = resample(audio, rate, new_rate), new_rate
+        return _opus_ogg(audio, rate), FORMATS["opus"], rate
+
+    if not audio.flags.writeable:
+        audio = audio.copy()
+    return _pcm16_wav(audio, rate), FORMATS["pcm16"], rate
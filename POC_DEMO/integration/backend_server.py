@@ -9,29 +9,55 @@ Provides REST API endpoints for:
 4. TTS audio generation (Coqui VITS)
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import os
 import sys
 from pathlib import Path
+import atexit
+import hashlib
 import io
 import json
-import uuid
+import logging
+import re
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
 from werkzeug.utils import secure_filename
 
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent.parent / "MILESTONE1" / "GUIDANCE_METRICS"))
 
-from gemini_api.gemini_client import GeminiHazardClient
-from gemini_api.hazard_schema import HazardOutput
+from gemini_api.gemini_client import (GeminiHazardClient, GeminiCancelled, GeminiDeadlineExceeded, analyze_hedged,
+                                      output_stats)
+from gemini_api.frame_analysis_schema import (DEFAULT_TASKS as FRAME_DEFAULT_TASKS, SECTIONS as FRAME_SECTIONS,
+                                               SceneOutput, TrafficSignalOutput, require_any_section,
+                                               validate_sections)
+from gemini_api.hazard_schema import HAPTIC_VALUES, HazardOutput, haptic_for
+from gemini_api.image_cache import IMAGE_CACHE
 from gemini_api.navigation_guidance_schema import NavigationGuidanceOutput
+from gemini_api.response_schema import sections_model
+from gemini_api.usage import usage_stats
+
+from structured_logging import setup_logging
+from audio_encoding import DEFAULT_FORMAT, SAMPLE_RATES, encode as encode_audio, negotiate_format, payload_sample_rate
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from color_palette import CVD_TYPES, classify_description, solve_palette
+from model_router import ModelRouter
+from profile_store import DEFAULT_USER_ID, ProfileStore, render_profile_fragment
+from route_geometry import RouteGeometry, RouteIndexCache, compass_direction
+from trip_keys import TripKeyCanonicalizer
+from trip_warmer import TripCacheWarmer, TripHistoryLog
+from upload_store import UploadStore
 
 # Google Maps API
 try:
     import googlemaps
     gmaps_api_key = ""
     if gmaps_api_key:
-        gmaps_client = googlemaps.Client(key=gmaps_api_key)
+        # Bounded client-side retries; the circuit breaker handles sustained outages
+        gmaps_client = googlemaps.Client(key=gmaps_api_key, timeout=5, retry_timeout=10)
         print("✅ Google Maps API client initialized")
     else:
         print("⚠️  Warning: GOOGLE_API_KEY not set for Maps API")
@@ -46,26 +72,25 @@ except Exception as e:
 app = Flask(__name__)
 CORS(app)  # Enable CORS for iOS app
 
+# Structured JSON logs written by a background thread; hot endpoints can be sampled,
+# e.g. NAVAID_LOG_SAMPLING="hazard_detection=0.1" NAVAID_LOG_LEVELS="text_to_speech=WARNING"
+setup_logging(
+    app,
+    level=os.getenv("NAVAID_LOG_LEVEL", "INFO"),
+    sampling=os.getenv("NAVAID_LOG_SAMPLING", ""),
+    endpoint_levels=os.getenv("NAVAID_LOG_LEVELS", "")
+)
+log = logging.getLogger("navaid.backend")
+
 # Initialize Gemini API key
 api_key = os.getenv("GOOGLE_API_KEY")
 if not api_key:
     print("❌ ERROR: GOOGLE_API_KEY not set!")
     sys.exit(1)
 
-# Default Gemini client (for mobile app)
-gemini_client = GeminiHazardClient(
-    api_key=api_key,
-    model_name="gemini-2.5-flash",
-    temperature=0.2,
-    top_p=0.8,
-    rpm_limit=0  # No rate limiting for demo
-)
-
-# Cached iOS profile (synced from app)
-cached_ios_profile = None
-
+@lru_cache(maxsize=32)
 def get_gemini_client(model_name="gemini-2.5-flash", temperature=0.2, top_p=0.8):
-    """Create a Gemini client with specified model. Supports web demo model selection."""
+    """Get a (cached) Gemini client with specified model. Supports web demo model selection."""
     return GeminiHazardClient(
         api_key=api_key,
         model_name=model_name,
@@ -74,6 +99,173 @@ def get_gemini_client(model_name="gemini-2.5-flash", temperature=0.2, top_p=0.8)
         rpm_limit=0
     )
 
+# Latency budgets per endpoint (seconds). A blind user should never wait indefinitely
+# for a hazard warning: past the hedge delay we race a faster model, past the
+# deadline we give up and return 504.
+ENDPOINT_DEADLINES_S = {
+    "hazard-detection": float(os.getenv("NAVAID_HAZARD_DEADLINE_S", "6.0")),
+    "navigation-guidance": float(os.getenv("NAVAID_NAVIGATION_DEADLINE_S", "8.0")),
+    "deep-analyze-traffic": float(os.getenv("NAVAID_TRAFFIC_DEADLINE_S", "10.0")),
+    "scene-understanding": float(os.getenv("NAVAID_SCENE_DEADLINE_S", "15.0")),
+    "analyze-frame": float(os.getenv("NAVAID_FRAME_DEADLINE_S", "10.0")),
+}
+HEDGE_AFTER_S = {
+    "hazard-detection": float(os.getenv("NAVAID_HAZARD_HEDGE_AFTER_S", "2.5")),
+    "navigation-guidance": float(os.getenv("NAVAID_NAVIGATION_HEDGE_AFTER_S", "3.5")),
+}
+HEDGE_MODEL = os.getenv("NAVAID_HEDGE_MODEL", "gemini-2.5-flash-lite")
+
+# Latency-aware model routing: each endpoint starts from its default (or the web demo's
+# requested) model and sheds to lighter models when observed latency/errors/load
+# would break its SLO.
+model_router = ModelRouter(
+    slo_ms={
+        "hazard-detection": float(os.getenv("NAVAID_HAZARD_SLO_MS", "2500")),
+        "navigation-guidance": float(os.getenv("NAVAID_NAVIGATION_SLO_MS", "3500")),
+        "deep-analyze-traffic": float(os.getenv("NAVAID_TRAFFIC_SLO_MS", "5000")),
+        "scene-understanding": float(os.getenv("NAVAID_SCENE_SLO_MS", "8000")),
+        "analyze-frame": float(os.getenv("NAVAID_FRAME_SLO_MS", "5000")),
+    },
+    default_models={
+        "hazard-detection": "gemini-2.5-flash",
+        "navigation-guidance": "gemini-2.5-flash",
+        "deep-analyze-traffic": "gemini-2.5-flash",
+        "scene-understanding": "gemini-2.5-flash",
+        "analyze-frame": "gemini-2.5-flash",
+    },
+    max_inflight_per_model=int(os.getenv("NAVAID_MAX_INFLIGHT_PER_MODEL", "8"))
+)
+
+# Circuit breakers: while an upstream is unhealthy, fail fast instead of tying up
+# worker threads in retries and backoff.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("NAVAID_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RECOVERY_S = float(os.getenv("NAVAID_BREAKER_RECOVERY_S", "30"))
+
+@lru_cache(maxsize=None)
+def gemini_breaker(model_name):
+    """One breaker per Gemini model, so the router can shed to a healthy one."""
+    return CircuitBreaker(
+        f"gemini:{model_name}",
+        failure_threshold=BREAKER_FAILURE_THRESHOLD,
+        recovery_timeout_s=BREAKER_RECOVERY_S,
+        ignore_exceptions=(ValueError,),  # malformed/invalid model output is not an outage
+        neutral_exceptions=(GeminiCancelled,)  # lost a hedge race: says nothing about this model
+    )
+
+maps_breaker = CircuitBreaker(
+    "google-maps",
+    failure_threshold=BREAKER_FAILURE_THRESHOLD,
+    recovery_timeout_s=BREAKER_RECOVERY_S
+)
+
+def degraded_response(e):
+    """Well-defined fast-fail response while an upstream circuit is open."""
+    retry_after = max(1, int(round(e.retry_after_s)))
+    body = {
+        "error": f"{e.name} is temporarily unavailable",
+        "degraded": True,
+        "upstream": e.name,
+        "retry_after_seconds": retry_after,
+        "message": "Guidance is temporarily unavailable. Please proceed with caution."
+    }
+    return jsonify(body), 503, {"Retry-After": str(retry_after)}
+
+def analyze_within_budget(endpoint, image_path, prompt, requested_model=None,
+                          temperature=0.2, top_p=0.8, validate=None, response_schema=None):
+    """
+    Route to a model, then run a deadline-bounded analyze(), hedged to HEDGE_MODEL
+    for latency-critical endpoints. Each model's call goes through its own circuit
+    breaker, and its outcome is fed back to the router under that model.
+    `response_schema` (a pydantic model) constrains the model's output to that shape.
+    """
+    model_name = model_router.choose(endpoint, requested_model,
+                                     is_available=lambda m: gemini_breaker(m).is_available())
+    hedge_after_s = HEDGE_AFTER_S.get(endpoint)
+    # The routed call holds an in-flight slot until it reports; if it never starts, it is released below
+    routed_lock = threading.Lock()
+    routed_state = {"started": False, "abandoned": False}
+
+    def call_model(client, attempt):
+        routed = client.model_name == model_name
+        if routed:
+            with routed_lock:
+                if routed_state["abandoned"]:
+                    raise GeminiCancelled(f"{model_name}: cancelled")
+                routed_state["started"] = True
+        report = model_router.record if routed else model_router.sample
+        start = time.monotonic()
+        try:
+            out = gemini_breaker(client.model_name).call(attempt)
+        except CircuitOpenError:
+            if routed:
+                model_router.release(endpoint, model_name)
+            raise
+        except GeminiCancelled:
+            # Lost the race: the routed model was slower than the hedge; a losing hedge is not a sample
+            if routed:
+                model_router.record(endpoint, model_name, (time.monotonic() - start) * 1000, ok=False)
+            raise
+        except Exception:
+            report(endpoint, client.model_name, (time.monotonic() - start) * 1000, ok=False)
+            raise
+        report(endpoint, client.model_name, (time.monotonic() - start) * 1000, ok=True)
+        return out
+
+    try:
+        client = get_gemini_client(model_name=model_name, temperature=temperature, top_p=top_p)
+        hedge_client = None
+        if (hedge_after_s is not None and model_name != HEDGE_MODEL
+                and gemini_breaker(HEDGE_MODEL).is_available()):
+            hedge_client = get_gemini_client(model_name=HEDGE_MODEL, temperature=temperature, top_p=top_p)
+
+        result = analyze_hedged(
+            client, Path(image_path), prompt,
+            deadline_s=ENDPOINT_DEADLINES_S[endpoint],
+            hedge_after_s=hedge_after_s,
+            hedge_client=hedge_client,
+            validate=validate,
+            response_schema=response_schema,
+            call_wrapper=call_model
+        )
+    finally:
+        with routed_lock:
+            if not routed_state["started"]:
+                routed_state["abandoned"] = True
+                model_router.release(endpoint, model_name)
+
+    if model_name != (requested_model or model_router.default_models.get(endpoint)):
+        log.info("🔀 %s: routed to %s", endpoint, model_name)
+    if result.hedged:
+        log.info("⏱️  %s: answered by hedge model %s in %.0fms", endpoint, result.model_name, result.latency_ms)
+    log.debug("%s token usage", endpoint, extra={"usage": result.usage})
+    return result
+
+# Color palettes are solved locally; Gemini is only an optional fallback classifier
+# for free-text descriptions the keyword matcher doesn't recognise.
+PALETTE_LLM_CLASSIFY = os.getenv("NAVAID_PALETTE_LLM_CLASSIFY", "0") == "1"
+
+def classify_description_with_gemini(description):
+    """Ask a light Gemini model for the CVD type only. Returns None on any failure."""
+    try:
+        import google.generativeai as genai
+
+        model = genai.GenerativeModel("gemini-2.5-flash-lite")
+        gcfg = genai.types.GenerationConfig(temperature=0.0, response_mime_type="application/json")
+        prompt = (
+            "Classify this color vision description into exactly one of: "
+            f"{', '.join(CVD_TYPES)}.\n\nDescription: {description}\n\n"
+            'Return JSON: {"type": "<one of the above>"}'
+        )
+        response = model.generate_content(prompt, generation_config=gcfg, request_options={"timeout": 3})
+        cvd_type = json.loads(response.text).get("type")
+        return cvd_type if cvd_type in CVD_TYPES else None
+    except Exception as e:
+        log.warning("⚠️  Colorblindness classification failed: %s", e)
+        return None
+
+# Pre-solve every palette in the background so the first request is instant too
+threading.Thread(target=lambda: [solve_palette(t) for t in CVD_TYPES], daemon=True).start()
+
 # Initialize TTS (Coqui VITS default)
 try:
     from TTS.api import TTS
@@ -95,7 +287,7 @@ def get_tts_model(model_id="coqui_vits_ljspeech"):
     """Get TTS model instance. Supports web demo model selection."""
     if model_id == "espeak":
         # eSpeak not implemented in this backend, return default
-        print(f"⚠️  eSpeak requested but not implemented, using default VITS")
+        log.warning("⚠️  eSpeak requested but not implemented, using default VITS")
         return tts_model, None
 
     model_path = TTS_MODEL_MAP.get(model_id, "tts_models/en/ljspeech/vits")
@@ -111,9 +303,73 @@ def get_tts_model(model_id="coqui_vits_ljspeech"):
     try:
         return TTS(model_path), speaker_id
     except Exception as e:
-        print(f"⚠️  Failed to load {model_id}, using default: {e}")
+        log.warning("⚠️  Failed to load %s, using default: %s", model_id, e)
         return tts_model, None
 
+# Optional downsampling of TTS output (e.g. 16000 for speech over cellular); 0 keeps the model's rate
+TTS_SAMPLE_RATE = int(os.getenv("NAVAID_TTS_SAMPLE_RATE", "0"))
+
+def synthesize_audio(text, model_id="coqui_vits_ljspeech", fmt=DEFAULT_FORMAT, sample_rate=TTS_SAMPLE_RATE):
+    """
+    Synthesize `text` and encode it (pcm16 WAV or Opus) at the model's real output rate,
+    downsampled to `sample_rate` if lower. Returns (bytes, mimetype, rate), or None if no
+    TTS model is available.
+    """
+    # Get the requested TTS model and speaker ID (if multi-speaker)
+    selected_tts, speaker_id = get_tts_model(model_id)
+    if selected_tts is None:
+        return None
+
+    # Generate audio (with speaker parameter for multi-speaker models)
+    if speaker_id:
+        log.debug("  Using speaker: %s", speaker_id)
+        wav = selected_tts.tts(text=text, speaker=speaker_id)
+    else:
+        wav = selected_tts.tts(text=text)
+
+    model_rate = getattr(getattr(selected_tts, "synthesizer", None), "output_sample_rate", None) or 22050
+    return encode_audio(wav, model_rate, fmt, target_rate=sample_rate)
+
+# Precomputed step audio for warmed trips (see trip warmer below); /api/tts serves these
+# without running the model
+TTS_AUDIO_CACHE_DIR = Path(__file__).parent.parent / "cache" / "audio"
+
+def tts_audio_cache_path(text, model_id="coqui_vits_ljspeech", fmt=DEFAULT_FORMAT, sample_rate=TTS_SAMPLE_RATE):
+    digest = hashlib.sha256(f"{model_id}|{fmt}|{sample_rate}|{text}".encode()).hexdigest()
+    return TTS_AUDIO_CACHE_DIR / f"{digest}.{'ogg' if fmt == 'opus' else 'wav'}"
+
+def precompute_tts_audio(texts, model_id="coqui_vits_ljspeech"):
+    """Synthesize and cache audio for texts that aren't cached yet; refreshes the age of those that are."""
+    TTS_AUDIO_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    created = 0
+    for text in texts:
+        if not text:
+            continue
+        path = tts_audio_cache_path(text, model_id)
+        if path.exists():
+            os.utime(path)
+            continue
+        encoded = synthesize_audio(text, model_id)
+        if encoded is None:
+            break
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_bytes(encoded[0])
+        os.replace(tmp, path)
+        created += 1
+    return created
+
+def prune_tts_audio_cache(max_age_s):
+    """Remove precomputed audio not refreshed within `max_age_s`."""
+    if not TTS_AUDIO_CACHE_DIR.exists():
+        return
+    cutoff = time.time() - max_age_s
+    for path in TTS_AUDIO_CACHE_DIR.glob("*.*"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+
 # Load prompts
 PROMPTS_DIR = Path(__file__).parent.parent / "prompts"
 
@@ -128,12 +384,23 @@ hazard_prompt = load_prompt("hazard_detection_v3.md")
 scene_prompt = load_prompt("scene_understanding.md")
 traffic_prompt = load_prompt("deep_analyze_traffic.md")
 navigation_guidance_prompt = load_prompt("navigation_guidance_v3.md")
+frame_analysis_prompt = load_prompt("frame_analysis.md")
 
 print("✅ All prompts loaded")
 
-# Simple uploads directory for web demo
+# Content-addressed uploads directory (deduped by hash, GC'd by TTL + size quota)
 UPLOADS_DIR = Path(__file__).parent.parent / "uploads"
-UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+upload_store = UploadStore(
+    UPLOADS_DIR,
+    ttl_seconds=float(os.getenv("NAVAID_UPLOAD_TTL_SECONDS", "3600")),
+    max_total_bytes=int(os.getenv("NAVAID_UPLOAD_MAX_BYTES", str(512 * 1024 * 1024))),
+    gc_interval_seconds=float(os.getenv("NAVAID_UPLOAD_GC_INTERVAL_SECONDS", "60"))
+)
+upload_store.start_gc()
+
+# Encoded image parts shared by all Gemini clients: hazard, scene, traffic and
+# navigation calls on the same uploaded frame read and encode it once
+IMAGE_CACHE.max_bytes = int(os.getenv("NAVAID_IMAGE_CACHE_MB", "64")) * 1024 * 1024
 
 # User profile paths (check multiple locations)
 # 1. iOS app path
@@ -142,25 +409,10 @@ IOS_PROFILE_PATH = "/Users/prabhavsingh/Library/Containers/com.navaid.app/Data/D
 INTEGRATION_PROFILE_PATH = os.path.join(os.path.dirname(__file__), "user_profile_template.json")
 
 def load_user_profile():
-    """Load user profile if exists, otherwise return placeholder."""
-    global cached_ios_profile
-
-    # First check if we have a cached iOS profile from sync
-    if cached_ios_profile:
-        print(f"📱 Using cached iOS profile (synced from app)")
-        # Format the dict into a string for prompt injection
-        profile = cached_ios_profile
-        formatted = f"""## User Profile:
-- Name: {profile.get('name', 'Unknown')}
-- Age: {profile.get('age', 'Unknown')}
-- Vision Problems: {profile.get('visionProblems', 'Not specified')}
-- Assistive Devices: {profile.get('assistiveDevices', 'None')}
-- Other Vision Defects: {profile.get('otherVisionDefects', 'None')}
-- Primary Environments: {profile.get('primaryNavigationEnvironments', 'Not specified')}
-- Navigation Challenges: {profile.get('navigationChallenges', 'Not specified')}
-- Emergency Contact: {profile.get('emergencyContact', 'Not provided')}"""
-        return formatted
-
+    """
+    Locate the on-disk profile (iOS container, simulator, or demo template) and render it.
+    Only used once at startup to seed the default profile; requests read the ProfileStore.
+    """
     # Search for iOS app profile in simulator OR container
     profile_path = None
     found_profiles = []
@@ -196,43 +448,8 @@ def load_user_profile():
             with open(profile_path, 'r') as f:
                 data = json.load(f)
 
-            # Handle new nested format (user_profile key)
-            if 'user_profile' in data:
-                profile = data['user_profile']
-
-                # Extract mobility aids
-                mobility_aids = profile.get('mobility_aids', {})
-                aids_list = []
-                if mobility_aids.get('white_cane'): aids_list.append('white cane')
-                if mobility_aids.get('walking_stick'): aids_list.append('walking stick')
-                if mobility_aids.get('guide_dog'): aids_list.append('guide dog')
-                if mobility_aids.get('other'): aids_list.append(mobility_aids['other'])
-
-                # Format profile as markdown for prompt injection
-                vision_condition = profile.get('vision_condition', {})
-                profile_text = f"""
-**User Profile:**
-- **Vision Condition:** {vision_condition.get('type', 'N/A')} - {vision_condition.get('description', '')}
-- **Field of View:** {vision_condition.get('field_of_view_degrees', 'N/A')}° (peripheral vision loss)
-- **Mobility Aids:** {', '.join(aids_list) if aids_list else 'None'}
-- **Notes:** {vision_condition.get('notes', '')}
-- **Additional:** {profile.get('additional_notes', '')}
-"""
-            else:
-                # Handle old flat format (iOS app)
-                profile = data
-                profile_text = f"""
-- Name: {profile.get('name', 'N/A')}
-- Age: {profile.get('age', 'N/A')}
-- Vision Problems: {profile.get('visionProblems', 'N/A')}
-- Assistive Devices: {profile.get('assistiveDevices', 'N/A')}
-- Other Vision Defects: {profile.get('otherVisionDefects', 'N/A')}
-- Primary Environments: {profile.get('primaryNavigationEnvironments', 'N/A')}
-- Navigation Challenges: {profile.get('navigationChallenges', 'N/A')}
-"""
-
             print(f"✅ User profile loaded from {os.path.basename(profile_path)}")
-            return profile_text
+            return render_profile_fragment(data)
         except Exception as e:
             print(f"⚠️  Failed to load user profile: {e}")
             import traceback
@@ -242,19 +459,36 @@ def load_user_profile():
         print("ℹ️  No user profile found (first-time user or not yet configured)")
         return "No user profile available."
 
-def inject_user_profile(prompt, personalization_enabled=True):
+# Per-user profiles (keyed by user/device id), held in memory with their rendered
+# prompt fragment and persisted write-behind, so requests never touch the disk.
+profile_store = ProfileStore(
+    UPLOADS_DIR.parent / "cache" / "profiles",
+    max_entries=int(os.getenv("NAVAID_PROFILE_CACHE_SIZE", "10000"))
+)
+print(f"✅ Profile store ready ({profile_store.preload()} persisted profiles)")
+atexit.register(profile_store.flush)
+# Users who never synced a profile fall back to the on-disk/demo profile, rendered once
+profile_store.default_fragment = load_user_profile()
+
+def request_user_id(data=None):
+    """User/device id from the JSON body or X-User-Id / X-Device-Id headers."""
+    data = data or {}
+    return (data.get('user_id') or data.get('device_id')
+            or request.headers.get('X-User-Id') or request.headers.get('X-Device-Id')
+            or DEFAULT_USER_ID)
+
+def inject_user_profile(prompt, personalization_enabled=True, user_id=DEFAULT_USER_ID):
     """
-    Replace {USER_PROFILE_PLACEHOLDER} with actual profile data or empty string.
-    Reloads profile on each call to pick up changes after survey completion.
+    Replace {USER_PROFILE_PLACEHOLDER} with the user's pre-rendered profile or a generic note.
+    Profiles come from the in-memory ProfileStore (updated by /api/sync-profile).
 
     Args:
         prompt: The prompt template with placeholder
         personalization_enabled: If False, replaces with "No personalization enabled"
+        user_id: User/device id whose profile to inject
     """
     if personalization_enabled:
-        # Reload profile on each call to pick up changes
-        current_profile = load_user_profile()
-        return prompt.replace("{USER_PROFILE_PLACEHOLDER}", current_profile)
+        return prompt.replace("{USER_PROFILE_PLACEHOLDER}", profile_store.fragment_or_default(user_id))
     else:
         return prompt.replace("{USER_PROFILE_PLACEHOLDER}", "No personalization enabled. Use generic guidance for all users.")
 
@@ -277,13 +511,16 @@ def hazard_detection():
         if not image_path or not os.path.exists(image_path):
             return jsonify({"error": "Invalid image path"}), 400
 
-        print(f"🔍 Analyzing hazards: {os.path.basename(image_path)} (personalization: {personalization_enabled})")
+        log.info("🔍 Analyzing hazards: %s (personalization: %s)", os.path.basename(image_path), personalization_enabled)
 
         # Call Gemini API with user profile injected (or not)
-        final_prompt = inject_user_profile(hazard_prompt, personalization_enabled)
-        raw_dict, raw_text = gemini_client.analyze(Path(image_path), final_prompt)
+        final_prompt = inject_user_profile(hazard_prompt, personalization_enabled, request_user_id(data))
+        result = analyze_within_budget("hazard-detection", image_path, final_prompt,
+                                       temperature=0.2, top_p=0.8,
+                                       validate=lambda d: HazardOutput(**d), response_schema=HazardOutput)
+        raw_dict = result.data
 
-        print(raw_dict)
+        log.debug("Hazard response", extra={"response": raw_dict})
 
         # Validate and normalize
         hazard_output = HazardOutput(**raw_dict).normalized()
@@ -291,13 +528,110 @@ def hazard_detection():
         # Return as JSON
         return jsonify(hazard_output.model_dump())
 
+    except CircuitOpenError as e:
+        log.warning("⚡ Hazard detection fast-fail: %s", e)
+        return degraded_response(e)
+
+    except GeminiDeadlineExceeded as e:
+        log.warning("⏱️  Hazard detection deadline exceeded: %s", e)
+        return jsonify({"error": str(e), "timeout": True}), 504
+
     except Exception as e:
-        print(f"❌ Hazard detection error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Hazard detection error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/hazard-detection/stream', methods=['POST'])
+def hazard_detection_stream():
+    """
+    Streaming hazard detection. Emits the haptic cue as soon as the model has written
+    enough fields to decide it, then the full result.
+
+    Request: same as /api/hazard-detection
+    Response: NDJSON lines
+        {"event": "haptic", "haptic_recommendation": "...", "elapsed_ms": ...}
+        {"event": "result", "result": HazardResponse, "elapsed_ms": ...}
+        {"event": "error", "error": "...", "timeout": true/false}  (+ "degraded", "retry_after_seconds" while the circuit is open)
+    A second "haptic" line is only sent if the model's own recommendation differs from the early one.
+    """
+    data = request.json or {}
+    image_path = data.get('image_path')
+    personalization_enabled = data.get('personalization_enabled', False)  # Default OFF
+
+    if not image_path or not os.path.exists(image_path):
+        return jsonify({"error": "Invalid image path"}), 400
+
+    final_prompt = inject_user_profile(hazard_prompt, personalization_enabled, request_user_id(data))
+    endpoint = "hazard-detection"
+
+    def line(event, **fields):
+        payload = {"event": event, **fields, "elapsed_ms": round((time.monotonic() - start) * 1000, 1)}
+        return json.dumps(payload) + "\n"
+
+    def haptic_so_far(fields):
+        haptic = str(fields.get("haptic_recommendation", "")).lower().strip()
+        if haptic in HAPTIC_VALUES:
+            return haptic
+        if fields.get("hazard_detected") is False:
+            return "no_haptic"
+        if "hazard_detected" in fields and "bearing" in fields and "proximity" in fields:
+            return haptic_for(fields["hazard_detected"], fields["bearing"], fields["proximity"])
+        return None
+
+    start = time.monotonic()
+
+    def generate():
+        fields, sent_haptic, ok, reached_model, model_name = {}, None, False, True, None
+        try:
+            # Routed here, not before the Response is returned: a body that never starts
+            # (client gone before the first chunk) would otherwise leak the in-flight slot
+            model_name = model_router.choose(endpoint, is_available=lambda m: gemini_breaker(m).is_available())
+            log.info("🔍 Streaming hazards: %s with %s", os.path.basename(image_path), model_name)
+            client = get_gemini_client(model_name=model_name, temperature=0.2, top_p=0.8)
+            # Outcome recorded when the stream ends, including failures before the first chunk.
+            # No response_schema here: the SDK cannot set property ordering, and constrained
+            # decoding may emit fields alphabetically, putting evasive_suggestion before the
+            # hazard_detected/bearing/proximity fields the early haptic needs. The prompt's
+            # field order is kept instead, and the result is still validated below.
+            stream = gemini_breaker(model_name).call_stream(
+                client.analyze_stream, Path(image_path), final_prompt,
+                deadline_s=ENDPOINT_DEADLINES_S[endpoint])
+            for key, value in stream:
+                fields[key] = value
+                haptic = haptic_so_far(fields)
+                if haptic is not None and haptic != sent_haptic and (
+                        sent_haptic is None or key == "haptic_recommendation"):
+                    sent_haptic = haptic
+                    yield line("haptic", haptic_recommendation=haptic)
+
+            hazard_output = HazardOutput(**fields).normalized()
+            ok = True
+            yield line("result", result=hazard_output.model_dump())
+
+        except CircuitOpenError as e:
+            reached_model = False
+            log.warning("⚡ Hazard stream fast-fail: %s", e)
+            yield line("error", error=str(e), timeout=False, degraded=True,
+                       retry_after_seconds=max(1, int(round(e.retry_after_s))))
+
+        except GeminiDeadlineExceeded as e:
+            log.warning("⏱️  Hazard stream deadline exceeded: %s", e)
+            yield line("error", error=str(e), timeout=True)
+
+        except Exception as e:
+            log.exception("❌ Hazard stream error: %s", e)
+            yield line("error", error=str(e), timeout=False)
+
+        finally:
+            if model_name is not None and reached_model:
+                model_router.record(endpoint, model_name, (time.monotonic() - start) * 1000, ok=ok)
+            elif model_name is not None:
+                model_router.release(endpoint, model_name)
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                    headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"})
+
+
 @app.route('/api/scene-understanding', methods=['POST'])
 def scene_understanding():
     """
@@ -309,28 +643,33 @@ def scene_understanding():
     try:
         data = request.json
         image_path = data.get('image_path')
-        vision_model = data.get('vision_model', 'gemini-2.5-flash')  # Default for mobile app compatibility
+        vision_model = data.get('vision_model')  # None = routed default (mobile app)
         personalization_enabled = data.get('personalization_enabled', False)  # Default OFF
 
         if not image_path or not os.path.exists(image_path):
             return jsonify({"error": "Invalid image path"}), 400
 
-        print(f"🏙️  Analyzing scene: {os.path.basename(image_path)} with {vision_model} (personalization: {personalization_enabled})")
+        log.info("🏙️  Analyzing scene: %s with %s (personalization: %s)", os.path.basename(image_path), vision_model or 'auto', personalization_enabled)
 
-        # Use specified model (web demo) or default (mobile app)
-        scene_client = get_gemini_client(model_name=vision_model, temperature=0.3, top_p=0.9)
-
-        # Call Gemini API with user profile injected (or not)
-        final_prompt = inject_user_profile(scene_prompt, personalization_enabled)
-        raw_dict, raw_text = scene_client.analyze(Path(image_path), final_prompt)
+        # Call Gemini API with user profile injected (or not); requested model (web demo) is a ceiling
+        final_prompt = inject_user_profile(scene_prompt, personalization_enabled, request_user_id(data))
+        raw_dict = analyze_within_budget("scene-understanding", image_path, final_prompt,
+                                         requested_model=vision_model, temperature=0.3, top_p=0.9,
+                                         response_schema=SceneOutput).data
 
         # Return as JSON (no validation model needed, raw JSON is fine)
         return jsonify(raw_dict)
 
+    except CircuitOpenError as e:
+        log.warning("⚡ Scene understanding fast-fail: %s", e)
+        return degraded_response(e)
+
+    except GeminiDeadlineExceeded as e:
+        log.warning("⏱️  Scene understanding deadline exceeded: %s", e)
+        return jsonify({"error": str(e), "timeout": True}), 504
+
     except Exception as e:
-        print(f"❌ Scene understanding error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Scene understanding error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -345,27 +684,32 @@ def deep_analyze_traffic():
     try:
         data = request.json
         image_path = data.get('image_path')
-        vision_model = data.get('vision_model', 'gemini-2.5-flash')  # Default for mobile app
+        vision_model = data.get('vision_model')  # None = routed default (mobile app)
 
         if not image_path or not os.path.exists(image_path):
             return jsonify({"error": "Invalid image path"}), 400
 
-        print(f"🚦 Analyzing traffic light: {os.path.basename(image_path)} with {vision_model}")
+        log.info("🚦 Analyzing traffic light: %s with %s", os.path.basename(image_path), vision_model or 'auto')
 
-        # Use specified model (web demo) or default (mobile app)
-        traffic_client = get_gemini_client(model_name=vision_model, temperature=0.1, top_p=0.8)
-
-        # Call Gemini API with user profile injected
-        final_prompt = inject_user_profile(traffic_prompt)
-        raw_dict, raw_text = traffic_client.analyze(Path(image_path), final_prompt)
+        # Call Gemini API with user profile injected; requested model (web demo) is a ceiling
+        final_prompt = inject_user_profile(traffic_prompt, user_id=request_user_id(data))
+        raw_dict = analyze_within_budget("deep-analyze-traffic", image_path, final_prompt,
+                                         requested_model=vision_model, temperature=0.1, top_p=0.8,
+                                         response_schema=TrafficSignalOutput).data
 
         # Return as JSON
         return jsonify(raw_dict)
 
+    except CircuitOpenError as e:
+        log.warning("⚡ Traffic light analysis fast-fail: %s", e)
+        return degraded_response(e)
+
+    except GeminiDeadlineExceeded as e:
+        log.warning("⏱️  Traffic light analysis deadline exceeded: %s", e)
+        return jsonify({"error": str(e), "timeout": True}), 504
+
     except Exception as e:
-        print(f"❌ Traffic light analysis error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Traffic light analysis error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -386,21 +730,21 @@ def navigation_guidance():
         data = request.json
         navigation_instruction = data.get('navigation_instruction')
         image_path = data.get('image_path')
-        vision_model = data.get('vision_model', 'gemini-2.5-flash')  # Default for mobile app
+        vision_model = data.get('vision_model')  # None = routed default (mobile app)
         personalization_enabled = data.get('personalization_enabled', False)  # Default OFF
 
-        print(personalization_enabled)
-
         if not navigation_instruction:
             return jsonify({"error": "No navigation instruction provided"}), 400
 
         if not image_path or not os.path.exists(image_path):
             return jsonify({"error": "Invalid image path"}), 400
 
-        print(f"🗺️  Navigation guidance: {navigation_instruction[:50]}... + {os.path.basename(image_path)} with {vision_model} (personalization: {personalization_enabled})")
+        log.info("🗺️  Navigation guidance: %s... + %s with %s (personalization: %s)",
+                 navigation_instruction[:50], os.path.basename(image_path), vision_model or 'auto', personalization_enabled)
 
         # Build combined prompt with navigation instruction
-        base_prompt_with_profile = inject_user_profile(navigation_guidance_prompt, personalization_enabled)
+        base_prompt_with_profile = inject_user_profile(navigation_guidance_prompt, personalization_enabled,
+                                                       request_user_id(data))
         combined_prompt = f"""
 {base_prompt_with_profile}
 
@@ -413,13 +757,14 @@ def navigation_guidance():
 Analyze the photo and provide combined guidance following the schema above.
 """
 
-        # Use specified model (web demo) or default (mobile app)
-        nav_client = get_gemini_client(model_name=vision_model, temperature=0.2, top_p=0.8)
-
-        # Call Gemini API with combined prompt
-        raw_dict, raw_text = nav_client.analyze(Path(image_path), combined_prompt)
+        # Call Gemini API with combined prompt; requested model (web demo) is a ceiling
+        result = analyze_within_budget("navigation-guidance", image_path, combined_prompt,
+                                       requested_model=vision_model, temperature=0.2, top_p=0.8,
+                                       validate=lambda d: NavigationGuidanceOutput(**d),
+                                       response_schema=NavigationGuidanceOutput)
+        raw_dict = result.data
 
-        print(f"📤 Response: {raw_dict}")
+        log.debug("📤 Response", extra={"response": raw_dict})
 
         # Validate and normalize
         guidance_output = NavigationGuidanceOutput(**raw_dict).normalized()
@@ -427,10 +772,86 @@ Analyze the photo and provide combined guidance following the schema above.
         # Return as JSON
         return jsonify(guidance_output.model_dump())
 
+    except CircuitOpenError as e:
+        log.warning("⚡ Navigation guidance fast-fail: %s", e)
+        return degraded_response(e)
+
+    except GeminiDeadlineExceeded as e:
+        log.warning("⏱️  Navigation guidance deadline exceeded: %s", e)
+        return jsonify({"error": str(e), "timeout": True}), 504
+
     except Exception as e:
-        print(f"❌ Navigation guidance error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Navigation guidance error: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/analyze-frame', methods=['POST'])
+def analyze_frame():
+    """
+    Combined hazard + traffic light + scene (+ navigation) analysis in ONE model call.
+
+    Request: {
+        "image_path": "/path/to/image.jpg",
+        "tasks": ["hazard", "traffic", "scene"] (optional; any of hazard, traffic, scene, navigation),
+        "navigation_instruction": "Head straight for 50 meters" (optional; adds the navigation task),
+        "vision_model": "gemini-2.5-flash" (optional),
+        "personalization_enabled": true/false (optional)
+    }
+    Response: {"<section>": {...} | null for each requested section, "errors": {section: reason},
+               "model": "...", "hedged": bool, "elapsed_ms": ...}
+    Each section is validated on its own: a malformed section is null (with a reason in "errors")
+    while the others are still returned. Fails only if no requested section is usable.
+    """
+    try:
+        data = request.json or {}
+        image_path = data.get('image_path')
+        vision_model = data.get('vision_model')  # None = routed default (mobile app)
+        personalization_enabled = data.get('personalization_enabled', False)  # Default OFF
+        navigation_instruction = data.get('navigation_instruction')
+
+        if not image_path or not os.path.exists(image_path):
+            return jsonify({"error": "Invalid image path"}), 400
+
+        tasks = list(dict.fromkeys(data.get('tasks') or FRAME_DEFAULT_TASKS))
+        if navigation_instruction and "navigation" not in tasks:
+            tasks.append("navigation")
+        unknown = [t for t in tasks if t not in FRAME_SECTIONS]
+        if unknown:
+            return jsonify({"error": f"Unknown tasks: {unknown}", "allowed": list(FRAME_SECTIONS)}), 400
+        if "navigation" in tasks and not navigation_instruction:
+            return jsonify({"error": "The navigation task needs a navigation_instruction"}), 400
+
+        log.info("🧩 Analyzing frame: %s for %s with %s (personalization: %s)",
+                 os.path.basename(image_path), ",".join(tasks), vision_model or 'auto', personalization_enabled)
+
+        final_prompt = inject_user_profile(frame_analysis_prompt, personalization_enabled, request_user_id(data))
+        final_prompt += "\n\n## Requested Sections:\n" + ", ".join(tasks) + "\n"
+        if navigation_instruction:
+            final_prompt += f"\n## Current Navigation Instruction from Google Maps:\n{navigation_instruction}\n"
+
+        start = time.monotonic()
+        result = analyze_within_budget("analyze-frame", image_path, final_prompt,
+                                       requested_model=vision_model, temperature=0.2, top_p=0.8,
+                                       validate=lambda d: require_any_section(d, tasks),
+                                       response_schema=sections_model(tuple((t, FRAME_SECTIONS[t]) for t in tasks),
+                                                                      "FrameAnalysis"))
+        sections, errors = validate_sections(result.data, tasks)
+        if errors:
+            log.warning("⚠️  Frame analysis dropped sections: %s", errors)
+
+        return jsonify({**sections, "errors": errors, "model": result.model_name, "hedged": result.hedged,
+                        "elapsed_ms": round((time.monotonic() - start) * 1000, 1)})
+
+    except CircuitOpenError as e:
+        log.warning("⚡ Frame analysis fast-fail: %s", e)
+        return degraded_response(e)
+
+    except GeminiDeadlineExceeded as e:
+        log.warning("⏱️  Frame analysis deadline exceeded: %s", e)
+        return jsonify({"error": str(e), "timeout": True}), 504
+
+    except Exception as e:
+        log.exception("❌ Frame analysis error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -439,54 +860,62 @@ def text_to_speech():
     """
     Endpoint for TTS audio generation.
 
-    Request: {"text": "Hello world", "tts_model": "coqui_vits_ljspeech" (optional)}
-    Response: WAV audio file (binary)
+    Request: {
+        "text": "Hello world",
+        "tts_model": "coqui_vits_ljspeech" (optional),
+        "format": "pcm16" | "opus" (optional; otherwise from the Accept header, default pcm16),
+        "sample_rate": 16000 (optional; downsample, default NAVAID_TTS_SAMPLE_RATE or the model's rate;
+                       400 unless one of audio_encoding.SAMPLE_RATES)
+    }
+    Response: audio file (binary) - 16-bit PCM WAV or Ogg/Opus, with X-Audio-Format
+    and X-Audio-Sample-Rate headers
     """
     try:
-        if tts_model is None:
-            return jsonify({"error": "TTS model not available"}), 503
-
         data = request.json
         text = data.get('text')
         tts_model_id = data.get('tts_model', 'coqui_vits_ljspeech')  # Default for mobile app
+        fmt = negotiate_format(data.get('format'), request.headers.get('Accept', ''))
 
         if not text:
             return jsonify({"error": "No text provided"}), 400
-
-        print(f"🔊 Generating TTS with {tts_model_id}: {text[:50]}...")
-
-        # Get the requested TTS model and speaker ID (if multi-speaker)
-        selected_tts, speaker_id = get_tts_model(tts_model_id)
-
-        if selected_tts is None:
-            return jsonify({"error": "TTS model not available"}), 503
-
-        # Generate audio (with speaker parameter for multi-speaker models)
-        if speaker_id:
-            print(f"  Using speaker: {speaker_id}")
-            wav = selected_tts.tts(text=text, speaker=speaker_id)
+        try:
+            sample_rate = int(data.get('sample_rate') or TTS_SAMPLE_RATE)
+        except (TypeError, ValueError):
+            sample_rate = -1
+        if sample_rate and sample_rate not in SAMPLE_RATES:
+            return jsonify({"error": f"Unsupported sample_rate: {data.get('sample_rate')}",
+                            "allowed": list(SAMPLE_RATES)}), 400
+
+        # Trip step audio is usually precomputed by the trip warmer
+        cached_audio = tts_audio_cache_path(text, tts_model_id, fmt, sample_rate)
+        if cached_audio.exists():
+            log.info("📦 Cached TTS audio: %s...", text[:50])
+            payload = cached_audio.read_bytes()
+            # The rate actually encoded (Opus may have snapped the requested one down)
+            mimetype, rate = None, payload_sample_rate(payload)
         else:
-            wav = selected_tts.tts(text=text)
-
-        # Convert to WAV bytes
-        import scipy.io.wavfile as wavfile
-        import numpy as np
-
-        audio_buffer = io.BytesIO()
-        wavfile.write(audio_buffer, 22050, np.array(wav))
-        audio_buffer.seek(0)
-
-        return send_file(
-            audio_buffer,
-            mimetype='audio/wav',
+            if tts_model is None:
+                return jsonify({"error": "TTS model not available"}), 503
+
+            log.info("🔊 Generating TTS with %s (%s): %s...", tts_model_id, fmt, text[:50])
+            encoded = synthesize_audio(text, tts_model_id, fmt, sample_rate)
+            if encoded is None:
+                return jsonify({"error": "TTS model not available"}), 503
+            payload, mimetype, rate = encoded
+
+        response = send_file(
+            io.BytesIO(payload),
+            mimetype=mimetype or ('audio/ogg' if fmt == 'opus' else 'audio/wav'),
             as_attachment=False,
-            download_name='tts.wav'
+            download_name='tts.ogg' if fmt == 'opus' else 'tts.wav'
         )
+        response.headers['X-Audio-Format'] = fmt
+        if rate:
+            response.headers['X-Audio-Sample-Rate'] = str(rate)
+        return response
 
     except Exception as e:
-        print(f"❌ TTS error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ TTS error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -494,8 +923,9 @@ def text_to_speech():
 def upload_image():
     """
     Accept an image file upload and return a local filesystem path for downstream endpoints.
+    Files are stored by content hash, so identical frames are only written once.
 
-    Response: {"image_path": "/absolute/path/to/saved.jpg"}
+    Response: {"image_path": "/absolute/path/to/<sha256>.jpg", "deduplicated": true/false}
     """
     try:
         if 'image' not in request.files:
@@ -505,22 +935,18 @@ def upload_image():
         if file.filename == '':
             return jsonify({"error": "Empty filename"}), 400
 
-        # Sanitize and generate unique filename to avoid collisions
+        # Sanitize extension; the stored name is the content hash
         filename = secure_filename(file.filename)
         ext = os.path.splitext(filename)[1]
-        unique_name = f"upload_{uuid.uuid4().hex}{ext or '.jpg'}"
-        save_path = UPLOADS_DIR / unique_name
 
-        file.save(save_path)
-        abs_path = str(save_path.resolve())
-        print(f"⬆️  Received upload: {filename} -> {abs_path}")
+        save_path, deduplicated = upload_store.save(file.stream, ext or '.jpg')
+        abs_path = str(save_path)
+        log.info("⬆️  Received upload: %s -> %s", filename, abs_path, extra={"deduplicated": deduplicated})
 
-        return jsonify({"image_path": abs_path})
+        return jsonify({"image_path": abs_path, "deduplicated": deduplicated})
 
     except Exception as e:
-        print(f"❌ Upload error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Upload error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -542,7 +968,7 @@ def transcribe_audio():
         if audio_file.filename == '':
             return jsonify({"error": "Empty filename"}), 400
 
-        print(f"🎤 Transcribing audio: {audio_file.filename}")
+        log.info("🎤 Transcribing audio: %s", audio_file.filename)
 
         # Save temporarily
         import tempfile
@@ -560,7 +986,7 @@ def transcribe_audio():
             # Transcribe
             result = whisper_model.transcribe(tmp_path)
 
-            print(f"📝 Transcription: {result['text']}")
+            log.info("📝 Transcription: %s", result['text'])
 
             return jsonify({"text": result['text'].strip()})
 
@@ -570,12 +996,239 @@ def transcribe_audio():
                 os.remove(tmp_path)
 
     except Exception as e:
-        print(f"❌ Transcription error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Transcription error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
+# Trip cache keys are built from canonicalized endpoints (normalized text, learned geocodes,
+# GPS fixes snapped to nearby anchors) so equivalent requests share one Directions result.
+# NAVAID_TRIP_KEY_GEOCODE=1 also geocodes unseen place names before the cache lookup.
+trip_keys = TripKeyCanonicalizer(
+    UPLOADS_DIR.parent / "cache" / "geocodes.json",
+    snap_radius_m=float(os.getenv("NAVAID_TRIP_SNAP_RADIUS_M", "25"))
+)
+atexit.register(trip_keys.flush)
+TRIP_KEY_GEOCODE = os.getenv("NAVAID_TRIP_KEY_GEOCODE", "0") == "1"
+
+# Decoded route geometry per trip, so GPS progress never re-reads the cache file or calls Maps
+route_index_cache = RouteIndexCache(max_entries=int(os.getenv("NAVAID_ROUTE_INDEX_ENTRIES", "256")))
+
+def geocode_unknown_places(*places):
+    """Teach trip_keys the coordinates of place names it has not seen (best effort)."""
+    for place in places:
+        if trip_keys.knows(place):
+            continue
+        try:
+            results = maps_breaker.call(gmaps_client.geocode, place)
+            if results:
+                trip_keys.learn(place, results[0]['geometry']['location'])
+        except Exception as e:
+            log.warning("⚠️  Geocoding '%s' failed, keying on text: %s", place, e)
+
+def build_trip_instructions(legs, destination):
+    """Turn a Directions leg into NavAid step dicts (TTS text, substeps, encoded polyline)."""
+    # Parse steps into NavAid format with more granularity
+    instructions = []
+
+    for i, step in enumerate(legs['steps'], start=1):
+        # Extract maneuver type
+        maneuver = step.get('maneuver', 'straight')
+
+        # Clean HTML from instruction text
+        instruction_text = re.sub('<[^<]+?>', '', step['html_instructions'])
+
+        # Create TTS-friendly text with more detail
+        tts_text = instruction_text
+        distance_m = step['distance']['value']
+        duration_s = step['duration']['value']
+
+        # Add distance context
+        if distance_m > 10:
+            if distance_m >= 1000:
+                distance_str = f"{distance_m / 1000:.1f} kilometers"
+            elif distance_m >= 100:
+                distance_str = f"{round(distance_m / 10) * 10} meters"  # Round to nearest 10m
+            else:
+                distance_str = f"{distance_m} meters"
+            tts_text = f"{instruction_text} for {distance_str}"
+
+        # Add time estimate for longer segments
+        if duration_s > 60:
+            time_str = f"{round(duration_s / 60)} minute" + ("s" if duration_s >= 120 else "")
+            tts_text = f"{tts_text} (about {time_str})"
+
+        # Extract additional details from substeps if available
+        substeps = []
+        if 'steps' in step:
+            for substep in step['steps']:
+                substep_text = re.sub('<[^<]+?>', '', substep.get('html_instructions', ''))
+                if substep_text and substep_text != instruction_text:
+                    substeps.append(substep_text)
+
+        instructions.append({
+            "step_number": i,
+            "instruction": instruction_text,
+            "distance_meters": distance_m,
+            "duration_seconds": duration_s,
+            "maneuver": maneuver,
+            "tts_text": tts_text,
+            "substeps": substeps if substeps else None,
+            "start_location": step.get('start_location'),
+            "end_location": step.get('end_location'),
+            "polyline": (step.get('polyline') or {}).get('points')
+        })
+
+    # Add final destination step
+    instructions.append({
+        "step_number": len(instructions) + 1,
+        "instruction": f"You have arrived at your destination",
+        "distance_meters": 0,
+        "duration_seconds": 0,
+        "maneuver": "destination",
+        "tts_text": f"You have arrived at {destination}"
+    })
+
+    return instructions
+
+
+def fetch_and_cache_trip(origin, destination, mode='walking', alternatives=False, avoid=(), units='metric'):
+    """
+    Call Directions, build both trip formats and write the full one to the trip cache.
+
+    Returns (trip_json, trip_json_full), or None if Maps found no route.
+    """
+    # Prepare API parameters
+    api_params = {
+        'origin': origin,
+        'destination': destination,
+        'mode': mode,
+        'alternatives': alternatives,
+        'units': units
+    }
+
+    # Add avoid parameter if specified
+    if avoid:
+        api_params['avoid'] = '|'.join(avoid)
+
+    # Call Google Maps Directions API (fails fast while Maps is unhealthy)
+    directions_result = maps_breaker.call(gmaps_client.directions, **api_params)
+
+    if not directions_result or len(directions_result) == 0:
+        return None
+
+    # Use the first route
+    route = directions_result[0]
+    legs = route['legs'][0]  # Assuming single-leg trip (no waypoints)
+
+    # Learn where the endpoints are, so differently worded requests for this trip hit
+    # the cache; then store it under the coordinate-based key
+    trip_keys.learn(origin, legs.get('start_location'))
+    trip_keys.learn(destination, legs.get('end_location'))
+    cache_key = trip_keys.cache_key(origin, destination, mode, avoid, units)
+    cache_file = trip_cache_file(cache_key)
+
+    # Extract trip metadata
+    total_distance = legs['distance']['value']  # meters
+    total_duration = legs['duration']['value']  # seconds
+
+    instructions = build_trip_instructions(legs, destination)
+
+    # Build NavAid trip JSON
+    # iOS app format (flat structure)
+    trip_json = {
+        "origin": origin,
+        "destination": destination,
+        "distance_meters": total_distance,
+        "duration_seconds": total_duration,
+        "num_steps": len(instructions),
+        "steps": instructions,  # iOS expects "steps" not "instructions"
+        "cache_key": cache_key,  # for /api/trip-progress
+        "from_cache": False
+    }
+
+    # Also save full metadata version for web demo
+    trip_json_full = {
+        "trip_metadata": {
+            "origin": origin,
+            "destination": destination,
+            "total_distance_meters": total_distance,
+            "estimated_duration_minutes": round(total_duration / 60, 1),
+            "num_steps": len(instructions),
+            "mode": mode,
+            "avoid": avoid,
+            "units": units,
+            "generated_at": datetime.now().isoformat(),
+            "cache_key": cache_key
+        },
+        "instructions": instructions,
+        "photo_timing": {
+            "description": f"Photos needed for each step during the trip",
+            "total_photos_needed": len(instructions),
+            "photo_naming_convention": f"Upload {len(instructions)} photos corresponding to each navigation step"
+        }
+    }
+
+    # Save to cache (use full format for web demo compatibility)
+    write_trip_cache_file(cache_file, trip_json_full)
+    log.info("💾 Cached trip to %s", cache_file.name)
+    route_index_cache.put(cache_key, RouteGeometry(instructions))
+
+
+    return trip_json, trip_json_full
+
+
+# Cached trips expire after NAVAID_TRIP_CACHE_TTL_S; routes requested often (per the trip
+# history) are refreshed in the background before that, step audio included, at no more
+# than NAVAID_TRIP_WARM_QPS Directions calls per second.
+TRIP_CACHE_TTL_S = float(os.getenv("NAVAID_TRIP_CACHE_TTL_S", str(7 * 86400)))
+TRIP_HISTORY_WINDOW_S = float(os.getenv("NAVAID_TRIP_HISTORY_WINDOW_S", str(14 * 86400)))
+trip_history_log = TripHistoryLog(UPLOADS_DIR.parent / "cache" / "trip_history.jsonl")
+
+def trip_cache_file(cache_key):
+    return UPLOADS_DIR.parent / "cache" / "trips" / f"{cache_key}.json"
+
+def write_trip_cache_file(cache_file, trip_json):
+    """Write a cached trip atomically; the cache warmer may refresh a trip while a request reads it."""
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_name(f".{cache_file.name}.{threading.get_ident()}.tmp")
+    with open(tmp_file, 'w') as f:
+        json.dump(trip_json, f, indent=2)
+    os.replace(tmp_file, cache_file)
+
+def trip_expires_in(cache_key):
+    """Seconds until a cached trip expires (negative once expired), or None if not cached."""
+    try:
+        age = time.time() - trip_cache_file(cache_key).stat().st_mtime
+    except FileNotFoundError:
+        return None
+    return TRIP_CACHE_TTL_S - age
+
+def history_entry_key(entry):
+    return trip_keys.cache_key(entry["origin"], entry["destination"], entry.get("mode", "walking"),
+                               entry.get("avoid", []), entry.get("units", "metric"))
+
+def warm_trip(entry):
+    trips = fetch_and_cache_trip(entry["origin"], entry["destination"], entry.get("mode", "walking"),
+                                 False, entry.get("avoid", []), entry.get("units", "metric"))
+    if trips is not None and tts_model is not None:
+        precompute_tts_audio(step.get("tts_text") for step in trips[0]["steps"])
+
+trip_warmer = TripCacheWarmer(
+    trip_history_log,
+    key_fn=history_entry_key,
+    expires_in_fn=trip_expires_in,
+    refresh_fn=warm_trip,
+    interval_s=float(os.getenv("NAVAID_TRIP_WARM_INTERVAL_S", "600")),
+    window_s=TRIP_HISTORY_WINDOW_S,
+    min_requests=int(os.getenv("NAVAID_TRIP_WARM_MIN_REQUESTS", "3")),
+    refresh_ahead_s=float(os.getenv("NAVAID_TRIP_WARM_AHEAD_S", "86400")),
+    qps=float(os.getenv("NAVAID_TRIP_WARM_QPS", "0.2")),
+    after_pass_fn=lambda: prune_tts_audio_cache(TRIP_HISTORY_WINDOW_S)
+)
+if gmaps_client is not None and os.getenv("NAVAID_TRIP_WARMER", "1") == "1":
+    trip_warmer.start()
+
+
 @app.route('/api/generate-trip', methods=['POST'])
 def generate_trip():
     """
@@ -610,15 +1263,23 @@ def generate_trip():
             return jsonify({"error": "Both origin and destination are required"}), 400
 
         # Generate cache key
-        import hashlib
-        cache_key = hashlib.md5(
-            f"{origin}|{destination}|{mode}|{sorted(avoid)}|{units}".encode()
-        ).hexdigest()
-        cache_file = UPLOADS_DIR.parent / "cache" / "trips" / f"{cache_key}.json"
-
-        # Check cache
-        if use_cache and cache_file.exists():
-            print(f"📦 Loading cached trip: {origin} → {destination}")
+        if TRIP_KEY_GEOCODE:
+            geocode_unknown_places(origin, destination)
+        cache_key = trip_keys.cache_key(origin, destination, mode, avoid, units)
+        cache_file = trip_cache_file(cache_key)
+
+        try:
+            trip_history_log.append({"origin": origin, "destination": destination, "mode": mode,
+                                 "avoid": avoid, "units": units})
+        except Exception as e:
+            log.warning("⚠️  Failed to record trip history: %s", e)
+
+        # Check cache (expired entries are regenerated)
+        fresh = (trip_expires_in(cache_key) or 0) > 0
+        if use_cache:
+            trip_keys.record_lookup(hit=fresh)
+        if use_cache and fresh:
+            log.info("📦 Loading cached trip: %s → %s", origin, destination)
             with open(cache_file, 'r') as f:
                 cached_trip = json.load(f)
 
@@ -633,6 +1294,7 @@ def generate_trip():
                         "duration_seconds": int(meta.get("estimated_duration_minutes", 0) * 60),
                         "num_steps": meta.get("num_steps", 0),
                         "steps": cached_trip.get("instructions", []),
+                        "cache_key": cache_key,
                         "from_cache": True
                     }
                     return jsonify(ios_format)
@@ -644,149 +1306,259 @@ def generate_trip():
                 cached_trip["from_cache"] = True
                 return jsonify(cached_trip)
 
-        print(f"🗺️  Generating trip: {origin} → {destination} ({mode}, avoid: {avoid})")
+        log.info("🗺️  Generating trip: %s → %s (%s, avoid: %s)", origin, destination, mode, avoid)
 
-        # Prepare API parameters
-        api_params = {
-            'origin': origin,
-            'destination': destination,
-            'mode': mode,
-            'alternatives': alternatives,
-            'units': units
-        }
+        trips = fetch_and_cache_trip(origin, destination, mode, alternatives, avoid, units)
+        if trips is None:
+            return jsonify({"error": "No route found"}), 404
+        trip_json, trip_json_full = trips
+        instructions = trip_json["steps"]
 
-        # Add avoid parameter if specified
-        if avoid:
-            api_params['avoid'] = '|'.join(avoid)
+        log.info("✅ Generated trip with %d steps", len(instructions))
 
-        # Call Google Maps Directions API
-        directions_result = gmaps_client.directions(**api_params)
+        # Return appropriate format based on demo_mode
+        if demo_mode == 'IOS':
+            return jsonify(trip_json)
+        else:
+            return jsonify(trip_json_full)
 
-        if not directions_result or len(directions_result) == 0:
-            return jsonify({"error": "No route found"}), 404
+    except CircuitOpenError as e:
+        log.warning("⚡ Trip generation fast-fail: %s", e)
+        return degraded_response(e)
 
-        # Use the first route
-        route = directions_result[0]
-        legs = route['legs'][0]  # Assuming single-leg trip (no waypoints)
+    except Exception as e:
+        log.exception("❌ Trip generation error: %s", e)
+        return jsonify({"error": str(e)}), 500
 
-        # Extract trip metadata
-        total_distance = legs['distance']['value']  # meters
-        total_duration = legs['duration']['value']  # seconds
 
-        # Parse steps into NavAid format with more granularity
-        instructions = []
-        import re
+OFF_ROUTE_THRESHOLD_M = float(os.getenv("NAVAID_OFF_ROUTE_THRESHOLD_M", "30"))
+# Off-route users within this distance of the remaining route are walked back to it locally;
+# farther away we ask Maps for a fresh route
+LOCAL_REJOIN_MAX_M = float(os.getenv("NAVAID_LOCAL_REJOIN_MAX_M", "150"))
+WALKING_SPEED_MPS = 1.2
+
+def load_trip(cache_key):
+    """Cached trip JSON for `cache_key` (iOS or full format), or None."""
+    if not re.fullmatch(r"[0-9a-f]{32}", cache_key or ""):
+        return None
+    cache_file = trip_cache_file(cache_key)
+    if not cache_file.exists():
+        return None
+    with open(cache_file, 'r') as f:
+        return json.load(f)
+
+def get_route_geometry(cache_key):
+    """Route index for a cached trip, built on first use."""
+    geometry = route_index_cache.get(cache_key)
+    if geometry is None:
+        trip = load_trip(cache_key)
+        if trip is None:
+            return None
+        geometry = RouteGeometry(trip.get("instructions") or trip.get("steps") or [])
+        route_index_cache.put(cache_key, geometry)
+    return geometry
+
+@app.route('/api/trip-progress', methods=['POST'])
+def trip_progress():
+    """
+    Locate a GPS fix on a cached trip (no Maps call).
 
-        for i, step in enumerate(legs['steps'], start=1):
-            # Extract maneuver type
-            maneuver = step.get('maneuver', 'straight')
+    Request: {
+        "cache_key": "abc123...",          (from /api/generate-trip)
+        "lat": 37.8716, "lng": -122.2727,
+        "step_number": 2 (optional, last known step; earlier steps are ignored),
+        "off_route_threshold_m": 30 (optional)
+    }
+    Response: {
+        "step_number": 2, "instruction": "...",
+        "next_instruction": "...", "next_maneuver": "turn-left",
+        "distance_to_maneuver_meters": 42.5, "distance_from_route_meters": 3.1,
+        "remaining_meters": 310.0, "off_route": false, "elapsed_us": 35.2
+    }
+    """
+    try:
+        data = request.json or {}
+        cache_key = data.get('cache_key')
+        lat, lng = data.get('lat'), data.get('lng')
+        if lat is None or lng is None:
+            return jsonify({"error": "lat and lng are required"}), 400
+
+        geometry = get_route_geometry(cache_key)
+        if geometry is None:
+            return jsonify({"error": "Unknown trip cache_key"}), 404
+
+        start = time.perf_counter()
+        from_step = max(0, int(data.get('step_number') or 1) - 1)
+        progress = geometry.progress(float(lat), float(lng),
+                                     off_route_m=float(data.get('off_route_threshold_m', OFF_ROUTE_THRESHOLD_M)),
+                                     from_step=from_step)
+        elapsed_us = (time.perf_counter() - start) * 1e6
+
+        step_index = progress.pop("step_index")
+        if step_index is not None:
+            step = geometry.steps[step_index]
+            next_step = geometry.steps[step_index + 1] if step_index + 1 < len(geometry.steps) else None
+            progress.update({
+                "step_number": step.get("step_number", step_index + 1),
+                "instruction": step.get("instruction"),
+                "next_instruction": next_step.get("instruction") if next_step else None,
+                "next_maneuver": next_step.get("maneuver") if next_step else None,
+            })
+        progress["elapsed_us"] = round(elapsed_us, 1)
+        return jsonify(progress)
 
-            # Clean HTML from instruction text
-            instruction_text = re.sub('<[^<]+?>', '', step['html_instructions'])
+    except Exception as e:
+        log.exception("❌ Trip progress error: %s", e)
+        return jsonify({"error": str(e)}), 500
 
-            # Create TTS-friendly text with more detail
-            tts_text = instruction_text
-            distance_m = step['distance']['value']
-            duration_s = step['duration']['value']
 
-            # Add distance context
-            if distance_m > 10:
-                if distance_m >= 1000:
-                    distance_str = f"{distance_m / 1000:.1f} kilometers"
-                elif distance_m >= 100:
-                    distance_str = f"{round(distance_m / 10) * 10} meters"  # Round to nearest 10m
-                else:
-                    distance_str = f"{distance_m} meters"
-                tts_text = f"{instruction_text} for {distance_str}"
-
-            # Add time estimate for longer segments
-            if duration_s > 60:
-                time_str = f"{round(duration_s / 60)} minute" + ("s" if duration_s >= 120 else "")
-                tts_text = f"{tts_text} (about {time_str})"
-
-            # Extract additional details from substeps if available
-            substeps = []
-            if 'steps' in step:
-                for substep in step['steps']:
-                    substep_text = re.sub('<[^<]+?>', '', substep.get('html_instructions', ''))
-                    if substep_text and substep_text != instruction_text:
-                        substeps.append(substep_text)
-
-            instructions.append({
-                "step_number": i,
-                "instruction": instruction_text,
-                "distance_meters": distance_m,
-                "duration_seconds": duration_s,
-                "maneuver": maneuver,
-                "tts_text": tts_text,
-                "substeps": substeps if substeps else None,
-                "start_location": step.get('start_location'),
-                "end_location": step.get('end_location')
-            })
+def format_distance(distance_m):
+    """Spoken distance, matching the rounding used for trip steps."""
+    distance_m = int(round(distance_m))
+    if distance_m >= 1000:
+        return f"{distance_m / 1000:.1f} kilometers"
+    if distance_m >= 100:
+        return f"{round(distance_m / 10) * 10} meters"
+    return f"{distance_m} meters"
+
+def local_rejoin_steps(geometry, lat, lng, rejoin):
+    """Approach step back to the route, followed by the rest of the original trip."""
+    direction = compass_direction(rejoin["heading_deg"])
+    distance_m = int(round(rejoin["distance_m"]))
+    approach = {
+        "step_number": 1,
+        "instruction": f"Head {direction} to rejoin the route",
+        "distance_meters": distance_m,
+        "duration_seconds": int(distance_m / WALKING_SPEED_MPS),
+        "maneuver": "rejoin-route",
+        "tts_text": f"You are off route. Head {direction} for {format_distance(distance_m)} to rejoin the route",
+        "substeps": None,
+        "start_location": {"lat": lat, "lng": lng},
+        "end_location": {"lat": rejoin["lat"], "lng": rejoin["lng"]}
+    }
 
-        # Add final destination step
-        instructions.append({
-            "step_number": len(instructions) + 1,
-            "instruction": f"You have arrived at your destination",
-            "distance_meters": 0,
-            "duration_seconds": 0,
-            "maneuver": "destination",
-            "tts_text": f"You have arrived at {destination}"
-        })
+    steps = [approach]
+    for index in range(rejoin["step_index"], len(geometry.steps)):
+        step = dict(geometry.steps[index])
+        if index == rejoin["step_index"] and step.get("distance_meters"):
+            # Only part of the step we rejoin is left to walk
+            remaining = int(round(rejoin["remaining_in_step_m"]))
+            step["duration_seconds"] = int(step.get("duration_seconds", 0) * remaining / step["distance_meters"])
+            step["distance_meters"] = remaining
+            step["start_location"] = approach["end_location"]
+        step["step_number"] = len(steps) + 1
+        steps.append(step)
+    return steps
+
+
+@app.route('/api/reroute', methods=['POST'])
+def reroute():
+    """
+    Recover from going off route on a cached trip.
 
-        # Build NavAid trip JSON
-        from datetime import datetime
-        # iOS app format (flat structure)
-        trip_json = {
-            "origin": origin,
-            "destination": destination,
-            "distance_meters": total_distance,
-            "duration_seconds": total_duration,
-            "num_steps": len(instructions),
-            "steps": instructions,  # iOS expects "steps" not "instructions"
-            "from_cache": False
-        }
+    Close to the route (NAVAID_LOCAL_REJOIN_MAX_M), the reroute is computed locally:
+    one step back to the nearest point of the remaining route, then the rest of the trip.
+    Only farther away is Maps asked for a new route from the current position.
 
-        # Also save full metadata version for web demo
-        trip_json_full = {
-            "trip_metadata": {
-                "origin": origin,
-                "destination": destination,
-                "total_distance_meters": total_distance,
-                "estimated_duration_minutes": round(total_duration / 60, 1),
-                "num_steps": len(instructions),
-                "mode": mode,
-                "avoid": avoid,
-                "units": units,
-                "generated_at": datetime.now().isoformat(),
-                "cache_key": cache_key
-            },
-            "instructions": instructions,
-            "photo_timing": {
-                "description": f"Photos needed for each step during the trip",
-                "total_photos_needed": len(instructions),
-                "photo_naming_convention": f"Upload {len(instructions)} photos corresponding to each navigation step"
-            }
-        }
+    Request: {"cache_key": "abc123...", "lat": 37.87, "lng": -122.27, "step_number": 2 (optional)}
+    Response: {
+        "rerouted": true/false,
+        "source": "local" | "maps" | null,
+        "cache_key": "...",                (trip to track progress against)
+        "distance_from_route_meters": 48.2,
+        "num_steps": 4, "distance_meters": 530, "steps": [...]
+    }
+    """
+    try:
+        data = request.json or {}
+        cache_key = data.get('cache_key')
+        lat, lng = data.get('lat'), data.get('lng')
+        if lat is None or lng is None:
+            return jsonify({"error": "lat and lng are required"}), 400
+        lat, lng = float(lat), float(lng)
+
+        geometry = get_route_geometry(cache_key)
+        if geometry is None:
+            return jsonify({"error": "Unknown trip cache_key"}), 404
+
+        start = time.perf_counter()
+        from_step = max(0, int(data.get('step_number') or 1) - 1)
+        progress = geometry.progress(lat, lng, off_route_m=OFF_ROUTE_THRESHOLD_M, from_step=from_step)
+        if not progress["off_route"]:
+            return jsonify({
+                "rerouted": False,
+                "source": None,
+                "cache_key": cache_key,
+                "distance_from_route_meters": progress["distance_from_route_meters"]
+            })
 
-        # Save to cache (use full format for web demo compatibility)
-        cache_file.parent.mkdir(parents=True, exist_ok=True)
-        with open(cache_file, 'w') as f:
-            json.dump(trip_json_full, f, indent=2)
-        print(f"💾 Cached trip to {cache_file.name}")
+        rejoin = geometry.rejoin(lat, lng, from_step=from_step)
+        if rejoin is not None and rejoin["distance_m"] <= LOCAL_REJOIN_MAX_M:
+            steps = local_rejoin_steps(geometry, lat, lng, rejoin)
+            log.info("↩️  Local reroute on %s: %.0fm back to step %d (%.2fms)", cache_key,
+                     rejoin["distance_m"], rejoin["step_index"] + 1, (time.perf_counter() - start) * 1000)
+            return jsonify({
+                "rerouted": True,
+                "source": "local",
+                "cache_key": cache_key,
+                "distance_from_route_meters": round(rejoin["distance_m"], 1),
+                "num_steps": len(steps),
+                "distance_meters": sum(step.get("distance_meters", 0) for step in steps),
+                "steps": steps
+            })
 
-        print(f"✅ Generated trip with {len(instructions)} steps")
+        # Too far from the route: ask Maps, from the current position to the same destination
+        if gmaps_client is None:
+            return jsonify({"error": "Google Maps API not available"}), 503
+        meta = (load_trip(cache_key) or {}).get("trip_metadata", {})
+        destination = meta.get("destination")
+        if not destination:
+            return jsonify({"error": "Trip has no destination to reroute to"}), 409
+
+        reroute_key = hashlib.md5(f"reroute|{cache_key}|{lat:.4f}|{lng:.4f}".encode()).hexdigest()
+        reroute_geometry = get_route_geometry(reroute_key)
+        if reroute_geometry is None:
+            api_params = {
+                'origin': (lat, lng),
+                'destination': destination,
+                'mode': meta.get('mode', 'walking'),
+                'units': meta.get('units', 'metric')
+            }
+            if meta.get('avoid'):
+                api_params['avoid'] = '|'.join(meta['avoid'])
+            directions_result = maps_breaker.call(gmaps_client.directions, **api_params)
+            if not directions_result:
+                return jsonify({"error": "No route found"}), 404
+
+            leg = directions_result[0]['legs'][0]
+            instructions = build_trip_instructions(leg, destination)
+            write_trip_cache_file(trip_cache_file(reroute_key), {
+                "trip_metadata": dict(meta, origin=f"{lat:.6f},{lng:.6f}", cache_key=reroute_key,
+                                      total_distance_meters=leg['distance']['value'],
+                                      estimated_duration_minutes=round(leg['duration']['value'] / 60, 1),
+                                      num_steps=len(instructions), rerouted_from=cache_key),
+                "instructions": instructions})
+            reroute_geometry = RouteGeometry(instructions)
+            route_index_cache.put(reroute_key, reroute_geometry)
+
+        log.info("🗺️  Maps reroute on %s → %s", cache_key, reroute_key)
+        steps = reroute_geometry.steps
+        return jsonify({
+            "rerouted": True,
+            "source": "maps",
+            "cache_key": reroute_key,
+            "distance_from_route_meters": round(rejoin["distance_m"], 1) if rejoin else None,
+            "num_steps": len(steps),
+            "distance_meters": sum(step.get("distance_meters", 0) for step in steps),
+            "steps": steps
+        })
 
-        # Return appropriate format based on demo_mode
-        if demo_mode == 'IOS':
-            return jsonify(trip_json)
-        else:
-            return jsonify(trip_json_full)
+    except CircuitOpenError as e:
+        log.warning("⚡ Reroute fast-fail: %s", e)
+        return degraded_response(e)
 
     except Exception as e:
-        print(f"❌ Trip generation error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Reroute error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -827,14 +1599,14 @@ def trip_history():
                         "cache_key": metadata.get('cache_key')
                     })
             except Exception as e:
-                print(f"⚠️  Failed to load cache file {cache_file.name}: {e}")
+                log.warning("⚠️  Failed to load cache file %s: %s", cache_file.name, e)
                 continue
 
         # Return most recent 10 trips
         return jsonify(trips[:10])
 
     except Exception as e:
-        print(f"❌ Trip history error: {e}")
+        log.error("❌ Trip history error: %s", e)
         return jsonify([])
 
 
@@ -843,7 +1615,14 @@ def generate_color_scheme():
     """
     Generate personalized color scheme for user based on colorblindness description.
 
-    Request: {"colorblind_description": "I have protanopia (red-green colorblindness)..."}
+    Colors are solved locally (CVD simulation + WCAG contrast + minimum ΔE), so the
+    response is deterministic and never contains duplicate button colors. Gemini is
+    only consulted (optionally) to classify descriptions the keyword matcher can't.
+
+    Request: {
+        "colorblind_description": "I have protanopia (red-green colorblindness)...",
+        "colorblindness_type": "protanopia" (optional, skips classification)
+    }
     Response: {
         "start_button": "#1E88E5",
         "pause_button": "#FFA726",
@@ -853,102 +1632,25 @@ def generate_color_scheme():
     }
     """
     try:
-        data = request.json
+        data = request.json or {}
         colorblind_desc = data.get('colorblind_description', 'No colorblindness')
+        cvd_type = data.get('colorblindness_type')
 
-        print(f"🎨 Generating color scheme for: {colorblind_desc[:50]}...")
-
-        # Use Gemini 2.0 Flash Lite for color generation (direct API call)
-        import google.generativeai as genai
-
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        gcfg = genai.types.GenerationConfig(
-            temperature=0.7,  # Higher for color variety
-            response_mime_type="application/json"
-        )
+        log.info("🎨 Generating color scheme for: %s...", colorblind_desc[:50])
 
-        prompt = f"""You are a WCAG AAA color accessibility expert. Generate 5 COMPLETELY UNIQUE, VIBRANT colors for a navigation app.
-
-**User's Vision:** {colorblind_desc}
-
-**CRITICAL RULES:**
-1. **ZERO DUPLICATES**: start_button, pause_button, end_button, scene_button MUST all be DIFFERENT colors
-2. **Minimum Distance**: Each color must be 60+ RGB units apart from others
-3. **High Contrast**: 7:1+ contrast against black backgrounds (WCAG AAA)
-4. **Vibrant**: Saturated, eye-catching colors (50-80% saturation in HSL)
-5. **Optimized**: For user's specific colorblind type
-
-**Color Semantics (USE DIFFERENT SPECTRUM FOR EACH):**
-- start_button: Green/Cyan spectrum (#00C853, #00E676 range) - GO action
-- pause_button: Yellow/Orange spectrum (#FFC107, #FF9800 range) - CAUTION
-- end_button: Red/Pink spectrum (#F44336, #E91E63 range) - STOP
-- scene_button: Purple/Violet spectrum (#9C27B0, #7B1FA2 range) - ANALYZE
-- deep_analyze_button: EXACT SAME as scene_button
-
-**Validation:**
-Before returning, verify NO two colors (except scene=deep_analyze) are similar.
-
-Return JSON (no markdown):
-{{
-  "start_button": "#HEXCODE",
-  "pause_button": "#HEXCODE",
-  "end_button": "#HEXCODE",
-  "scene_button": "#HEXCODE",
-  "deep_analyze_button": "#HEXCODE"
-}}"""
-
-        # Retry up to 3 times to get unique colors
-        for attempt in range(3):
-            response = model.generate_content(prompt, generation_config=gcfg)
-            raw_dict = json.loads(response.text)
-
-            # Validate color uniqueness
-            colors_to_check = {
-                'start_button': raw_dict['start_button'],
-                'pause_button': raw_dict['pause_button'],
-                'end_button': raw_dict['end_button'],
-                'scene_button': raw_dict['scene_button']
-            }
+        if cvd_type not in CVD_TYPES:
+            cvd_type = classify_description(colorblind_desc)
+        if cvd_type is None and PALETTE_LLM_CLASSIFY:
+            cvd_type = classify_description_with_gemini(colorblind_desc)
+        if cvd_type is None:
+            cvd_type = "unknown"  # palette that stays distinct for every deficiency
 
-            def hex_to_rgb(hex_color):
-                hex_color = hex_color.lstrip('#')
-                return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-
-            def rgb_distance(c1, c2):
-                r1, g1, b1 = hex_to_rgb(c1)
-                r2, g2, b2 = hex_to_rgb(c2)
-                return ((r2-r1)**2 + (g2-g1)**2 + (b2-b1)**2) ** 0.5
-
-            # Check all pairs for minimum distance
-            all_unique = True
-            color_list = list(colors_to_check.items())
-            for i in range(len(color_list)):
-                for j in range(i+1, len(color_list)):
-                    name1, color1 = color_list[i]
-                    name2, color2 = color_list[j]
-                    dist = rgb_distance(color1, color2)
-                    if dist < 60:
-                        print(f"⚠️ Colors too similar: {name1}={color1} and {name2}={color2} (distance: {dist:.1f})")
-                        all_unique = False
-                        break
-                if not all_unique:
-                    break
-
-            if all_unique:
-                print(f"✅ Generated unique color scheme (attempt {attempt + 1}): {raw_dict}")
-                return jsonify(raw_dict)
-            else:
-                print(f"⚠️ Attempt {attempt + 1} failed - retrying with higher temperature...")
-                gcfg.temperature = min(1.0, gcfg.temperature + 0.15)
-
-        # If all attempts fail, return validated fallback
-        print("⚠️ All attempts produced duplicates - using fallback")
-        return jsonify(raw_dict)  # Return last attempt
+        palette = solve_palette(cvd_type)
+        log.info("✅ Color scheme for %s: %s", cvd_type, palette)
+        return jsonify(palette)
 
     except Exception as e:
-        print(f"❌ Color scheme generation error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Color scheme generation error: %s", e)
         # Return default fallback colors (purple theme)
         return jsonify({
             "start_button": "#8B5CF6",
@@ -961,29 +1663,46 @@ Return JSON (no markdown):
 
 @app.route('/api/sync-profile', methods=['POST'])
 def sync_profile():
-    """Receive and cache user profile from iOS app."""
-    global cached_ios_profile
+    """
+    Receive and cache a user profile from the iOS app.
 
+    The profile is keyed by "user_id"/"device_id" in the body (or X-User-Id /
+    X-Device-Id headers); persistence happens in the background.
+    """
     try:
         profile_data = request.json
-        print(f"📱 Received iOS profile sync: {profile_data.get('name', 'Unknown')}")
+        user_id = request_user_id(profile_data)
+        log.info("📱 Received iOS profile sync: %s (user: %s)", profile_data.get('name', 'Unknown'), user_id)
 
-        # Cache the profile for immediate use
-        cached_ios_profile = profile_data
+        profile_store.put(user_id, profile_data)
 
-        # Optionally save to a file as backup
-        sync_path = os.path.join(os.path.dirname(__file__), "ios_profile_synced.json")
-        with open(sync_path, 'w') as f:
-            json.dump(profile_data, f, indent=2)
-
-        print(f"✅ iOS profile cached and saved to {sync_path}")
+        log.info("✅ iOS profile cached for %s", user_id)
         return jsonify({"status": "success", "message": "Profile synced"}), 200
 
     except Exception as e:
-        print(f"❌ Profile sync error: {e}")
+        log.error("❌ Profile sync error: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Runtime metrics (model routing decisions, per-model latency/error rates)."""
+    return jsonify({
+        "model_router": model_router.snapshot(),
+        "profile_store": profile_store.stats(),
+        "trip_cache": trip_keys.snapshot(),
+        "trip_warmer": trip_warmer.snapshot(),
+        "image_cache": IMAGE_CACHE.stats(),
+        "gemini_output": output_stats.snapshot(),
+        # Billed tokens and list-price cost per model and response schema (one schema per endpoint)
+        "gemini_usage": {"totals": usage_stats.totals(), "by_model_schema": usage_stats.snapshot()},
+        "circuit_breakers": {
+            breaker.name: breaker.snapshot()
+            for breaker in [maps_breaker] + [gemini_breaker(m) for m in model_router.models]
+        }
+    })
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+circuit_breaker.py - Fast-fail protection for upstream dependencies (Gemini, Maps)
+
+States:
+1. closed    - calls pass through; consecutive failures are counted
+2. open      - calls fail immediately with CircuitOpenError until `recovery_timeout_s` passes
+3. half_open - up to `half_open_max_calls` probe calls are let through; a success
+               closes the circuit, a failure re-opens it
+"""
+
+import logging
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+log = logging.getLogger(__name__)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an upstream that is known to be unhealthy."""
+
+    def __init__(self, name: str, retry_after_s: float):
+        super().__init__(f"{name} circuit open; retry in {retry_after_s:.1f}s")
+        self.name = name
+        self.retry_after_s = retry_after_s
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with half-open probing."""
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout_s: float = 30.0,
+                 half_open_max_calls: int = 1, ignore_exceptions: tuple = (), neutral_exceptions: tuple = ()):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout_s = recovery_timeout_s
+        self.half_open_max_calls = half_open_max_calls
+        # Exceptions that say nothing about upstream health (e.g. bad model output)
+        self.ignore_exceptions = ignore_exceptions
+        # Exceptions that end a call without an outcome (e.g. a hedged call cancelled
+        # because the other model answered first): neither a success nor a failure
+        self.neutral_exceptions = neutral_exceptions
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_inflight = 0
+        self._rejected = 0
+        self._times_opened = 0
+        self._neutral = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.recovery_timeout_s:
+            self._state = HALF_OPEN
+            self._half_open_inflight = 0
+        return self._state
+
+    def is_available(self) -> bool:
+        """True if a call would currently be let through (does not reserve a probe slot)."""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            return state == CLOSED or (state == HALF_OPEN and self._half_open_inflight < self.half_open_max_calls)
+
+    def _before_call(self):
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == OPEN:
+                self._rejected += 1
+                raise CircuitOpenError(self.name, self.recovery_timeout_s - (now - self._opened_at))
+            if state == HALF_OPEN:
+                if self._half_open_inflight >= self.half_open_max_calls:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.name, self.recovery_timeout_s)
+                self._half_open_inflight += 1
+            return state
+
+    def _on_success(self, state_at_call: str):
+        with self._lock:
+            if state_at_call == HALF_OPEN:
+                self._half_open_inflight = max(0, self._half_open_inflight - 1)
+                if self._state == HALF_OPEN:
+                    log.info("✅ Circuit '%s' closed (probe succeeded)", self.name)
+            self._state = CLOSED
+            self._failures = 0
+
+    def _on_neutral(self, state_at_call: str):
+        with self._lock:
+            self._neutral += 1
+            if state_at_call == HALF_OPEN:
+                self._half_open_inflight = max(0, self._half_open_inflight - 1)
+
+    def _on_failure(self, state_at_call: str):
+        with self._lock:
+            if state_at_call == HALF_OPEN:
+                self._half_open_inflight = max(0, self._half_open_inflight - 1)
+            self._failures += 1
+            if state_at_call == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                if self._state != OPEN:
+                    self._times_opened += 1
+                    log.warning("⚠️  Circuit '%s' opened after %d failure(s)", self.name, self._failures)
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def call(self, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs) through the breaker. Raises CircuitOpenError when open."""
+        state_at_call = self._before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except self.neutral_exceptions:
+            self._on_neutral(state_at_call)
+            raise
+        except self.ignore_exceptions:
+            self._on_success(state_at_call)
+            raise
+        except Exception:
+            self._on_failure(state_at_call)
+            raise
+        self._on_success(state_at_call)
+        return result
+
+    def call_stream(self, fn, *args, **kwargs):
+        """
+        Like call() for a generator function: yields its items, and records the outcome
+        when the stream ends, so failures before or during streaming count against the
+        circuit. Raises CircuitOpenError on the first next() when open. A consumer that
+        stops early (GeneratorExit) records nothing.
+        """
+        state_at_call = self._before_call()
+        try:
+            yield from fn(*args, **kwargs)
+        except GeneratorExit:
+            self._on_neutral(state_at_call)
+            raise
+        except self.neutral_exceptions:
+            self._on_neutral(state_at_call)
+            raise
+        except self.ignore_exceptions:
+            self._on_success(state_at_call)
+            raise
+        except Exception:
+            self._on_failure(state_at_call)
+            raise
+        self._on_success(state_at_call)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self._current_state(time.monotonic()),
+                "consecutive_failures": self._failures,
+                "times_opened": self._times_opened,
+                "rejected_calls": self._rejected,
+                "neutral_calls": self._neutral,
+            }
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+color_palette.py - Deterministic accessible button palette for /api/generate-color-scheme
+
+Replaces LLM-generated colors with a local solver:
+1. Simulate how each candidate color is seen with the user's color vision deficiency
+   (Machado et al. 2009 matrices, applied in linear RGB)
+2. Keep candidates with WCAG contrast >= 7:1 against the black app background
+   (falling back to 4.5:1 only if a role has no AAA candidate)
+3. Pick one color per button role, maximizing the minimum CIE76 ΔE between buttons
+   as seen by BOTH the user and normal vision, so buttons never look alike
+
+Results are memoized per deficiency type: a cold solve takes tens of milliseconds,
+every later request for the same type is a dictionary lookup.
+"""
+
+import colorsys
+import itertools
+import re
+from functools import lru_cache
+
+BACKGROUND_RGB = (0.0, 0.0, 0.0)  # app buttons sit on a black background
+
+# Machado, Oliveira & Fernandes (2009), severity 1.0, linear RGB
+_CVD_MATRICES = {
+    "protanopia": ((0.152286, 1.052583, -0.204868),
+                   (0.114503, 0.786281, 0.099216),
+                   (-0.003882, -0.048116, 1.051998)),
+    "deuteranopia": ((0.367322, 0.860646, -0.227968),
+                     (0.280085, 0.672501, 0.047413),
+                     (-0.011820, 0.042940, 0.968881)),
+    "tritanopia": ((1.255528, -0.076749, -0.178779),
+                   (-0.078411, 0.930809, 0.147602),
+                   (0.004733, 0.691367, 0.303900)),
+}
+_ANOMALY_SEVERITY = 0.6  # anomalous trichromacy: blend of identity and the dichromat matrix
+
+CVD_TYPES = (
+    "none", "protanopia", "deuteranopia", "tritanopia",
+    "protanomaly", "deuteranomaly", "tritanomaly", "achromatopsia",
+    "unknown",  # optimize for every deficiency at once
+)
+
+# Button roles keep their semantic hue families (HSL hue ranges in degrees)
+ROLE_HUES = {
+    "start_button": (120, 190),   # green / cyan   - GO
+    "pause_button": (35, 60),     # yellow / orange - CAUTION
+    "end_button": (330, 375),     # red / pink     - STOP (wraps past 360)
+    "scene_button": (255, 300),   # purple / violet - ANALYZE
+}
+_HUE_STEP = 5
+_SATURATIONS = (0.55, 0.65, 0.8)
+_LIGHTNESSES = (0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8)
+_CONTRAST_TIERS = (7.0, 4.5)  # WCAG AAA, then AA
+
+# Ordered: the first matching pattern wins
+_DESCRIPTION_PATTERNS = (
+    ("none", r"\bno (colou?r ?blind|colou?r vision)|\bnormal (colou?r )?vision|^\s*(none|no)\s*$"),
+    ("achromatopsia", r"achromat|monochroma|total colou?r ?blind|no colou?r|gr[ae]yscale|black and white|"
+                      r"can'?t see (any )?colou?rs"),
+    ("protanomaly", r"protanomal|red[- ]weak"),
+    ("protanopia", r"protan|red[- ]blind"),
+    ("deuteranomaly", r"deuteranomal|green[- ]weak"),
+    ("deuteranopia", r"deutan|deuteran|green[- ]blind|red[- ]green"),
+    ("tritanomaly", r"tritanomal|blue[- ]weak"),
+    ("tritanopia", r"tritan|blue[- ]blind|blue[- ]yellow"),
+)
+
+
+def classify_description(text: str):
+    """Map a free-text colorblindness description to a CVD type, or None if unclear."""
+    lowered = (text or "").lower()
+    for cvd_type, pattern in _DESCRIPTION_PATTERNS:
+        if re.search(pattern, lowered):
+            return cvd_type
+    return None
+
+
+def _srgb_to_linear(c):
+    return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(c):
+    c = min(1.0, max(0.0, c))
+    return c * 12.92 if c <= 0.0031308 else 1.055 * c ** (1 / 2.4) - 0.055
+
+
+def _matrix_for(cvd_type):
+    if cvd_type.endswith("anomaly"):
+        full = _CVD_MATRICES[cvd_type.replace("anomaly", "anopia")]
+        s = _ANOMALY_SEVERITY
+        return tuple(tuple((1 - s) * (i == j) + s * full[i][j] for j in range(3)) for i in range(3))
+    return _CVD_MATRICES.get(cvd_type)
+
+
+def simulate(rgb, cvd_type):
+    """Return the sRGB color (0-1 floats) as perceived with `cvd_type`."""
+    lin = [_srgb_to_linear(c) for c in rgb]
+    if cvd_type == "achromatopsia":
+        y = 0.2126 * lin[0] + 0.7152 * lin[1] + 0.0722 * lin[2]
+        return (_linear_to_srgb(y),) * 3
+    m = _matrix_for(cvd_type)
+    if m is None:
+        return tuple(rgb)
+    return tuple(_linear_to_srgb(sum(m[i][j] * lin[j] for j in range(3))) for i in range(3))
+
+
+def relative_luminance(rgb):
+    r, g, b = (_srgb_to_linear(c) for c in rgb)
+    return 0.2126 * r + 0.7152 * g + 0.0722 * b
+
+
+def contrast_ratio(rgb1, rgb2):
+    l1, l2 = sorted((relative_luminance(rgb1), relative_luminance(rgb2)), reverse=True)
+    return (l1 + 0.05) / (l2 + 0.05)
+
+
+def _to_lab(rgb):
+    r, g, b = (_srgb_to_linear(c) for c in rgb)
+    # linear sRGB -> XYZ (D65), normalized by the white point
+    x = (0.4124 * r + 0.3576 * g + 0.1805 * b) / 0.95047
+    y = 0.2126 * r + 0.7152 * g + 0.0722 * b
+    z = (0.0193 * r + 0.1192 * g + 0.9505 * b) / 1.08883
+    f = lambda t: t ** (1 / 3) if t > 0.008856 else 7.787 * t + 16 / 116
+    fx, fy, fz = f(x), f(y), f(z)
+    return (116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz))
+
+
+def delta_e(lab1, lab2):
+    """CIE76 color difference."""
+    return sum((a - b) ** 2 for a, b in zip(lab1, lab2)) ** 0.5
+
+
+def _hex(rgb):
+    return "#" + "".join(f"{round(c * 255):02X}" for c in rgb)
+
+
+def _views(cvd_type):
+    if cvd_type == "unknown":
+        return ("none",) + tuple(t for t in CVD_TYPES if t not in ("none", "unknown"))
+    return ("none", cvd_type) if cvd_type != "none" else ("none",)
+
+
+def _role_candidates(role, views):
+    lo, hi = ROLE_HUES[role]
+    center = (lo + hi) / 2
+    scored = []
+    for hue, sat, light in itertools.product(range(lo, hi + 1, _HUE_STEP), _SATURATIONS, _LIGHTNESSES):
+        # Score the 8-bit color that is actually sent, not the unrounded one
+        rgb = tuple(round(c * 255) / 255 for c in colorsys.hls_to_rgb((hue % 360) / 360, light, sat))
+        # The user must see enough contrast too, not just normal vision
+        contrast = min(contrast_ratio(simulate(rgb, v), BACKGROUND_RGB) for v in views)
+        labs = tuple(_to_lab(simulate(rgb, v)) for v in views)
+        # Prefer vivid colors close to the role's canonical hue when distances tie
+        preference = abs(hue - center) / 180 - sat
+        scored.append((contrast, preference, _hex(rgb), labs))
+
+    for tier in _CONTRAST_TIERS:
+        passing = [c for c in scored if c[0] >= tier]
+        if passing:
+            return [(pref, hx, labs) for _, pref, hx, labs in sorted(passing, key=lambda c: (c[1], c[2]))]
+    best = sorted(scored, key=lambda c: (-c[0], c[1], c[2]))
+    return [(pref, hx, labs) for _, pref, hx, labs in best]
+
+
+def _min_distance(labs, others):
+    return min(
+        (delta_e(a, b) for other in others for a, b in zip(labs, other)),
+        default=float("inf")
+    )
+
+
+@lru_cache(maxsize=None)
+def solve_palette(cvd_type: str = "none") -> dict:
+    """
+    Deterministically compute the five button colors for a CVD type.
+    scene_button and deep_analyze_button intentionally share a color.
+    """
+    if cvd_type not in CVD_TYPES:
+        cvd_type = "unknown"
+    views = _views(cvd_type)
+    roles = list(ROLE_HUES)
+    candidates = {role: _role_candidates(role, views) for role in roles}
+
+    # Coordinate ascent: re-pick each role to maximize its worst-case ΔE to the others
+    chosen = {role: candidates[role][0] for role in roles}
+    for _ in range(10):
+        changed = False
+        for role in roles:
+            others = [chosen[r][2] for r in roles if r != role]
+            best = max(
+                candidates[role],
+                key=lambda c: (round(_min_distance(c[2], others), 1), -c[0], c[1])
+            )
+            if best[1] != chosen[role][1]:
+                chosen[role] = best
+                changed = True
+        if not changed:
+            break
+
+    palette = {role: chosen[role][1] for role in roles}
+    palette["deep_analyze_button"] = palette["scene_button"]
+    return palette
+
+
+def palette_min_delta_e(palette: dict, cvd_type: str) -> float:
+    """Smallest ΔE between distinct buttons as seen under `cvd_type` (the solver's separation)."""
+    colors = [palette[r] for r in ROLE_HUES]
+    rgbs = [tuple(int(h[i:i + 2], 16) / 255 for i in (1, 3, 5)) for h in colors]
+    views = _views(cvd_type if cvd_type in CVD_TYPES else "unknown")
+    return min(
+        delta_e(_to_lab(simulate(a, v)), _to_lab(simulate(b, v)))
+        for a, b in itertools.combinations(rgbs, 2) for v in views
+    )
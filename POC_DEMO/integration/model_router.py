@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+model_router.py - Latency-aware Gemini model selection
+
+Tracks rolling latency and error rate per (endpoint, model) and, for each request,
+picks the most capable model that currently fits the endpoint's latency SLO.
+Models that are too slow, erroring, or saturated with in-flight requests are
+skipped in favour of lighter ones. Samples age out after `sample_ttl_s`, so a
+shed model is re-probed once it has had time to recover.
+"""
+
+import threading
+import time
+from collections import Counter, deque
+
+# Most capable first; routing only ever moves right (lighter) from the requested model
+MODEL_CAPABILITY_ORDER = [
+    "gemini-2.5-pro",
+    "gemini-2.5-flash",
+    "gemini-2.0-flash",
+    "gemini-2.5-flash-lite",
+]
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+class _ModelStats:
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)  # (timestamp, latency_ms, ok)
+        self.inflight = 0
+
+    def recent(self, now, ttl_s):
+        while self.samples and now - self.samples[0][0] > ttl_s:
+            self.samples.popleft()
+        return self.samples
+
+
+class ModelRouter:
+    """Picks a model per request from observed latency, errors and load."""
+
+    def __init__(self, slo_ms: dict, default_models: dict, models=None, window: int = 50,
+                 min_samples: int = 5, latency_percentile: float = 0.9, max_error_rate: float = 0.25,
+                 max_inflight_per_model: int = 8, sample_ttl_s: float = 120.0):
+        self.slo_ms = slo_ms
+        self.default_models = default_models
+        self.models = list(models or MODEL_CAPABILITY_ORDER)
+        self.window = window
+        self.min_samples = min_samples
+        self.latency_percentile = latency_percentile
+        self.max_error_rate = max_error_rate
+        self.max_inflight_per_model = max_inflight_per_model
+        self.sample_ttl_s = sample_ttl_s
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._decisions = Counter()  # (endpoint, model, reason) -> count
+
+    def _get(self, endpoint, model):
+        key = (endpoint, model)
+        if key not in self._stats:
+            self._stats[key] = _ModelStats(self.window)
+        return self._stats[key]
+
+    def _candidates(self, endpoint, requested_model):
+        ceiling = requested_model or self.default_models.get(endpoint, self.models[0])
+        if ceiling not in self.models:
+            # Unknown model: honour it as-is, there is nothing lighter we know to shed to
+            return [ceiling]
+        return self.models[self.models.index(ceiling):]
+
+    def choose(self, endpoint: str, requested_model: str = None, is_available=None) -> str:
+        """
+        Return the model to use and mark one request in flight on it.
+        `is_available(model)` lets callers veto models (e.g. an open circuit breaker).
+        """
+        now = time.time()
+        slo = self.slo_ms.get(endpoint)
+        with self._lock:
+            candidates = self._candidates(endpoint, requested_model)
+            chosen, reason = candidates[-1], "fallback_lightest"
+            for model in candidates:
+                st = self._get(endpoint, model)
+                if is_available is not None and not is_available(model):
+                    self._decisions[(endpoint, model, "skipped_unavailable")] += 1
+                    continue
+                if st.inflight >= self.max_inflight_per_model:
+                    self._decisions[(endpoint, model, "skipped_load")] += 1
+                    continue
+                samples = st.recent(now, self.sample_ttl_s)
+                if len(samples) >= self.min_samples:
+                    error_rate = sum(1 for _, _, ok in samples if not ok) / len(samples)
+                    if error_rate > self.max_error_rate:
+                        self._decisions[(endpoint, model, "skipped_errors")] += 1
+                        continue
+                    ok_latencies = [lat for _, lat, ok in samples if ok]
+                    if slo and ok_latencies and _percentile(ok_latencies, self.latency_percentile) > slo:
+                        self._decisions[(endpoint, model, "skipped_slo")] += 1
+                        continue
+                chosen, reason = model, "selected"
+                break
+
+            self._get(endpoint, chosen).inflight += 1
+            self._decisions[(endpoint, chosen, reason)] += 1
+            return chosen
+
+    def record(self, endpoint: str, model: str, latency_ms: float, ok: bool):
+        """Report the outcome of a request previously routed with choose()."""
+        with self._lock:
+            st = self._get(endpoint, model)
+            st.inflight = max(0, st.inflight - 1)
+            st.samples.append((time.time(), latency_ms, ok))
+
+    def sample(self, endpoint: str, model: str, latency_ms: float, ok: bool):
+        """Report a call that was not routed with choose() (e.g. a hedge to another model)."""
+        with self._lock:
+            self._get(endpoint, model).samples.append((time.time(), latency_ms, ok))
+
+    def release(self, endpoint: str, model: str):
+        """Drop the in-flight mark for a request that never reached the model."""
+        with self._lock:
+            st = self._get(endpoint, model)
+            st.inflight = max(0, st.inflight - 1)
+
+    def snapshot(self) -> dict:
+        """Per-endpoint model stats and decision counts, for the metrics endpoint."""
+        now = time.time()
+        out = {}
+        with self._lock:
+            for (endpoint, model), st in self._stats.items():
+                samples = st.recent(now, self.sample_ttl_s)
+                ok_latencies = [lat for _, lat, ok in samples if ok]
+                ep = out.setdefault(endpoint, {"slo_ms": self.slo_ms.get(endpoint), "models": {}})
+                ep["models"][model] = {
+                    "samples": len(samples),
+                    "inflight": st.inflight,
+                    "error_rate": round(sum(1 for _, _, ok in samples if not ok) / len(samples), 3) if samples else 0.0,
+                    "p50_ms": round(_percentile(ok_latencies, 0.5), 1) if ok_latencies else None,
+                    "p90_ms": round(_percentile(ok_latencies, 0.9), 1) if ok_latencies else None,
+                    "decisions": {},
+                }
+            for (endpoint, model, reason), count in self._decisions.items():
+                ep = out.setdefault(endpoint, {"slo_ms": self.slo_ms.get(endpoint), "models": {}})
+                m = ep["models"].setdefault(model, {"decisions": {}})
+                m.setdefault("decisions", {})[reason] = count
+        return out
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+profile_store.py - Per-user profile cache with write-behind persistence
+
+Profiles are keyed by a user or device id and kept in memory together with their
+pre-rendered prompt fragment, so personalized requests never read or format a
+profile on the request path. Writes are persisted by a background thread
+(write-behind), and memory is bounded by LRU eviction; evicted profiles are
+reloaded from disk in the background on their next use.
+
+Each profile is stored as {"user_id": ..., "profile": ...} in a file named by a
+readable prefix of the id plus a hash of the full id, so distinct ids never share
+a file.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+DEFAULT_USER_ID = "default"
+
+log = logging.getLogger(__name__)
+
+
+def render_profile_fragment(profile: dict) -> str:
+    """Format a profile (iOS flat format or nested `user_profile` format) for prompt injection."""
+    if 'user_profile' in profile:
+        nested = profile['user_profile']
+
+        # Extract mobility aids
+        mobility_aids = nested.get('mobility_aids', {})
+        aids_list = []
+        if mobility_aids.get('white_cane'): aids_list.append('white cane')
+        if mobility_aids.get('walking_stick'): aids_list.append('walking stick')
+        if mobility_aids.get('guide_dog'): aids_list.append('guide dog')
+        if mobility_aids.get('other'): aids_list.append(mobility_aids['other'])
+
+        vision_condition = nested.get('vision_condition', {})
+        return f"""
+**User Profile:**
+- **Vision Condition:** {vision_condition.get('type', 'N/A')} - {vision_condition.get('description', '')}
+- **Field of View:** {vision_condition.get('field_of_view_degrees', 'N/A')}° (peripheral vision loss)
+- **Mobility Aids:** {', '.join(aids_list) if aids_list else 'None'}
+- **Notes:** {vision_condition.get('notes', '')}
+- **Additional:** {nested.get('additional_notes', '')}
+"""
+
+    # iOS app flat format
+    return f"""## User Profile:
+- Name: {profile.get('name', 'Unknown')}
+- Age: {profile.get('age', 'Unknown')}
+- Vision Problems: {profile.get('visionProblems', 'Not specified')}
+- Assistive Devices: {profile.get('assistiveDevices', 'None')}
+- Other Vision Defects: {profile.get('otherVisionDefects', 'None')}
+- Primary Environments: {profile.get('primaryNavigationEnvironments', 'Not specified')}
+- Navigation Challenges: {profile.get('navigationChallenges', 'Not specified')}
+- Emergency Contact: {profile.get('emergencyContact', 'Not provided')}"""
+
+
+class ProfileStore:
+    """Thread-safe LRU of user profiles and their prompt fragments, persisted write-behind."""
+
+    def __init__(self, persist_dir: Path, max_entries: int = 10000, flush_interval_s: float = 2.0):
+        self.persist_dir = Path(persist_dir)
+        self.persist_dir.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.flush_interval_s = flush_interval_s
+        self.default_fragment = "No user profile available."
+        self._lock = threading.Lock()
+        # Held for a whole flush, so an older snapshot never lands after a newer one
+        self._flush_lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (profile, fragment)
+        self._dirty = {}               # user_id -> profile awaiting persistence
+        self._loading = set()          # user_ids being reloaded in the background
+        self._missing = OrderedDict()  # user_ids known to have no persisted profile
+        self._wake = threading.Event()
+        self._loader = ThreadPoolExecutor(max_workers=2, thread_name_prefix="profile-load")
+        self._writer = threading.Thread(target=self._writer_loop, name="profile-writer", daemon=True)
+        self._writer.start()
+
+    def _path_for(self, user_id: str) -> Path:
+        prefix = re.sub(r"[^A-Za-z0-9_.-]", "_", user_id)[:32]
+        digest = hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:16]
+        return self.persist_dir / f"{prefix}-{digest}.json"
+
+    @staticmethod
+    def _read(path: Path):
+        """(user_id, profile) stored in `path`."""
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if not isinstance(data, dict) or set(data) != {"user_id", "profile"}:
+            raise ValueError("not a profile store file")
+        return data["user_id"], data["profile"]
+
+    def _insert(self, user_id, profile):
+        """Caller holds the lock."""
+        self._entries[user_id] = (profile, render_profile_fragment(profile))
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            # Dirty profiles stay in self._dirty until written, so eviction never loses data
+            self._entries.popitem(last=False)
+
+    def put(self, user_id: str, profile: dict):
+        """Cache a profile and schedule it for persistence. Never blocks on disk."""
+        with self._lock:
+            self._missing.pop(user_id, None)
+            self._insert(user_id, profile)
+            self._dirty[user_id] = profile
+        self._wake.set()
+
+    def get_fragment(self, user_id: str):
+        """Return the user's prompt fragment, or None if not cached (a reload is scheduled)."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+            pending = self._dirty.get(user_id)
+            if pending is not None:
+                self._insert(user_id, pending)
+                return self._entries[user_id][1]
+            if user_id in self._loading or user_id in self._missing:
+                return None
+            self._loading.add(user_id)
+        self._loader.submit(self._load, user_id)
+        return None
+
+    def fragment_or_default(self, user_id: str) -> str:
+        fragment = self.get_fragment(user_id) if user_id else None
+        if fragment is None and user_id != DEFAULT_USER_ID:
+            fragment = self.get_fragment(DEFAULT_USER_ID)
+        return fragment if fragment is not None else self.default_fragment
+
+    def preload(self):
+        """Load persisted profiles (most recent first) up to capacity. Call at startup."""
+        files = sorted(self.persist_dir.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for path in reversed(files[:self.max_entries]):
+            try:
+                user_id, profile = self._read(path)
+            except Exception as e:
+                log.warning("⚠️  Skipping unreadable profile %s: %s", path.name, e)
+                continue
+            with self._lock:
+                self._insert(user_id, profile)
+        return len(files)
+
+    def flush(self):
+        """Persist all pending writes now."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._dirty = self._dirty, {}
+            for user_id, profile in pending.items():
+                try:
+                    self._write(user_id, profile)
+                except Exception as e:
+                    log.warning("⚠️  Failed to persist profile %s: %s", user_id, e)
+                    with self._lock:
+                        # Keep it for the next pass unless a newer version arrived meanwhile
+                        self._dirty.setdefault(user_id, profile)
+
+    def _write(self, user_id, profile):
+        path = self._path_for(user_id)
+        fd, tmp = tempfile.mkstemp(dir=self.persist_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"user_id": user_id, "profile": profile}, f, indent=2)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def _load(self, user_id):
+        try:
+            path = self._path_for(user_id)
+            stored_id, profile = self._read(path) if path.exists() else (None, None)
+            if stored_id == user_id:
+                with self._lock:
+                    if user_id not in self._entries:
+                        self._insert(user_id, profile)
+            else:
+                with self._lock:
+                    self._missing[user_id] = True
+                    while len(self._missing) > self.max_entries:
+                        self._missing.popitem(last=False)
+        except Exception as e:
+            log.warning("⚠️  Failed to reload profile %s: %s", user_id, e)
+        finally:
+            with self._lock:
+                self._loading.discard(user_id)
+
+    def _writer_loop(self):
+        while True:
+            self._wake.wait()
+            # Coalesce bursts of syncs into one write per user
+            time.sleep(self.flush_interval_s)
+            self._wake.clear()
+            self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "cached_profiles": len(self._entries),
+                "pending_writes": len(self._dirty),
+                "max_entries": self.max_entries,
+            }
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+route_geometry.py - Decoded route polylines with a spatial index
+
+A trip's step polylines are decoded once into flat `array('d')` buffers of
+local planar coordinates (meters, equirectangular projection around the
+route's first point) and bucketed into a uniform grid. Locating a GPS fix on
+the route then only touches the few segments in nearby grid cells, so
+progress queries take microseconds and never call Maps.
+
+Indexes are kept in a small in-memory LRU keyed by trip cache key.
+"""
+
+import math
+import threading
+from array import array
+from collections import OrderedDict
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def decode_polyline(encoded: str) -> array:
+    """Decode a Google encoded polyline into a flat array('d') of lat, lng pairs."""
+    out = array('d')
+    index = lat = lng = 0
+    length = len(encoded)
+    while index < length:
+        for is_lng in (False, True):
+            shift = result = 0
+            while True:
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            delta = ~(result >> 1) if result & 1 else result >> 1
+            if is_lng:
+                lng += delta
+            else:
+                lat += delta
+        out.append(lat / 1e5)
+        out.append(lng / 1e5)
+    return out
+
+
+def step_points(step: dict) -> array:
+    """Flat lat, lng points of a step: its polyline, or start -> end for trips cached without one."""
+    if step.get("polyline"):
+        return decode_polyline(step["polyline"])
+    points = array('d')
+    for key in ("start_location", "end_location"):
+        loc = step.get(key)
+        if loc:
+            points.append(loc["lat"])
+            points.append(loc["lng"])
+    return points
+
+
+def _cells_crossed(x0: float, y0: float, x1: float, y1: float):
+    """Grid cells (unit size) crossed by the segment from (x0, y0) to (x1, y1), in order (Amanatides-Woo)."""
+    cx, cy = math.floor(x0), math.floor(y0)
+    end_x, end_y = math.floor(x1), math.floor(y1)
+    dx, dy = x1 - x0, y1 - y0
+    step_x, step_y = (1 if dx > 0 else -1), (1 if dy > 0 else -1)
+    # Parameter t in [0, 1] along the segment at the next vertical / horizontal cell boundary
+    t_delta_x = abs(1 / dx) if dx else math.inf
+    t_delta_y = abs(1 / dy) if dy else math.inf
+    t_max_x = ((cx + 1 - x0) if dx > 0 else (x0 - cx)) * t_delta_x if dx else math.inf
+    t_max_y = ((cy + 1 - y0) if dy > 0 else (y0 - cy)) * t_delta_y if dy else math.inf
+    yield cx, cy
+    # Exactly one step per crossed boundary, so rounding can never overshoot the end cell
+    for _ in range(abs(end_x - cx) + abs(end_y - cy)):
+        if cy == end_y or (cx != end_x and t_max_x < t_max_y):
+            cx += step_x
+            t_max_x += t_delta_x
+        else:
+            cy += step_y
+            t_max_y += t_delta_y
+        yield cx, cy
+
+
+class RouteGeometry:
+    """Planar route geometry for one trip: points, segments, cumulative distance and a grid index."""
+
+    def __init__(self, steps: list, cell_size_m: float = 25.0):
+        self.steps = steps
+        self.cell_size_m = cell_size_m
+        self.xs = array('d')
+        self.ys = array('d')
+        self.seg_start = array('i')   # segment i runs from point seg_start[i] to seg_start[i] + 1
+        self.seg_step = array('i')    # step index each segment belongs to
+        self.seg_along = array('d')   # distance along the route at the segment start
+        self.step_end = array('d')    # distance along the route at the end of each step
+        self.grid = {}                # (cx, cy) -> list of segment indices
+
+        self._origin = None
+        along = 0.0
+        for step_index, step in enumerate(steps):
+            pts = step_points(step)
+            for j in range(0, len(pts), 2):
+                x, y = self.project(pts[j], pts[j + 1])
+                if j:
+                    seg = len(self.seg_start)
+                    self.seg_start.append(len(self.xs) - 1)
+                    self.seg_step.append(step_index)
+                    self.seg_along.append(along)
+                    along += math.hypot(x - self.xs[-1], y - self.ys[-1])
+                    self._index_segment(seg, self.xs[-1], self.ys[-1], x, y)
+                self.xs.append(x)
+                self.ys.append(y)
+            self.step_end.append(along)
+        self.total_m = along
+
+    def project(self, lat: float, lng: float):
+        """Local planar (x, y) in meters."""
+        if self._origin is None:
+            self._origin = (lat, lng, math.cos(math.radians(lat)))
+        lat0, lng0, cos0 = self._origin
+        k = math.pi / 180 * EARTH_RADIUS_M
+        return (lng - lng0) * k * cos0, (lat - lat0) * k
+
+    def unproject(self, x: float, y: float):
+        """Inverse of project(): (lat, lng)."""
+        lat0, lng0, cos0 = self._origin
+        k = math.pi / 180 * EARTH_RADIUS_M
+        return lat0 + y / k, lng0 + x / (k * cos0)
+
+    def _index_segment(self, seg, x0, y0, x1, y1):
+        """Add `seg` to the cells it crosses, padded by one cell (not its whole bounding box)."""
+        c = self.cell_size_m
+        cells = set()
+        for cx, cy in _cells_crossed(x0 / c, y0 / c, x1 / c, y1 / c):
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    cells.add((cx + dx, cy + dy))
+        for cell in cells:
+            self.grid.setdefault(cell, []).append(seg)
+
+    def _candidates(self, x, y, radius_m):
+        c = self.cell_size_m
+        seen = set()
+        for cx in range(math.floor((x - radius_m) / c), math.floor((x + radius_m) / c) + 1):
+            for cy in range(math.floor((y - radius_m) / c), math.floor((y + radius_m) / c) + 1):
+                seen.update(self.grid.get((cx, cy), ()))
+        return seen
+
+    def _project_on_segment(self, seg, x, y):
+        """(distance from segment, distance along route, qx, qy) of the closest point on `seg`."""
+        a = self.seg_start[seg]
+        x0, y0 = self.xs[a], self.ys[a]
+        dx, dy = self.xs[a + 1] - x0, self.ys[a + 1] - y0
+        l2 = dx * dx + dy * dy
+        t = 0.0 if l2 == 0 else max(0.0, min(1.0, ((x - x0) * dx + (y - y0) * dy) / l2))
+        qx, qy = x0 + t * dx, y0 + t * dy
+        return math.hypot(x - qx, y - qy), self.seg_along[seg] + t * math.sqrt(l2), qx, qy
+
+    def locate(self, lat: float, lng: float, search_radius_m: float = 50.0, from_step: int = 0):
+        """
+        Closest point on the route (ignoring steps before `from_step`).
+
+        Grid cells within `search_radius_m` are searched first; only if none of them
+        hold a segment are all remaining segments scanned.
+
+        Returns (segment, distance_from_route_m, along_m, x, y) - x, y being the closest
+        route point - or None for an empty route.
+        """
+        x, y = self.project(lat, lng)
+        candidates = self._candidates(x, y, search_radius_m)
+        if from_step:
+            candidates = [s for s in candidates if self.seg_step[s] >= from_step]
+        if not candidates:
+            candidates = [s for s in range(len(self.seg_start)) if self.seg_step[s] >= from_step]
+
+        best = None
+        for seg in candidates:
+            dist, along, qx, qy = self._project_on_segment(seg, x, y)
+            if best is None or dist < best[1] or (dist == best[1] and seg < best[0]):
+                best = (seg, dist, along, qx, qy)
+        return best
+
+    def progress(self, lat: float, lng: float, off_route_m: float = 30.0, from_step: int = 0) -> dict:
+        """Current step, distance to its closing maneuver, and whether the fix is off route."""
+        match = self.locate(lat, lng, search_radius_m=max(off_route_m, self.cell_size_m), from_step=from_step)
+        if match is None:
+            return {"step_index": None, "off_route": True}
+        seg, dist, along = match[:3]
+        step_index = self.seg_step[seg]
+        return {
+            "step_index": step_index,
+            "distance_to_maneuver_meters": round(self.step_end[step_index] - along, 1),
+            "distance_from_route_meters": round(dist, 1),
+            "remaining_meters": round(self.total_m - along, 1),
+            "off_route": dist > off_route_m,
+        }
+
+
+    def rejoin(self, lat: float, lng: float, from_step: int = 0):
+        """
+        Nearest point on the remaining route (steps >= from_step), for getting an
+        off-route user back onto it. Scans every remaining segment, since the user
+        may be well outside the grid neighbourhood.
+
+        Returns a dict with the step to rejoin, the rejoin point, the straight-line
+        distance and compass heading to it and the distance left in that step,
+        or None if nothing of the route remains.
+        """
+        x, y = self.project(lat, lng)
+        best = None
+        for seg in range(len(self.seg_start)):
+            if self.seg_step[seg] < from_step:
+                continue
+            dist, along, qx, qy = self._project_on_segment(seg, x, y)
+            if best is None or dist < best[1]:
+                best = (seg, dist, along, qx, qy)
+        if best is None:
+            return None
+        seg, dist, along, qx, qy = best
+        step_index = self.seg_step[seg]
+        rejoin_lat, rejoin_lng = self.unproject(qx, qy)
+        return {
+            "step_index": step_index,
+            "lat": rejoin_lat,
+            "lng": rejoin_lng,
+            "distance_m": dist,
+            "heading_deg": math.degrees(math.atan2(qx - x, qy - y)) % 360,
+            "remaining_in_step_m": self.step_end[step_index] - along,
+        }
+
+
+def compass_direction(heading_deg: float) -> str:
+    """8-point compass name for a heading in degrees (0 = north)."""
+    names = ("north", "northeast", "east", "southeast", "south", "southwest", "west", "northwest")
+    return names[int((heading_deg % 360 + 22.5) // 45) % 8]
+
+
+class RouteIndexCache:
+    """Thread-safe LRU of RouteGeometry objects keyed by trip cache key."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, cache_key: str):
+        with self._lock:
+            geometry = self._entries.get(cache_key)
+            if geometry is not None:
+                self._entries.move_to_end(cache_key)
+            return geometry
+
+    def put(self, cache_key: str, geometry: RouteGeometry):
+        with self._lock:
+            self._entries[cache_key] = geometry
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+structured_logging.py - JSON logging off the request path
+
+Request threads only enqueue log records (QueueHandler); a background
+QueueListener thread formats them as JSON lines and writes them to stdout.
+
+Per endpoint you can configure:
+1. Sampling rate - fraction of requests whose INFO/DEBUG logs are kept
+   (decided once per request, so a sampled request logs completely;
+   WARNING and above are always kept)
+2. Log level     - minimum level for records emitted while serving that endpoint
+
+Every record carries the request id (X-Request-Id header or a generated one)
+and the Flask endpoint name.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import uuid
+
+from flask import g, has_request_context, request
+
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _parse_mapping(spec: str) -> dict:
+    """Parse "endpoint=value,endpoint=value" config strings."""
+    out = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            out[key.strip()] = value.strip()
+    return out
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, request context and any `extra` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach request id / endpoint and apply per-endpoint sampling and levels."""
+
+    def __init__(self, endpoint_levels: dict):
+        super().__init__()
+        self.endpoint_levels = endpoint_levels
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not has_request_context():
+            return True
+        endpoint = request.endpoint or ""
+        record.request_id = getattr(g, "request_id", None)
+        record.endpoint = endpoint
+        if record.levelno < self.endpoint_levels.get(endpoint, logging.NOTSET):
+            return False
+        return record.levelno >= logging.WARNING or getattr(g, "log_sampled", True)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Freeze the message and traceback text; JSON encoding and I/O happen on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(app, level: str = "INFO", sampling: str = "", endpoint_levels: str = ""):
+    """
+    Route all logging through a background writer and install request-id hooks on `app`.
+
+    Args:
+        level: root log level
+        sampling: e.g. "hazard_detection=0.1,text_to_speech=0.5" (default 1.0)
+        endpoint_levels: e.g. "navigation_guidance=WARNING"
+    """
+    sample_rates = {k: float(v) for k, v in _parse_mapping(sampling).items()}
+    levels, rejected = {}, {}
+    for endpoint, name in _parse_mapping(endpoint_levels).items():
+        # getLevelName returns "Level FOO" (a str) for names it does not know
+        value = logging.getLevelName(name.upper())
+        if isinstance(value, int):
+            levels[endpoint] = value
+        else:
+            rejected[endpoint] = name
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    listener.start()
+    atexit.register(listener.stop)
+
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter(levels))
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level.upper())
+    for endpoint, name in rejected.items():
+        logging.getLogger(__name__).warning("ignoring unknown log level %r for endpoint %s", name, endpoint)
+
+    @app.before_request
+    def _assign_request_id():
+        g.request_id = request.headers.get("X-Request-Id") or uuid.uuid4().hex[:16]
+        g.log_sampled = random.random() < sample_rates.get(request.endpoint or "", 1.0)
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def _log_request(response):
+        response.headers["X-Request-Id"] = getattr(g, "request_id", "")
+        start = getattr(g, "request_start", None)
+        logging.getLogger("navaid.access").log(
+            logging.WARNING if response.status_code >= 500 else logging.INFO,
+            "request", extra={
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "latency_ms": round((time.perf_counter() - start) * 1000, 2) if start else None,
+            }
+        )
+        return response
+
+    return listener
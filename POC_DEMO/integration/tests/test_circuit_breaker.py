@@ -0,0 +1,153 @@
+"""State transitions of circuit_breaker.CircuitBreaker."""
+
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    return clock
+
+
+def ok():
+    return "ok"
+
+
+def boom():
+    raise ConnectionError("upstream down")
+
+
+def fail(breaker, n):
+    for _ in range(n):
+        with pytest.raises(ConnectionError):
+            breaker.call(boom)
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3)
+    fail(breaker, 2)
+    assert breaker.state == CLOSED
+    fail(breaker, 1)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as exc:
+        breaker.call(ok)
+    assert exc.value.retry_after_s == pytest.approx(30.0)
+    assert breaker.snapshot()["times_opened"] == 1
+    assert breaker.snapshot()["rejected_calls"] == 1
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3)
+    fail(breaker, 2)
+    assert breaker.call(ok) == "ok"
+    fail(breaker, 2)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_probe_success_closes(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout_s=10)
+    fail(breaker, 1)
+    clock.now += 9.9
+    assert breaker.state == OPEN
+    clock.now += 0.1
+    assert breaker.state == HALF_OPEN
+    assert breaker.call(ok) == "ok"
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()["consecutive_failures"] == 0
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, recovery_timeout_s=10)
+    fail(breaker, 3)
+    clock.now += 10
+    fail(breaker, 1)  # a single failed probe re-opens, regardless of the threshold
+    assert breaker.state == OPEN
+    assert breaker.snapshot()["times_opened"] == 2
+
+
+def test_half_open_limits_concurrent_probes(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout_s=10)
+    fail(breaker, 1)
+    clock.now += 10
+
+    def probe_while_inflight():
+        assert not breaker.is_available()
+        with pytest.raises(CircuitOpenError):
+            breaker.call(ok)
+        return "probe"
+
+    assert breaker.call(probe_while_inflight) == "probe"
+    assert breaker.state == CLOSED
+
+
+def test_ignored_exceptions_count_as_success(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, ignore_exceptions=(ValueError,))
+
+    def bad_output():
+        raise ValueError("unparseable reply")
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            breaker.call(bad_output)
+    assert breaker.state == CLOSED
+
+
+def test_neutral_exceptions_release_the_probe_slot(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout_s=10,
+                             neutral_exceptions=(KeyboardInterrupt,))
+    fail(breaker, 1)
+    clock.now += 10
+
+    def cancelled():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        breaker.call(cancelled)
+    assert breaker.state == HALF_OPEN
+    assert breaker.is_available()
+    assert breaker.snapshot()["neutral_calls"] == 1
+
+
+def test_stream_failure_before_first_chunk_counts(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2)
+
+    def stream():
+        raise ConnectionError("refused")
+        yield  # pragma: no cover
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            list(breaker.call_stream(stream))
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        next(breaker.call_stream(stream))
+
+
+def test_stream_completion_and_early_close(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout_s=10)
+
+    def chunks():
+        yield from ("a", "b", "c")
+
+    assert list(breaker.call_stream(chunks)) == ["a", "b", "c"]
+    fail(breaker, 1)
+    clock.now += 10
+    stream = breaker.call_stream(chunks)
+    assert next(stream) == "a"
+    stream.close()  # consumer went away: no outcome, probe slot released
+    assert breaker.state == HALF_OPEN
+    assert breaker.snapshot()["neutral_calls"] == 1
+    assert list(breaker.call_stream(chunks)) == ["a", "b", "c"]
+    assert breaker.state == CLOSED
@@ -0,0 +1,65 @@
+"""Determinism and accessibility guarantees of color_palette.solve_palette."""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from color_palette import (BACKGROUND_RGB, CVD_TYPES, ROLE_HUES, _views, contrast_ratio,
+                           palette_min_delta_e, simulate, solve_palette)
+
+# Smallest ΔE between buttons the solver reaches. With no hue information left
+# (achromatopsia, or every deficiency at once) only lightness separates the buttons.
+MIN_DELTA_E = {"achromatopsia": 9.0, "unknown": 9.0}
+DEFAULT_MIN_DELTA_E = 40.0
+
+
+def rgb(hex_color):
+    return tuple(int(hex_color[i:i + 2], 16) / 255 for i in (1, 3, 5))
+
+
+def test_solve_is_deterministic():
+    for cvd_type in CVD_TYPES:
+        assert solve_palette.__wrapped__(cvd_type) == solve_palette.__wrapped__(cvd_type) == solve_palette(cvd_type)
+
+
+def test_solve_is_independent_of_hash_seed():
+    script = ("import json, color_palette as c; "
+              "print(json.dumps({t: c.solve_palette(t) for t in c.CVD_TYPES}, sort_keys=True))")
+    outputs = set()
+    for seed in ("0", "1", "12345"):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        result = subprocess.run([sys.executable, "-c", script], cwd=Path(__file__).resolve().parent.parent,
+                                env=env, capture_output=True, text=True, check=True)
+        outputs.add(result.stdout)
+    assert len(outputs) == 1
+    assert json.loads(outputs.pop())["none"] == solve_palette("none")
+
+
+def test_unrecognized_type_is_solved_for_every_deficiency():
+    assert solve_palette("martian") == solve_palette("unknown")
+
+
+@pytest.mark.parametrize("cvd_type", CVD_TYPES)
+def test_palette_shape(cvd_type):
+    palette = solve_palette(cvd_type)
+    assert set(palette) == set(ROLE_HUES) | {"deep_analyze_button"}
+    assert palette["deep_analyze_button"] == palette["scene_button"]
+    assert all(len(color) == 7 and color.startswith("#") for color in palette.values())
+
+
+@pytest.mark.parametrize("cvd_type", CVD_TYPES)
+def test_every_button_meets_aaa_contrast_as_seen(cvd_type):
+    palette = solve_palette(cvd_type)
+    for color in palette.values():
+        for view in _views(cvd_type):
+            assert contrast_ratio(simulate(rgb(color), view), BACKGROUND_RGB) >= 7.0, (color, view)
+
+
+@pytest.mark.parametrize("cvd_type", CVD_TYPES)
+def test_buttons_stay_apart_as_seen(cvd_type):
+    palette = solve_palette(cvd_type)
+    assert palette_min_delta_e(palette, cvd_type) >= MIN_DELTA_E.get(cvd_type, DEFAULT_MIN_DELTA_E)
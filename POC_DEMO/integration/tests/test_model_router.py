@@ -0,0 +1,98 @@
+"""Slot accounting, vetoes and sample expiry in model_router.ModelRouter."""
+
+import pytest
+
+import model_router
+from model_router import ModelRouter
+
+EP = "hazard-detection"
+MODELS = ["gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.5-flash-lite"]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = type("Clock", (), {"now": 1000.0})()
+    monkeypatch.setattr(model_router.time, "time", lambda: clock.now)
+    return clock
+
+
+@pytest.fixture
+def router(clock):
+    return ModelRouter({EP: 1000}, {EP: MODELS[0]}, models=MODELS, min_samples=3,
+                       max_inflight_per_model=2, sample_ttl_s=60.0)
+
+
+def inflight(router, model):
+    return router.snapshot()[EP]["models"][model]["inflight"]
+
+
+def decisions(router, model):
+    return router.snapshot()[EP]["models"][model]["decisions"]
+
+
+def test_record_and_release_return_the_slot(router):
+    assert router.choose(EP) == MODELS[0]
+    assert router.choose(EP) == MODELS[0]
+    assert inflight(router, MODELS[0]) == 2
+    router.record(EP, MODELS[0], 200, ok=True)
+    router.release(EP, MODELS[0])
+    assert inflight(router, MODELS[0]) == 0
+    router.release(EP, MODELS[0])  # never below zero
+    assert inflight(router, MODELS[0]) == 0
+    assert router.snapshot()[EP]["models"][MODELS[0]]["samples"] == 1
+
+
+def test_sample_does_not_touch_slots(router):
+    router.choose(EP)
+    router.sample(EP, MODELS[1], 300, ok=True)
+    assert inflight(router, MODELS[0]) == 1
+    assert inflight(router, MODELS[1]) == 0
+    assert router.snapshot()[EP]["models"][MODELS[1]]["samples"] == 1
+
+
+def test_saturated_model_sheds_to_a_lighter_one(router):
+    assert [router.choose(EP) for _ in range(3)] == [MODELS[0], MODELS[0], MODELS[1]]
+    assert decisions(router, MODELS[0])["skipped_load"] == 1
+    router.record(EP, MODELS[0], 200, ok=True)
+    assert router.choose(EP) == MODELS[0]
+
+
+def test_is_available_veto(router):
+    vetoed = {MODELS[0]}
+    assert router.choose(EP, is_available=lambda m: m not in vetoed) == MODELS[1]
+    assert decisions(router, MODELS[0])["skipped_unavailable"] == 1
+    assert inflight(router, MODELS[0]) == 0 and inflight(router, MODELS[1]) == 1
+    # Everything vetoed: the lightest model is used anyway
+    assert router.choose(EP, is_available=lambda m: False) == MODELS[-1]
+    assert decisions(router, MODELS[-1])["fallback_lightest"] == 1
+
+
+def test_requested_model_is_the_ceiling(router):
+    assert router.choose(EP, requested_model=MODELS[1]) == MODELS[1]
+    assert router.choose(EP, requested_model="custom-model") == "custom-model"
+
+
+def test_errors_and_slow_models_are_skipped(router):
+    for _ in range(3):
+        router.record(EP, MODELS[0], 200, ok=False)
+        router.record(EP, MODELS[1], 5000, ok=True)
+    assert router.choose(EP) == MODELS[2]
+    assert decisions(router, MODELS[0])["skipped_errors"] == 1
+    assert decisions(router, MODELS[1])["skipped_slo"] == 1
+
+
+def test_too_few_samples_do_not_shed(router):
+    for _ in range(2):
+        router.record(EP, MODELS[0], 200, ok=False)
+    assert router.choose(EP) == MODELS[0]
+
+
+def test_stale_samples_expire_so_a_shed_model_is_retried(router, clock):
+    for _ in range(3):
+        router.record(EP, MODELS[0], 200, ok=False)
+    assert router.choose(EP) == MODELS[1]
+    clock.now += 60.0
+    assert router.choose(EP) == MODELS[1]  # exactly at the TTL the samples still count
+    clock.now += 0.1
+    assert router.choose(EP) == MODELS[0]
+    assert router.snapshot()[EP]["models"][MODELS[0]]["samples"] == 0
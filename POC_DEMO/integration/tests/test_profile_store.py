@@ -0,0 +1,41 @@
+"""Persistence in profile_store.ProfileStore."""
+
+import json
+import threading
+import time
+
+from profile_store import ProfileStore
+
+
+def test_ids_that_sanitize_alike_get_their_own_files(tmp_path):
+    store = ProfileStore(tmp_path, flush_interval_s=3600)
+    store.put("a@b", {"name": "first"})
+    store.put("a#b", {"name": "second"})
+    store.flush()
+    assert len(list(tmp_path.glob("*.json"))) == 2
+    reloaded = ProfileStore(tmp_path, flush_interval_s=3600)
+    assert reloaded.preload() == 2
+    assert "first" in reloaded.get_fragment("a@b")
+    assert "second" in reloaded.get_fragment("a#b")
+
+
+def test_concurrent_flushes_never_land_a_stale_profile(tmp_path):
+    store = ProfileStore(tmp_path, flush_interval_s=3600)
+    write = store._write
+    writing_old = threading.Event()
+
+    def slow_write(user_id, profile):
+        if profile["v"] == 1:
+            writing_old.set()
+            time.sleep(0.2)
+        write(user_id, profile)
+
+    store._write = slow_write
+    store.put("u", {"v": 1})
+    background = threading.Thread(target=store.flush)
+    background.start()
+    writing_old.wait()
+    store.put("u", {"v": 2})
+    store.flush()  # e.g. the atexit flush while the writer thread is mid-write
+    background.join()
+    assert json.loads(store._path_for("u").read_text())["profile"] == {"v": 2}
@@ -0,0 +1,147 @@
+"""Polyline decoding, GPS progress and the index cache in route_geometry."""
+
+import pytest
+
+from route_geometry import RouteGeometry, RouteIndexCache, compass_direction, decode_polyline
+
+# ~111 m north, then ~76 m east (at latitude 47)
+A, B, C = (47.0, 8.0), (47.001, 8.0), (47.001, 8.001)
+
+
+def steps():
+    def step(start, end):
+        return {"start_location": {"lat": start[0], "lng": start[1]},
+                "end_location": {"lat": end[0], "lng": end[1]}}
+    return [step(A, B), step(B, C)]
+
+
+def offset(point, north_m=0.0, east_m=0.0):
+    """A point `north_m`/`east_m` meters from `point`, in the route's own projection."""
+    geometry = RouteGeometry(steps())
+    x, y = geometry.project(*point)
+    return geometry.unproject(x + east_m, y + north_m)
+
+
+def test_decode_polyline_reference_example():
+    # Example from Google's encoded polyline algorithm documentation
+    points = decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@")
+    assert list(points) == pytest.approx([38.5, -120.2, 40.7, -120.95, 43.252, -126.453])
+
+
+def test_step_lengths_accumulate():
+    geometry = RouteGeometry(steps())
+    assert geometry.step_end[0] == pytest.approx(111.2, abs=0.1)
+    assert geometry.total_m == pytest.approx(111.2 + 75.8, abs=0.2)
+
+
+def test_progress_on_route():
+    geometry = RouteGeometry(steps())
+    progress = geometry.progress(*offset(A, north_m=40.0))
+    assert progress["step_index"] == 0
+    assert progress["off_route"] is False
+    assert progress["distance_from_route_meters"] == pytest.approx(0.0, abs=0.1)
+    assert progress["distance_to_maneuver_meters"] == pytest.approx(geometry.step_end[0] - 40.0, abs=0.1)
+    assert progress["remaining_meters"] == pytest.approx(geometry.total_m - 40.0, abs=0.1)
+
+
+def test_progress_off_route():
+    geometry = RouteGeometry(steps())
+    progress = geometry.progress(*offset(A, north_m=40.0, east_m=-45.0), off_route_m=30.0)
+    assert progress["step_index"] == 0
+    assert progress["distance_from_route_meters"] == pytest.approx(45.0, abs=0.1)
+    assert progress["off_route"] is True
+
+
+def test_progress_ignores_steps_already_done():
+    geometry = RouteGeometry(steps())
+    progress = geometry.progress(*offset(A, north_m=40.0), from_step=1)
+    assert progress["step_index"] == 1
+    assert progress["off_route"] is True
+
+
+def test_locate_scans_everything_outside_the_grid_neighbourhood():
+    geometry = RouteGeometry(steps())
+    match = geometry.locate(*offset(A, north_m=-1000.0), search_radius_m=50.0)
+    assert match is not None
+    assert match[1] == pytest.approx(1000.0, abs=0.5)
+
+
+def test_empty_route():
+    geometry = RouteGeometry([])
+    assert geometry.progress(47.0, 8.0) == {"step_index": None, "off_route": True}
+
+
+@pytest.mark.parametrize("heading, name", [
+    (0, "north"), (22.4, "north"), (22.5, "northeast"), (90, "east"),
+    (200, "south"), (337.4, "northwest"), (337.5, "north"), (-90, "west"), (720, "north"),
+])
+def test_compass_direction(heading, name):
+    assert compass_direction(heading) == name
+
+
+def test_route_index_cache_evicts_least_recently_used():
+    cache = RouteIndexCache(max_entries=2)
+    cache.put("a", RouteGeometry([]))
+    cache.put("b", RouteGeometry([]))
+    assert cache.get("a") is not None
+    cache.put("c", RouteGeometry([]))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert len(cache) == 2
+
+
+def test_rejoin_nearest_point_heading_and_remaining():
+    geometry = RouteGeometry(steps())
+    rejoin = geometry.rejoin(*offset(A, north_m=40.0, east_m=-100.0))
+    assert rejoin["step_index"] == 0
+    assert rejoin["distance_m"] == pytest.approx(100.0, abs=0.1)
+    assert compass_direction(rejoin["heading_deg"]) == "east"
+    assert rejoin["heading_deg"] == pytest.approx(90.0, abs=0.01)
+    assert rejoin["remaining_in_step_m"] == pytest.approx(geometry.step_end[0] - 40.0, abs=0.1)
+    assert (rejoin["lat"], rejoin["lng"]) == pytest.approx(offset(A, north_m=40.0))
+
+
+def test_rejoin_skips_steps_already_done():
+    geometry = RouteGeometry(steps())
+    # West of step 0, but step 0 is behind the user: rejoin at the start of step 1
+    rejoin = geometry.rejoin(*offset(A, north_m=40.0, east_m=-100.0), from_step=1)
+    assert rejoin["step_index"] == 1
+    assert (rejoin["lat"], rejoin["lng"]) == pytest.approx(B)
+    assert rejoin["distance_m"] == pytest.approx((100.0 ** 2 + (geometry.step_end[0] - 40.0) ** 2) ** 0.5, abs=0.1)
+    assert compass_direction(rejoin["heading_deg"]) == "northeast"
+    assert rejoin["remaining_in_step_m"] == pytest.approx(geometry.total_m - geometry.step_end[0], abs=0.1)
+
+
+def test_rejoin_past_the_end_of_the_route():
+    geometry = RouteGeometry(steps())
+    assert geometry.rejoin(*A, from_step=2) is None
+
+
+def diagonal_route(length_m, cell_size_m):
+    """One straight step running `length_m` to the northeast of A."""
+    origin = RouteGeometry([])
+    origin.project(*A)
+    end = origin.unproject(length_m / 2 ** 0.5, length_m / 2 ** 0.5)
+    return RouteGeometry([{"start_location": {"lat": A[0], "lng": A[1]},
+                           "end_location": {"lat": end[0], "lng": end[1]}}], cell_size_m=cell_size_m)
+
+
+def test_long_diagonal_segment_indexes_only_the_cells_it_crosses():
+    geometry = diagonal_route(5000.0, 50.0)
+    cells = sum(1 for segs in geometry.grid.values() if 0 in segs)
+    # ~100 x 100 cells in the bounding box; the crossed cells padded by one are a few hundred
+    assert cells < 1000
+    assert cells >= 5000 / 50
+
+
+def test_diagonal_segment_is_found_from_anywhere_near_it():
+    geometry = diagonal_route(5000.0, 50.0)
+    for i in range(0, 101):
+        along = 50.0 * i
+        for side in (-29.0, 0.0, 29.0):
+            x = along / 2 ** 0.5 - side / 2 ** 0.5
+            y = along / 2 ** 0.5 + side / 2 ** 0.5
+            assert 0 in geometry._candidates(x, y, 30.0), (along, side)
+    progress = geometry.progress(*geometry.unproject(1000.0, 1020.0), off_route_m=30.0)
+    assert progress["off_route"] is False
+    assert progress["distance_from_route_meters"] == pytest.approx(20 / 2 ** 0.5, abs=0.1)
@@ -0,0 +1,98 @@
+"""Canonicalization of trip cache keys in trip_keys."""
+
+import json
+
+import pytest
+
+from trip_keys import TripKeyCanonicalizer, normalize_place, parse_latlng
+
+
+@pytest.fixture
+def keys(tmp_path):
+    return TripKeyCanonicalizer(tmp_path / "geocodes.json", snap_radius_m=25.0, flush_interval_s=60)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Library, Berkeley, CA", "library,  berkeley ca"),
+    ("123 Main St.", "123 main street"),
+    ("Café Strada", "cafe strada"),
+    ("Shattuck Ave & Center St", "shattuck avenue and center street"),
+])
+def test_normalize_place_equivalents(a, b):
+    assert normalize_place(a) == normalize_place(b)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("37.8716,-122.2727", (37.8716, -122.2727)),
+    (" 37.8716 , -122.2727 ", (37.8716, -122.2727)),
+    ((37.8716, -122.2727), (37.8716, -122.2727)),
+    ("91.0,10.0", None),
+    ("Berkeley, CA", None),
+    (None, None),
+])
+def test_parse_latlng(text, expected):
+    assert parse_latlng(text) == expected
+
+
+def test_equivalent_text_shares_a_key(keys):
+    assert (keys.cache_key("Library, Berkeley, CA", "Main St", "WALKING", ["ferries", "highways"], "metric")
+            == keys.cache_key("library berkeley ca", "main street", "walking", ["highways", "ferries"], "Metric"))
+
+
+def test_options_change_the_key(keys):
+    base = keys.cache_key("a", "b", "walking", [], "metric")
+    assert keys.cache_key("a", "b", "transit", [], "metric") != base
+    assert keys.cache_key("a", "b", "walking", ["tolls"], "metric") != base
+    assert keys.cache_key("b", "a", "walking", [], "metric") != base
+
+
+def test_nearby_fixes_snap_to_a_learned_anchor(keys):
+    keys.learn("Library", {"lat": 37.8716, "lng": -122.2727})
+    anchor = "37.871600,-122.272700"
+    assert keys.canonical_place("37.871700,-122.272700") == anchor   # ~11 m away
+    assert keys.canonical_place("37.872000,-122.272700") == "37.872000,-122.272700"   # ~44 m away
+
+
+def test_lookups_never_register_anchors(keys):
+    assert keys.canonical_place("37.871600,-122.272700") == "37.871600,-122.272700"
+    # A second fix nearby keys on its own rounded point, whichever came first
+    assert keys.canonical_place("37.871700,-122.272700") == "37.871700,-122.272700"
+    assert keys.canonical_place("37.8716001,-122.2727") == "37.871600,-122.272700"
+    assert keys.snapshot()["anchors"] == 0
+    assert not keys.snapshot()["pending_write"]
+
+
+def test_directions_endpoint_of_a_gps_origin_becomes_an_anchor(keys):
+    # Directions snaps a raw GPS origin to the road; later fixes near it share its key
+    keys.learn("37.87165,-122.27275", {"lat": 37.8716, "lng": -122.2727})
+    assert not keys.knows("library")
+    assert keys.snapshot()["anchors"] == 1 and keys.snapshot()["pending_write"]
+    assert (keys.cache_key("37.87165,-122.27275", "b", "walking", [], "metric")
+            == keys.cache_key("37.87158,-122.27268", "b", "walking", [], "metric"))
+
+
+def test_anchors_survive_a_restart(keys):
+    keys.learn("37.87165,-122.27275", {"lat": 37.8716, "lng": -122.2727})
+    before = keys.cache_key("37.87165,-122.27275", "b", "walking", [], "metric")
+    keys.flush()
+    reloaded = TripKeyCanonicalizer(keys.path, flush_interval_s=60)
+    assert reloaded.cache_key("37.87165,-122.27275", "b", "walking", [], "metric") == before
+
+
+def test_learned_geocode_keys_text_like_its_coordinates(keys):
+    before = keys.cache_key("Berkeley Library", "37.8,-122.3", "walking", [], "metric")
+    keys.learn("Berkeley Library", {"lat": 37.8716, "lng": -122.2727})
+    assert keys.knows("berkeley library")
+    after = keys.cache_key("Berkeley Library", "37.8,-122.3", "walking", [], "metric")
+    assert after != before
+    assert after == keys.cache_key("37.87161,-122.27271", "37.8,-122.3", "walking", [], "metric")
+
+
+def test_learned_geocodes_are_written_behind(tmp_path, keys):
+    keys.learn("Berkeley Library", {"lat": 37.8716, "lng": -122.2727})
+    assert not keys.path.exists()
+    assert keys.snapshot()["pending_write"]
+    keys.flush()
+    assert json.loads(keys.path.read_text())["geocodes"] == {"berkeley library": [37.8716, -122.2727]}
+    reloaded = TripKeyCanonicalizer(keys.path, flush_interval_s=60)
+    assert reloaded.canonical_place("Berkeley Library") == keys.canonical_place("Berkeley Library")
@@ -0,0 +1,40 @@
+"""Deduplication in upload_store.UploadStore.save, including its race with GC."""
+
+import io
+import os
+
+import pytest
+
+import upload_store
+from upload_store import UploadStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = UploadStore(tmp_path, gc_interval_seconds=3600, chunk_size=4)
+    yield store
+    store.stop_gc()
+
+
+def test_identical_uploads_share_one_file(store, tmp_path):
+    path, dedup = store.save(io.BytesIO(b"frame-bytes"), ".JPG")
+    assert not dedup and path.suffix == ".jpg" and path.read_bytes() == b"frame-bytes"
+    os.utime(path, (0, 0))
+    again, dedup = store.save(io.BytesIO(b"frame-bytes"), ".jpg")
+    assert dedup and again == path
+    assert path.stat().st_mtime > 0  # TTL refreshed
+    assert sorted(p.name for p in tmp_path.iterdir()) == [path.name]
+
+
+def test_duplicate_collected_before_its_touch_is_stored_again(store, monkeypatch):
+    path, _ = store.save(io.BytesIO(b"frame-bytes"))
+    real_utime = os.utime
+
+    def collected_first(p, *args, **kwargs):
+        os.unlink(p)  # GC removes the original between the digest and the touch
+        return real_utime(p, *args, **kwargs)
+
+    monkeypatch.setattr(upload_store.os, "utime", collected_first)
+    again, dedup = store.save(io.BytesIO(b"frame-bytes"))
+    assert again == path and not dedup
+    assert path.read_bytes() == b"frame-bytes"
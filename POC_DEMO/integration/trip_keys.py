@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+trip_keys.py - Canonical trip cache keys
+
+Raw origin/destination strings make poor cache keys: "Library, Berkeley, CA"
+and "library,  berkeley ca" are the same place, and so are two GPS fixes a
+few meters apart. Each endpoint is canonicalized before hashing:
+
+1. Text normalization - case, punctuation, whitespace, common street abbreviations
+2. Geocode cache      - normalized text -> coordinates, learned from Directions
+                        responses (and optionally the Geocoding API), persisted on disk
+                        write-behind (one file rewrite per `flush_interval_s`, off the
+                        request path)
+3. Snapping           - coordinates within `snap_radius_m` of an anchor reuse that
+                        anchor. Anchors are only learned from Directions/Geocoding
+                        results, never from lookups, so a key does not depend on which
+                        request came first
+
+An endpoint whose coordinates are known is keyed by its anchor; otherwise by its
+normalized text.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+_ABBREVIATIONS = {
+    "st": "street", "ave": "avenue", "av": "avenue", "rd": "road", "blvd": "boulevard",
+    "dr": "drive", "ln": "lane", "ct": "court", "pl": "place", "sq": "square",
+    "hwy": "highway", "pkwy": "parkway", "n": "north", "s": "south", "e": "east", "w": "west",
+    "univ": "university", "ctr": "center", "centre": "center",
+}
+_LATLNG = re.compile(r"^\s*(-?\d{1,2}(?:\.\d+)?)\s*,\s*(-?\d{1,3}(?:\.\d+)?)\s*$")
+_METERS_PER_DEG_LAT = 111320.0
+
+
+def normalize_place(text: str) -> str:
+    """Lowercase, strip punctuation/accents, collapse whitespace, expand street abbreviations."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    text = text.replace("&", " and ")
+    tokens = re.sub(r"[^\w#]+", " ", text).split()
+    return " ".join(_ABBREVIATIONS.get(token, token) for token in tokens)
+
+
+def parse_latlng(text):
+    """(lat, lng) if `text` is a "lat,lng" pair or a (lat, lng) sequence, else None."""
+    if isinstance(text, (list, tuple)) and len(text) == 2:
+        return float(text[0]), float(text[1])
+    match = _LATLNG.match(str(text or ""))
+    if not match:
+        return None
+    lat, lng = float(match.group(1)), float(match.group(2))
+    if -90 <= lat <= 90 and -180 <= lng <= 180:
+        return lat, lng
+    return None
+
+
+def distance_m(a, b) -> float:
+    """Equirectangular distance between two (lat, lng) points; accurate at snapping scales."""
+    x = math.radians(b[1] - a[1]) * math.cos(math.radians((a[0] + b[0]) / 2))
+    y = math.radians(b[0] - a[0])
+    return math.hypot(x, y) * 6371008.8
+
+
+class TripKeyCanonicalizer:
+    """Geocode cache + anchor snapping, persisted as one JSON file."""
+
+    def __init__(self, path: Path, snap_radius_m: float = 25.0, max_entries: int = 50000,
+                 flush_interval_s: float = 5.0):
+        self.path = Path(path)
+        self.snap_radius_m = snap_radius_m
+        self.max_entries = max_entries
+        self.flush_interval_s = flush_interval_s
+        self._lock = threading.Lock()
+        self._geocodes = {}   # normalized text -> [lat, lng]
+        self._anchors = {}    # grid cell -> list of (lat, lng) anchors
+        self._num_anchors = 0
+        self.stats = {"hits": 0, "misses": 0, "geocodes_learned": 0}
+        self._dirty = False            # geocodes or anchors learned since the last write
+        self._wake = threading.Event()
+        self._load()
+        self._writer = threading.Thread(target=self._writer_loop, name="geocode-writer", daemon=True)
+        self._writer.start()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except Exception as e:
+            log.warning("⚠️  Ignoring unreadable geocode cache %s: %s", self.path.name, e)
+            return
+        self._geocodes = {k: tuple(v) for k, v in data.get("geocodes", {}).items()}
+        for point in data.get("anchors", []):
+            self._add_anchor(tuple(point))
+
+    def flush(self):
+        """Persist learned geocodes and anchors now, if anything changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            payload = {
+                "geocodes": dict(self._geocodes),
+                "anchors": [p for cell in self._anchors.values() for p in cell],
+            }
+        try:
+            self._save(payload)
+        except Exception as e:
+            log.warning("⚠️  Failed to persist geocode cache: %s", e)
+            with self._lock:
+                self._dirty = True
+
+    def _writer_loop(self):
+        while True:
+            self._wake.wait()
+            # Coalesce a burst of learned places into one rewrite of the file
+            time.sleep(self.flush_interval_s)
+            self._wake.clear()
+            self.flush()
+
+    def _save(self, payload):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def _cell(self, point):
+        size = max(self.snap_radius_m, 1.0) / _METERS_PER_DEG_LAT
+        return math.floor(point[0] / size), math.floor(point[1] * math.cos(math.radians(point[0])) / size)
+
+    def _add_anchor(self, point):
+        """Caller holds the lock (or is __init__)."""
+        if self._num_anchors < self.max_entries:
+            self._anchors.setdefault(self._cell(point), []).append(point)
+            self._num_anchors += 1
+        return point
+
+    def _nearest_anchor(self, point):
+        """Caller holds the lock. Nearest anchor within snap_radius_m of `point`, or None."""
+        cx, cy = self._cell(point)
+        # Ties go to the smaller anchor, so the result never depends on insertion order
+        nearby = [(distance_m(point, anchor), anchor)
+                  for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                  for anchor in self._anchors.get((cx + dx, cy + dy), ())]
+        best = min((c for c in nearby if c[0] <= self.snap_radius_m), default=None)
+        return best[1] if best else None
+
+    def snap(self, point):
+        """Nearest anchor within snap_radius_m of `point`, else `point` itself (rounded). Read-only."""
+        point = (round(point[0], 6), round(point[1], 6))
+        with self._lock:
+            return self._nearest_anchor(point) or point
+
+    def canonical_place(self, place) -> str:
+        """Key component for one endpoint: snapped "lat,lng" when coordinates are known, else normalized text."""
+        point = parse_latlng(place)
+        if point is None:
+            with self._lock:
+                point = self._geocodes.get(normalize_place(place))
+        if point is None:
+            return normalize_place(place)
+        lat, lng = self.snap(point)
+        return f"{lat:.6f},{lng:.6f}"
+
+    def knows(self, place) -> bool:
+        if parse_latlng(place) is not None:
+            return True
+        with self._lock:
+            return normalize_place(place) in self._geocodes
+
+    def learn(self, place, location: dict):
+        """
+        Remember where a place resolved to (e.g. a Directions leg start/end_location):
+        its coordinates if it is text, and the location as an anchor if none is near it.
+        """
+        if not location:
+            return
+        point = (round(location["lat"], 6), round(location["lng"], 6))
+        changed = False
+        with self._lock:
+            if parse_latlng(place) is None:
+                text = normalize_place(place)
+                if self._geocodes.get(text) != point and len(self._geocodes) < self.max_entries:
+                    self._geocodes[text] = point
+                    self.stats["geocodes_learned"] += 1
+                    changed = True
+            if self._nearest_anchor(point) is None and self._num_anchors < self.max_entries:
+                self._add_anchor(point)
+                changed = True
+            if not changed:
+                return
+            self._dirty = True
+        self._wake.set()
+
+    def cache_key(self, origin, destination, mode, avoid, units) -> str:
+        """MD5 trip cache key over canonicalized endpoints and normalized options."""
+        parts = [
+            self.canonical_place(origin),
+            self.canonical_place(destination),
+            str(mode).lower(),
+            ",".join(sorted(str(a).lower() for a in (avoid or []))),
+            str(units).lower(),
+        ]
+        return hashlib.md5("|".join(parts).encode()).hexdigest()
+
+    def record_lookup(self, hit: bool):
+        with self._lock:
+            self.stats["hits" if hit else "misses"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats,
+                        hit_rate=round(self.stats["hits"] / lookups, 3) if lookups else None,
+                        geocodes=len(self._geocodes),
+                        anchors=self._num_anchors,
+                        pending_write=self._dirty,
+                        snap_radius_m=self.snap_radius_m)
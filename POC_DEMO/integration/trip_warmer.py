@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+trip_warmer.py - Trip request history and a background trip cache warmer
+
+Every /api/generate-trip request is appended to a JSONL history. Periodically the
+warmer counts requests per route over a recent window and, for routes requested
+at least `min_requests` times, regenerates the cached trip before it expires (or
+after it was evicted) - so frequent commutes are served from cache instead of
+making the user wait for a Directions call.
+
+Refreshes are paced to at most `qps` upstream calls per second.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+
+class TripHistoryLog:
+    """Append-only JSONL log of trip requests."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def append(self, entry: dict):
+        line = json.dumps(dict(entry, ts=round(time.time(), 3))) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def read_since(self, since_ts: float) -> list:
+        with self._lock:
+            return self._read_since(since_ts)
+
+    def _read_since(self, since_ts: float) -> list:
+        """Caller holds the lock."""
+        if not self.path.exists():
+            return []
+        entries = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn line from a crash mid-write
+                if entry.get("ts", 0) >= since_ts:
+                    entries.append(entry)
+        return entries
+
+    def compact(self, since_ts: float) -> int:
+        """Drop entries older than `since_ts`. Returns the number kept."""
+        with self._lock:
+            entries = self._read_since(since_ts)
+            fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry) + "\n")
+                os.replace(tmp, self.path)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+                raise
+        return len(entries)
+
+
+class TripCacheWarmer:
+    """
+    Background refresher for frequently requested trips.
+
+    Args:
+        history: TripHistoryLog to read requests from
+        key_fn(entry) -> cache key of the route a history entry asked for
+        expires_in_fn(cache_key) -> seconds until the cached trip expires (<= 0 or None if missing)
+        refresh_fn(entry) -> regenerate and cache the trip (one upstream call)
+        after_pass_fn() -> optional housekeeping after each pass (e.g. pruning precomputed audio)
+    """
+
+    def __init__(self, history: TripHistoryLog, key_fn, expires_in_fn, refresh_fn,
+                 interval_s: float = 600, window_s: float = 14 * 86400, min_requests: int = 3,
+                 max_routes: int = 50, refresh_ahead_s: float = 86400, qps: float = 0.2,
+                 after_pass_fn=None):
+        self.history = history
+        self.key_fn = key_fn
+        self.expires_in_fn = expires_in_fn
+        self.refresh_fn = refresh_fn
+        self.after_pass_fn = after_pass_fn
+        self.interval_s = interval_s
+        self.window_s = window_s
+        self.min_requests = min_requests
+        self.max_routes = max_routes
+        self.refresh_ahead_s = refresh_ahead_s
+        self.min_call_interval_s = 1.0 / qps if qps > 0 else 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_call = 0.0
+        self._stats = {"passes": 0, "refreshed": 0, "failed": 0, "last_pass_at": None, "last_candidates": 0}
+
+    def frequent_routes(self) -> list:
+        """[(count, latest history entry)] for routes requested at least min_requests times, most frequent first."""
+        counts, latest = Counter(), {}
+        for entry in self.history.read_since(time.time() - self.window_s):
+            try:
+                key = self.key_fn(entry)
+            except Exception:
+                continue
+            counts[key] += 1
+            latest[key] = entry
+        return [(count, latest[key]) for key, count in counts.most_common(self.max_routes)
+                if count >= self.min_requests]
+
+    def _pace(self):
+        """Sleep until the next upstream call is allowed. Returns False if stopping."""
+        wait_s = self._last_call + self.min_call_interval_s - time.monotonic()
+        if wait_s > 0 and self._stop.wait(wait_s):
+            return False
+        self._last_call = time.monotonic()
+        return True
+
+    def run_once(self) -> dict:
+        """One warming pass. Returns counts for this pass."""
+        routes = self.frequent_routes()
+        refreshed = failed = 0
+        for count, entry in routes:
+            key = self.key_fn(entry)
+            expires_in = self.expires_in_fn(key)
+            if expires_in is not None and expires_in > self.refresh_ahead_s:
+                continue
+            if not self._pace():
+                break
+            try:
+                self.refresh_fn(entry)
+                refreshed += 1
+                log.info("🔥 Warmed trip %s → %s (%d requests)", entry.get("origin"), entry.get("destination"), count)
+            except Exception as e:
+                failed += 1
+                log.warning("⚠️  Failed to warm trip %s → %s: %s", entry.get("origin"), entry.get("destination"), e)
+
+        self.history.compact(time.time() - self.window_s)
+        if self.after_pass_fn is not None:
+            self.after_pass_fn()
+        self._stats.update(passes=self._stats["passes"] + 1,
+                           refreshed=self._stats["refreshed"] + refreshed,
+                           failed=self._stats["failed"] + failed,
+                           last_pass_at=round(time.time(), 3),
+                           last_candidates=len(routes))
+        return {"candidates": len(routes), "refreshed": refreshed, "failed": failed}
+
+    def start(self):
+        """Start the background warming thread (idempotent)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="trip-warmer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.run_once()
+            except Exception as e:
+                log.warning("⚠️  Trip warmer pass failed: %s", e)
+
+    def snapshot(self) -> dict:
+        return dict(self._stats, min_requests=self.min_requests, qps_limit=(
+            round(1.0 / self.min_call_interval_s, 3) if self.min_call_interval_s else None))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+upload_store.py - Content-addressed storage for uploaded frames
+
+Files are named by the SHA-256 of their bytes, so re-uploading an identical
+frame costs no extra disk. Uploads are streamed to a temp file in chunks and
+hashed on the fly (never fully buffered in memory), then atomically renamed.
+
+A background garbage collector enforces:
+1. TTL - files not written/re-uploaded within `ttl_seconds` are removed
+2. Quota - oldest files are evicted until the total size fits `max_total_bytes`
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+_PARTIAL_PREFIX = ".incoming_"
+
+log = logging.getLogger(__name__)
+
+
+class UploadStore:
+    """Deduplicating upload directory with TTL + total-size garbage collection."""
+
+    def __init__(self, root: Path, ttl_seconds: float = 3600, max_total_bytes: int = 512 * 1024 * 1024,
+                 gc_interval_seconds: float = 60, chunk_size: int = 1024 * 1024):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_total_bytes = max_total_bytes
+        self.gc_interval_seconds = gc_interval_seconds
+        self.chunk_size = chunk_size
+        self._gc_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._gc_thread = None
+
+    def save(self, stream, ext: str = ".jpg"):
+        """
+        Stream `stream` (file-like with .read) into the store.
+
+        Returns:
+            (path, deduplicated) - absolute path of the stored file and whether
+            an identical file already existed.
+        """
+        ext = (ext or ".jpg").lower()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=_PARTIAL_PREFIX, suffix=".part")
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+
+            final_path = self.root / f"{digest.hexdigest()}{ext}"
+            try:
+                # Duplicate frame: refresh the TTL of the original and drop the copy
+                os.utime(final_path)
+            except FileNotFoundError:
+                pass  # new, or collected by GC since it was last seen: store this copy
+            else:
+                os.unlink(tmp_path)
+                return final_path.resolve(), True
+
+            os.replace(tmp_path, final_path)
+            return final_path.resolve(), False
+
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def collect(self) -> dict:
+        """Run one GC pass. Returns counts of removed files and bytes remaining."""
+        with self._gc_lock:
+            now = time.time()
+            removed_expired = 0
+            live = []
+
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    if now - st.st_mtime > self.ttl_seconds:
+                        # Expired (also catches partial uploads abandoned mid-stream)
+                        if self._remove(entry.path):
+                            removed_expired += 1
+                    elif not entry.name.startswith(_PARTIAL_PREFIX):
+                        live.append((st.st_mtime, st.st_size, entry.path))
+
+            # Enforce quota: evict least recently uploaded first
+            total_bytes = sum(size for _, size, _ in live)
+            removed_quota = 0
+            if total_bytes > self.max_total_bytes:
+                live.sort()
+                for _, size, path in live:
+                    if total_bytes <= self.max_total_bytes:
+                        break
+                    if self._remove(path):
+                        total_bytes -= size
+                        removed_quota += 1
+
+            return {
+                "removed_expired": removed_expired,
+                "removed_quota": removed_quota,
+                "total_bytes": total_bytes,
+            }
+
+    def start_gc(self):
+        """Start the background GC thread (idempotent)."""
+        if self._gc_thread is not None and self._gc_thread.is_alive():
+            return
+        self._stop.clear()
+        self._gc_thread = threading.Thread(target=self._gc_loop, name="upload-gc", daemon=True)
+        self._gc_thread.start()
+
+    def stop_gc(self):
+        self._stop.set()
+        if self._gc_thread is not None:
+            self._gc_thread.join(timeout=self.gc_interval_seconds)
+
+    def _gc_loop(self):
+        while not self._stop.is_set():
+            try:
+                stats = self.collect()
+                if stats["removed_expired"] or stats["removed_quota"]:
+                    log.info("🧹 Upload GC: removed %d expired, %d over quota (%.1f MB kept)",
+                             stats["removed_expired"], stats["removed_quota"], stats["total_bytes"] / 1e6)
+            except Exception as e:
+                log.warning("⚠️  Upload GC failed: %s", e)
+            self._stop.wait(self.gc_interval_seconds)
+
+    @staticmethod
+    def _remove(path) -> bool:
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False